@@ -0,0 +1,81 @@
+<?php
+
+namespace App\Console\Commands;
+
+use App\Models\ProcessedImage;
+use Illuminate\Console\Command;
+use Illuminate\Support\Facades\File;
+use Illuminate\Support\Facades\Storage;
+
+class ExportTriageCorpusCommand extends Command
+{
+    protected $signature = 'triage:export {output : Archivo JSON-lines de salida}
+                            {--project= : Solo imágenes de este proyecto}
+                            {--limit=1000 : Número máximo de imágenes}
+                            {--download : Descargar las imágenes junto al corpus en lugar de usar rutas s3://}';
+
+    protected $description = 'Exporta imágenes procesadas con su ai_response_json para evaluar el triaje local (triage_eval.py)';
+
+    public function handle(): int
+    {
+        $output = $this->argument('output');
+        $download = (bool) $this->option('download');
+        $imagesDir = dirname($output) . '/triage_images';
+        $bucket = config('filesystems.disks.wasabi.bucket');
+        $wasabi = Storage::disk('wasabi');
+
+        File::ensureDirectoryExists(dirname($output));
+        if ($download) {
+            File::ensureDirectoryExists($imagesDir);
+        }
+
+        $query = ProcessedImage::with('image.project')
+            ->whereNotNull('ai_response_json')
+            ->where('ai_response_json', '!=', '')
+            ->whereNotNull('corrected_path')
+            ->orderByDesc('id')
+            ->limit((int) $this->option('limit'));
+
+        if ($project = $this->option('project')) {
+            $query->whereHas('image', fn($q) => $q->where('project_id', $project));
+        }
+
+        $handle = fopen($output, 'w');
+        $exported = 0;
+
+        foreach ($query->get() as $processed) {
+            $aiResponse = json_decode($processed->ai_response_json, true);
+            if (!is_array($aiResponse)) {
+                continue;
+            }
+
+            $project = $processed->image?->project;
+            $inputPath = 's3://' . $bucket . '/' . ltrim($processed->corrected_path, '/');
+
+            if ($download) {
+                if (!$wasabi->exists($processed->corrected_path)) {
+                    $this->warn("⚠️ No existe en Wasabi: {$processed->corrected_path}");
+                    continue;
+                }
+                $inputPath = "{$imagesDir}/{$processed->id}_" . basename($processed->corrected_path);
+                File::put($inputPath, $wasabi->get($processed->corrected_path));
+            }
+
+            fwrite($handle, json_encode([
+                'image_id' => $processed->image_id,
+                'input_path' => $inputPath,
+                'ai_response_json' => $aiResponse,
+                'filas' => $project?->cell_count,
+                'columnas' => $project?->column_count,
+            ]) . "\n");
+            $exported++;
+        }
+
+        fclose($handle);
+
+        $this->info("✅ {$exported} imágenes exportadas a {$output}");
+        $this->line("💡 Evalúa con: python storage/app/scripts/triage_eval.py {$output}");
+
+        return Command::SUCCESS;
+    }
+}
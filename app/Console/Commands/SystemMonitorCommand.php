@@ -45,6 +45,9 @@ public function handle()
             // ✅ MÉTRICAS DE PERFORMANCE
             $this->showPerformanceMetrics($hours);
 
+            // ✅ TIEMPOS POR ETAPA DE LOS SCRIPTS DE PROCESAMIENTO
+            $this->showScriptTimings($hours);
+
             // ✅ INFORMACIÓN DETALLADA
             if ($detailed) {
                 $this->showDetailedInfo();
@@ -278,6 +281,94 @@ private function showPerformanceMetrics(int $hours): void
         );
     }
 
+    private function showScriptTimings(int $hours): void
+    {
+        $stats = $this->getScriptTimingStats($hours);
+        if (empty($stats)) {
+            return; // PANEL_TIMINGS desactivado o sin imágenes en el periodo
+        }
+
+        $this->info("\n⏱️ TIEMPOS POR ETAPA DE LOS SCRIPTS (Últimas {$hours}h)");
+        $this->line("──────────────────────────────────────────");
+
+        $rows = [];
+        foreach ($stats as $row) {
+            $rows[] = [
+                $row['script'],
+                $row['stage'],
+                $row['count'],
+                $row['p50_ms'] . 'ms',
+                $row['p95_ms'] . 'ms',
+                $row['p99_ms'] . 'ms',
+                $row['max_peak_rss_mb'] !== null ? $row['max_peak_rss_mb'] . 'MB' : 'N/A',
+            ];
+        }
+
+        $this->table(['Script', 'Etapa', 'Imágenes', 'p50', 'p95', 'p99', 'Pico RSS'], $rows);
+    }
+
+    /**
+     * ✅ Percentiles por script y etapa a partir del JSON-lines que escriben los scripts con --metrics-out
+     */
+    private function getScriptTimingStats(int $hours): array
+    {
+        $path = env('PANEL_METRICS_OUT', storage_path('logs/panel_timings.jsonl'));
+        if (!is_file($path) || str_ends_with($path, '.prom')) {
+            return [];
+        }
+
+        $cutoff = time() - $hours * 3600;
+        $durations = [];
+        $peaks = [];
+
+        $file = new \SplFileObject($path, 'r');
+        while (!$file->eof()) {
+            $record = json_decode(trim((string) $file->fgets()), true);
+            if (!is_array($record) || ($record['ts'] ?? 0) < $cutoff || empty($record['timings'])) {
+                continue;
+            }
+
+            $script = $record['script'] ?? 'desconocido';
+            $stages = $record['timings']['etapas'] ?? [];
+            $stages['total'] = [
+                'ms' => $record['timings']['total_ms'] ?? 0,
+                'peak_rss_mb' => $record['timings']['peak_rss_mb'] ?? null,
+            ];
+
+            foreach ($stages as $stage => $values) {
+                $key = "{$script}|{$stage}";
+                $durations[$key][] = (float) ($values['ms'] ?? 0);
+                if (isset($values['peak_rss_mb'])) {
+                    $peaks[$key] = max($peaks[$key] ?? 0, (float) $values['peak_rss_mb']);
+                }
+            }
+        }
+
+        $stats = [];
+        ksort($durations);
+        foreach ($durations as $key => $values) {
+            sort($values);
+            [$script, $stage] = explode('|', $key, 2);
+            $stats[] = [
+                'script' => $script,
+                'stage' => $stage,
+                'count' => count($values),
+                'p50_ms' => $this->percentile($values, 50),
+                'p95_ms' => $this->percentile($values, 95),
+                'p99_ms' => $this->percentile($values, 99),
+                'max_peak_rss_mb' => $peaks[$key] ?? null,
+            ];
+        }
+
+        return $stats;
+    }
+
+    private function percentile(array $sorted, float $percent): float
+    {
+        $index = (int) ceil($percent / 100 * count($sorted)) - 1;
+        return round($sorted[max(0, min($index, count($sorted) - 1))], 1);
+    }
+
     private function showDetailedInfo(): void
     {
         $this->info("\n🔍 INFORMACIÓN DETALLADA");
@@ -564,6 +655,7 @@ private function exportMetrics(int $hours): void
                     'environment' => app()->environment()
                 ],
                 'performance_stats' => $stats,
+                'script_timings' => $this->getScriptTimingStats($hours),
                 'current_resources' => [
                     'memory_usage' => memory_get_usage(true),
                     'memory_peak' => memory_get_peak_usage(true),
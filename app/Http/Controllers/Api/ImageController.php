@@ -12,6 +12,7 @@
 use App\Models\ProcessedImage;
 use App\Models\Project;
 use App\Services\ImageProcessingService;
+use App\Services\ManualCropService;
 use Illuminate\Http\Request;
 use Illuminate\Support\Facades\File;
 use Illuminate\Support\Facades\Log;
@@ -374,17 +375,30 @@ public function manualCrop(Request $request, Image $image)
             return response()->json(['error' => 'Imagen no encontrada'], 404);
         }
 
+        $filename = 'manual_' . Str::random(8) . '.jpg';
+        $relativeProcessed = "projects/{$image->project_id}/images/processed/{$filename}";
+
+        // ✅ Con el servicio caliente el recorte reutiliza el original ya decodificado en las vistas previas
+        $cropService = app(ManualCropService::class);
+        if ($cropService->available()) {
+            $json = $cropService->commit($image, $data['points'], $relativeProcessed);
+            if (isset($json['error']) || ($json['output_key'] ?? null) !== $relativeProcessed) {
+                Log::error("❌ Recorte manual fallido", ['output' => $json]);
+                return response()->json(['error' => 'Recorte manual fallido', 'output' => $json], 500);
+            }
+
+            return $this->saveManualCrop($image, $relativeProcessed);
+        }
+
         $tempDir = storage_path("app/temp_crop_{$image->id}");
         File::makeDirectory($tempDir, 0755, true);
 
         $tempInput = "$tempDir/input.jpg";
         File::put($tempInput, $wasabiDisk->get($image->original_path));
 
-        $filename = 'manual_' . Str::random(8) . '.jpg';
-        $relativeProcessed = "projects/{$image->project_id}/images/processed/{$filename}";
         $outputPath = "$tempDir/output.jpg";
 
-        $pointsArg = implode(',', array_map(fn($p) => implode('_', $p), $data['points']));
+        $pointsArg = $cropService->pointsArgument($data['points']);
 
         $pythonPath = env('PYTHON_PATH', 'python3');
         $scriptPath = storage_path('app/scripts/manual_crop_transform.py');
@@ -401,6 +415,40 @@ public function manualCrop(Request $request, Image $image)
         $wasabiDisk->put($relativeProcessed, File::get($outputPath));
         File::deleteDirectory($tempDir);
 
+        return $this->saveManualCrop($image, $relativeProcessed);
+    }
+
+    /**
+     * ✅ Vista previa del recorte manual en baja resolución (JPEG en base64), para ajustar las esquinas
+     */
+    public function manualCropPreview(Request $request, Image $image)
+    {
+        $data = $request->validate([
+            'points' => 'required|array|size:4',
+            'points.*' => 'array|size:2',
+            'preview_size' => 'nullable|integer|min:64|max:2048',
+        ]);
+
+        $json = app(ManualCropService::class)->preview($image, $data['points'], $data['preview_size'] ?? null);
+
+        if (isset($json['error'])) {
+            Log::warning("⚠️ Vista previa de recorte fallida", ['image_id' => $image->id, 'error' => $json['error']]);
+            return response()->json(['error' => 'Vista previa fallida', 'output' => $json], 500);
+        }
+
+        return response()->json([
+            'ok' => true,
+            'image' => 'data:image/jpeg;base64,' . $json['image_base64'],
+            'width' => $json['width'],
+            'height' => $json['height'],
+            'preview_width' => $json['preview_width'],
+            'preview_height' => $json['preview_height'],
+            'ms' => $json['ms'] ?? null,
+        ]);
+    }
+
+    private function saveManualCrop(Image $image, string $relativeProcessed)
+    {
         $processed = $image->processedImage ?? new ProcessedImage();
         $processed->corrected_path = $relativeProcessed;
         $image->processedImage()->save($processed);
@@ -155,9 +155,9 @@ public function processAnalyzedZip(Request $request, $analysisId)
                 ], 410);
             }
 
-            // ✅ Verificar que los archivos extraídos existan
-            $extractedPath = $analysis->getExtractedPath();
-            if (!is_dir($extractedPath)) {
+            // ✅ Verificar que los archivos extraídos (o el ZIP sin extraer) existan
+            $extractedPath = $analysis->getImagesSourcePath();
+            if (!$extractedPath) {
                 return response()->json([
                     'error' => 'Los archivos extraídos no están disponibles'
                 ], 410);
@@ -40,6 +40,24 @@ public function handle()
                 throw new \Exception("Archivo ZIP no encontrado: {$zipPath}");
             }
 
+            // ✅ Listar directamente del directorio central del ZIP, sin extraer a disco
+            $imageData = $this->listZipWithoutExtraction($zipPath);
+            if ($imageData !== null) {
+                $analysis->update([
+                    'status' => 'completed',
+                    'progress' => 100,
+                    'total_files' => $imageData['total_files'],
+                    'valid_images' => $imageData['valid_images'],
+                    'images_data' => $imageData['images']
+                ]);
+
+                Log::info("✅ Análisis completado sin extracción", [
+                    'analysis_id' => $this->analysisId,
+                    'valid_images' => $imageData['valid_images']
+                ]);
+                return;
+            }
+
             // ✅ Crear directorio de extracción
             $extractPath = $analysis->getExtractedPath();
             if (!file_exists($extractPath)) {
@@ -88,6 +106,54 @@ public function handle()
         }
     }
 
+    /**
+     * ✅ Lista las imágenes sin extraer (mismos filtros); null si no está disponible o falla
+     *
+     * Con zip_prescan.py cada imagen incluye además ancho, alto, megapíxeles, rotación
+     * y corrupción leídos de las cabeceras; si no existe se usa zip_ingest.py --list.
+     */
+    private function listZipWithoutExtraction(string $zipPath): ?array
+    {
+        $scriptPath = storage_path('app/scripts/zip_prescan.py');
+        $arguments = '';
+        if (!file_exists($scriptPath)) {
+            $scriptPath = storage_path('app/scripts/zip_ingest.py');
+            $arguments = '--list';
+        }
+
+        if (env('ZIP_INGEST', 'stream') !== 'stream' || !file_exists($scriptPath)) {
+            return null;
+        }
+
+        $cmd = sprintf(
+            '"%s" "%s" %s %s 2>/dev/null',
+            env('PYTHON_PATH', '/usr/bin/python3'),
+            $scriptPath,
+            escapeshellarg($zipPath),
+            $arguments
+        );
+
+        $output = [];
+        $returnCode = 0;
+        exec($cmd, $output, $returnCode);
+
+        $data = json_decode(implode("\n", $output), true);
+        if ($returnCode !== 0 || !is_array($data) || !isset($data['images'])) {
+            Log::warning("⚠️ Listado del ZIP sin extracción falló (código: {$returnCode}), extrayendo el ZIP");
+            return null;
+        }
+
+        if (isset($data['prescan'])) {
+            Log::info("🔎 Pre-escaneo de cabeceras", [
+                'analysis_id' => $this->analysisId,
+                'corruptas' => $data['prescan']['corruptas'] ?? 0,
+                'total_megapixeles' => $data['prescan']['total_megapixeles'] ?? 0,
+            ]);
+        }
+
+        return $data;
+    }
+
     private function analyzeImages(string $extractPath): array
     {
         $images = [];
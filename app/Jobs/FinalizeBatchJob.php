@@ -102,6 +102,13 @@ private function checkIfJobsStillRunning(ImageBatch $batch): bool
      */
     private function cleanupTempPath(ImageBatch $batch): void
     {
+        // ✅ Ingesta sin extracción: temp_path es el ZIP del análisis, que elimina ZipAnalysis::cleanup
+        if ($batch->temp_path && File::isFile($batch->temp_path)) {
+            Log::info("🗜️ temp_path es el ZIP original ({$batch->temp_path}); se conserva hasta ZipAnalysis::cleanup");
+            $batch->update(['temp_path' => null]);
+            return;
+        }
+
         if ($batch->temp_path && File::exists($batch->temp_path)) {
             try {
                 File::deleteDirectory($batch->temp_path);
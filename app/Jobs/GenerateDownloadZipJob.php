@@ -6,6 +6,7 @@
 use App\Models\Image;
 use App\Models\Folder;
 use App\Models\DownloadBatch;
+use App\Services\AnalysisOverlayRenderer;
 use Illuminate\Bus\Queueable;
 use Illuminate\Contracts\Queue\ShouldQueue;
 use Illuminate\Foundation\Bus\Dispatchable;
@@ -318,6 +319,26 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
         $tempZipPath = sys_get_temp_dir() . '/' . $zipName;
         Log::info("📁 Creando ZIP temporal: {$tempZipPath}");
 
+        // ✅ CONSTRUCTOR PYTHON: descarga y recompresión en paralelo, JPEG como STORED
+        if ($this->usePythonZipBuilder()) {
+            $summary = $this->buildZipChunkWithPython($project, $images, $type, $foldersCache, $tempZipPath, $zipName);
+
+            if ($summary !== null) {
+                $processedInChunk = count($summary['image_ids'] ?? []);
+                $batch->update(['processed_images' => $totalProcessedSoFar + $processedInChunk]);
+
+                if ($processedInChunk === 0) {
+                    @unlink($tempZipPath);
+                    Log::warning("⚠️ Chunk {$chunkNum} vacío");
+                    return null;
+                }
+
+                return $this->uploadZipChunk($project, $zipName, $tempZipPath, $chunkNum, $processedInChunk, (int) ($summary['entries'] ?? 0));
+            }
+
+            Log::warning("⚠️ Constructor Python falló, usando ZipArchive para chunk {$chunkNum}");
+        }
+
         // ✅ CONFIGURAR ZIP CON COMPRESIÓN ALTA
         $zip = new \ZipArchive;
         $openResult = $zip->open($tempZipPath, \ZipArchive::CREATE | \ZipArchive::OVERWRITE);
@@ -334,6 +355,17 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
         $processedInChunk = 0;
         $imageData = null;
 
+        // ✅ IMÁGENES ANALIZADAS: todo el chunk se dibuja en paralelo con OpenCV antes del bucle
+        $renderedAnalyzed = [];
+        if (in_array($type, ['analyzed', 'all'])) {
+            $overlayDir = sys_get_temp_dir() . '/overlays_' . pathinfo($zipName, PATHINFO_FILENAME);
+            $renderedAnalyzed = (new AnalysisOverlayRenderer())->renderBatch(
+                $images->pluck('processedImage')->filter(),
+                $overlayDir,
+                'zip'
+            );
+        }
+
         foreach ($images as $index => $img) {
             try {
                 // ✅ LIMPIEZA DE MEMORIA CADA 25 IMÁGENES
@@ -414,7 +446,14 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
 
                     // ✅ IMÁGENES ANALIZADAS CON COMPRESIÓN
                     if (in_array($type, ['analyzed', 'all']) && $img->processedImage->ai_response_json) {
-                        $analyzedContent = $this->generateAnalyzedImageContentOptimized($img->processedImage);
+                        $renderedPath = $renderedAnalyzed[$img->processedImage->id] ?? null;
+                        if ($renderedPath) {
+                            $analyzedContent = file_get_contents($renderedPath);
+                            @unlink($renderedPath);
+                            unset($renderedAnalyzed[$img->processedImage->id]);
+                        } else {
+                            $analyzedContent = $this->generateAnalyzedImageContentOptimized($img->processedImage);
+                        }
                         if ($analyzedContent) {
                             $originalExtension = $this->getOriginalExtension($img->original_path);
                             $filename = "{$originalBaseName}_analyzed{$originalExtension}";
@@ -452,6 +491,14 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
             }
         }
 
+        // ✅ Limpiar renderizados no usados
+        foreach ($renderedAnalyzed as $renderedPath) {
+            @unlink($renderedPath);
+        }
+        if (isset($overlayDir) && is_dir($overlayDir)) {
+            @rmdir($overlayDir);
+        }
+
         // ✅ VERIFICAR Y CERRAR ZIP
         if ($processedInChunk === 0) {
             $zip->close();
@@ -474,6 +521,16 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
             throw new \Exception("❌ ZIP temporal no creado: {$tempZipPath}");
         }
 
+        return $this->uploadZipChunk($project, $zipName, $tempZipPath, $chunkNum, $processedInChunk, $numFiles);
+    }
+
+    /**
+     * ✅ SUBIR ZIP TEMPORAL A WASABI Y ELIMINAR LOCAL
+     */
+    private function uploadZipChunk($project, string $zipName, string $tempZipPath, $chunkNum, int $processedInChunk, int $numFiles): string
+    {
+        $wasabi = Storage::disk('wasabi');
+
         $tempSize = filesize($tempZipPath);
         Log::info("📏 ZIP temporal: " . round($tempSize/1024/1024, 1) . "MB con {$numFiles} archivos");
 
@@ -518,6 +575,170 @@ private function generateAndUploadZipChunk($project, $images, $type, $chunkNum,
         }
     }
 
+    private function usePythonZipBuilder(): bool
+    {
+        return env('ZIP_BUILDER', 'python') === 'python'
+            && file_exists(storage_path('app/scripts/build_download_zip.py'));
+    }
+
+    /**
+     * ✅ CONSTRUIR ZIP CON build_download_zip.py: mismo árbol de carpetas, sin pasar las imágenes por PHP
+     *
+     * Devuelve el resumen JSON del script o null si falló (se usa ZipArchive como respaldo).
+     */
+    private function buildZipChunkWithPython($project, $images, $type, $foldersCache, string $tempZipPath, string $zipName): ?array
+    {
+        $wasabi = Storage::disk('wasabi');
+        $root = Str::slug($project->name, '_');
+        $workDir = sys_get_temp_dir() . '/zipbuild_' . pathinfo($zipName, PATHINFO_FILENAME);
+        $urlExpiry = now()->addMinutes((int) env('ZIP_URL_TTL_MINUTES', 180));
+
+        if (!file_exists($workDir)) {
+            mkdir($workDir, 0755, true);
+        }
+
+        try {
+            // ✅ Imágenes analizadas renderizadas en paralelo antes de montar el manifiesto
+            $renderedAnalyzed = [];
+            if (in_array($type, ['analyzed', 'all'])) {
+                $renderedAnalyzed = (new AnalysisOverlayRenderer())->renderBatch(
+                    $images->pluck('processedImage')->filter(),
+                    $workDir,
+                    'zip'
+                );
+            }
+
+            $entries = [];
+            foreach ($images as $img) {
+                $folder = $foldersCache[$img->folder_id] ?? null;
+                if (!$folder) {
+                    Log::warning("⚠️ Folder no encontrado para imagen {$img->id}");
+                    continue;
+                }
+
+                $folderPath = $this->getFolderPathForZipOptimized($folder, $foldersCache);
+                $originalBaseName = $this->getOriginalImageNameOptimized($img);
+                $originalExtension = $this->getOriginalExtension($img->original_path);
+                $processedImage = $img->processedImage;
+
+                if (in_array($type, ['original', 'all']) && $img->original_path) {
+                    $entries[] = [
+                        'name' => "{$root}/{$folderPath}/original/{$originalBaseName}{$originalExtension}",
+                        'url' => $wasabi->temporaryUrl($img->original_path, $urlExpiry),
+                        'image_id' => $img->id,
+                    ];
+                }
+
+                if (!$processedImage || !$processedImage->corrected_path) {
+                    continue;
+                }
+
+                if (in_array($type, ['processed', 'all'])) {
+                    $entries[] = [
+                        'name' => "{$root}/{$folderPath}/processed/{$originalBaseName}_processed{$originalExtension}",
+                        'url' => $wasabi->temporaryUrl($processedImage->corrected_path, $urlExpiry),
+                        'image_id' => $img->id,
+                    ];
+                }
+
+                if (in_array($type, ['analyzed', 'all']) && $processedImage->ai_response_json) {
+                    $analyzedPath = $renderedAnalyzed[$processedImage->id] ?? null;
+
+                    // ✅ Respaldo Imagick para las que el renderizador no produjo
+                    if (!$analyzedPath && ($analyzedContent = $this->generateAnalyzedImageContentOptimized($processedImage))) {
+                        $analyzedPath = "{$workDir}/analyzed_php_{$processedImage->id}.jpg";
+                        file_put_contents($analyzedPath, $analyzedContent);
+                        unset($analyzedContent);
+                    }
+
+                    if ($analyzedPath) {
+                        $entries[] = [
+                            'name' => "{$root}/{$folderPath}/analyzed/{$originalBaseName}_analyzed{$originalExtension}",
+                            'path' => $analyzedPath,
+                            'image_id' => $img->id,
+                        ];
+                    }
+                }
+            }
+
+            if (empty($entries)) {
+                return ['entries' => 0, 'image_ids' => []];
+            }
+
+            $manifestPath = "{$workDir}/manifest.json";
+            $summaryPath = "{$workDir}/summary.json";
+            $stderrPath = "{$workDir}/stderr.log";
+            file_put_contents($manifestPath, json_encode($entries));
+
+            $cmd = sprintf(
+                '"%s" "%s" "%s" "%s"',
+                env('PYTHON_PATH', '/usr/bin/python3'),
+                storage_path('app/scripts/build_download_zip.py'),
+                $manifestPath,
+                $tempZipPath
+            );
+
+            Log::info("🗜️ Construyendo ZIP con Python: " . count($entries) . " entradas");
+
+            $process = proc_open($cmd, [
+                0 => ["pipe", "r"],
+                1 => ["file", $summaryPath, "w"],
+                2 => ["file", $stderrPath, "w"],
+            ], $pipes);
+
+            if (!is_resource($process)) {
+                throw new \Exception("No se pudo iniciar build_download_zip.py");
+            }
+            fclose($pipes[0]);
+
+            // ✅ Espera con límite: el job no tiene timeout y un pool atascado bloquearía el worker de la cola
+            $timeoutSeconds = (int) env('ZIP_BUILD_TIMEOUT_SECONDS', 1800);
+            $start = time();
+            $returnCode = null;
+
+            while (true) {
+                $status = proc_get_status($process);
+                if (!$status['running']) {
+                    $returnCode = $status['exitcode'] >= 0 ? $status['exitcode'] : null;
+                    break;
+                }
+
+                if ((time() - $start) > $timeoutSeconds) {
+                    proc_terminate($process, 9);
+                    proc_close($process);
+                    throw new \Exception("Timeout alcanzado al construir el ZIP (>{$timeoutSeconds}s)");
+                }
+                usleep(200000);
+            }
+            $closeCode = proc_close($process);
+            $returnCode = $returnCode ?? $closeCode;
+
+            $summary = json_decode((string) @file_get_contents($summaryPath), true);
+            if ($returnCode !== 0 || !is_array($summary) || !($summary['success'] ?? false)) {
+                $stderr = substr((string) @file_get_contents($stderrPath), -2000);
+                throw new \Exception("build_download_zip.py falló (código: {$returnCode}) - " . ($summary['error'] ?? $stderr));
+            }
+
+            foreach ($summary['errors'] ?? [] as $error) {
+                Log::warning("⚠️ Entrada omitida del ZIP {$error['name']}: {$error['error']}");
+            }
+
+            Log::info("✅ ZIP Python: {$summary['entries']}/{$summary['total']} entradas en {$summary['seconds']}s");
+            return $summary;
+
+        } catch (\Throwable $e) {
+            Log::warning("⚠️ Error en constructor Python de ZIP: " . $e->getMessage());
+            @unlink($tempZipPath);
+            return null;
+
+        } finally {
+            foreach (glob("{$workDir}/*") ?: [] as $file) {
+                @unlink($file);
+            }
+            @rmdir($workDir);
+        }
+    }
+
     /**
      * ✅ COMPRIMIR IMAGEN SI ES NECESARIO PARA REDUCIR TAMAÑO - VERSIÓN ARREGLADA
      */
@@ -6,6 +6,7 @@
 use App\Models\Project;
 use App\Models\ProcessedImage;
 use App\Models\ReportGeneration;
+use App\Services\AnalysisOverlayRenderer;
 use Barryvdh\DomPDF\Facade\Pdf;
 use Illuminate\Bus\Queueable;
 use Illuminate\Contracts\Queue\ShouldQueue;
@@ -728,15 +729,22 @@ private function preGenerateAnalyzedImages($images, $tempDir, $reportGeneration)
 
         Log::info("🔄 Pre-generando {$images->count()} imágenes analizadas...");
 
+        $renderer = new AnalysisOverlayRenderer();
+
         foreach ($images->chunk($batchSize) as $batch) {
+            // ✅ Todo el lote se dibuja en paralelo con OpenCV; las que fallen usan el camino Imagick
+            $rendered = $renderer->renderBatch($batch->pluck('processedImage')->filter(), $tempDir, 'report');
+
             foreach ($batch as $image) {
                 if (!$image->processedImage) continue;
 
                 try {
-                    $analyzedContent = $this->generateAnalyzedImageContent($image->processedImage);
+                    $analyzedPath = $tempDir . '/analyzed_' . $image->id . '.jpg';
+                    $renderedPath = $rendered[$image->processedImage->id] ?? null;
 
-                    if ($analyzedContent) {
-                        $analyzedPath = $tempDir . '/analyzed_' . $image->id . '.jpg';
+                    if ($renderedPath && rename($renderedPath, $analyzedPath)) {
+                        $analyzedImages[$image->id] = $analyzedPath;
+                    } elseif ($analyzedContent = $this->generateAnalyzedImageContent($image->processedImage)) {
                         file_put_contents($analyzedPath, $analyzedContent);
                         $analyzedImages[$image->id] = $analyzedPath;
                     }
@@ -772,12 +780,18 @@ private function generateAnalyzedImageContent($processedImage): ?string
             }
 
             $wasabi = Storage::disk('wasabi');
-            if (!$wasabi->exists($processedImage->corrected_path)) {
-                return null;
+
+            // ✅ Derivado tamaño informe generado al procesar (más ligero); si no existe, la imagen corregida
+            $sourcePath = $processedImage->report_path ?: $processedImage->corrected_path;
+            if (!$wasabi->exists($sourcePath)) {
+                $sourcePath = $processedImage->corrected_path;
+                if ($sourcePath === $processedImage->report_path || !$wasabi->exists($sourcePath)) {
+                    return null;
+                }
             }
 
-            // ✅ Descargar imagen original
-            $imageContent = $wasabi->get($processedImage->corrected_path);
+            // ✅ Descargar imagen
+            $imageContent = $wasabi->get($sourcePath);
 
             // ✅ Procesar con Intervention Image
             $manager = new ImageManager(new ImagickDriver());
@@ -91,6 +91,12 @@ private function prepareExtractionPath(): string
             return $this->extractedPath;
         }
 
+        // ZIP analizado sin extraer: cada job lee su miembro directamente del ZIP
+        if ($this->extractedPath && is_file($this->extractedPath)) {
+            Log::info("🗜️ Leyendo imágenes directamente del ZIP: {$this->extractedPath}");
+            return $this->extractedPath;
+        }
+
         // Si no, extraer el ZIP
         if (!$this->zipPath || !file_exists($this->zipPath)) {
             throw new \Exception("No se proporcionó ZIP path válido y no hay archivos extraídos");
@@ -177,6 +177,11 @@ private function validateAssignment(): array
      */
     private function findExtractedFile(string $nombreImagen): ?string
     {
+        // ✅ ZIP sin extraer: se devuelve una ruta zip:// al miembro (se lee en streaming al subir)
+        if (is_file($this->tempPath)) {
+            return $this->findZipMember($nombreImagen);
+        }
+
         if (!is_dir($this->tempPath)) {
             Log::error("❌ Directorio temporal no existe: {$this->tempPath}");
             return null;
@@ -225,6 +230,75 @@ private function findExtractedFile(string $nombreImagen): ?string
         return null;
     }
 
+    /**
+     * ✅ BÚSQUEDA DEL MIEMBRO EN EL DIRECTORIO CENTRAL DEL ZIP (sin extraer)
+     */
+    private function findZipMember(string $nombreImagen): ?string
+    {
+        $zip = new \ZipArchive;
+        if ($zip->open($this->tempPath) !== true) {
+            Log::error("❌ No se pudo abrir el ZIP: {$this->tempPath}");
+            return null;
+        }
+
+        $match = null;
+        $fallback = null;
+
+        // ✅ Coincidencia exacta vía índice de nombres de libzip (sin recorrer el directorio central)
+        $index = $zip->locateName($nombreImagen, \ZipArchive::FL_NOCASE | \ZipArchive::FL_NODIR);
+        if ($index !== false && $this->isUsableZipEntry($zip->statIndex($index))) {
+            $match = $zip->getNameIndex($index);
+        }
+
+        // ✅ Recorrido completo solo si hace falta la alternativa por nombre sin extensión
+        $nameWithoutExt = strtolower(pathinfo($nombreImagen, PATHINFO_FILENAME));
+
+        for ($i = 0; $match === null && $i < $zip->numFiles; $i++) {
+            $stat = $zip->statIndex($i);
+            if (!$this->isUsableZipEntry($stat)) {
+                continue;
+            }
+            $entryName = $stat['name'];
+            $filename = basename(str_replace('\\', '/', $entryName));
+
+            // ✅ COMPARACIÓN CASE-INSENSITIVE (y por nombre base como alternativa)
+            if (strtolower($filename) === strtolower($nombreImagen)) {
+                $match = $entryName;
+                break;
+            }
+            if ($fallback === null && strtolower(pathinfo($filename, PATHINFO_FILENAME)) === $nameWithoutExt) {
+                $fallback = $entryName;
+            }
+        }
+
+        $zip->close();
+
+        $entryName = $match ?? $fallback;
+        if ($entryName === null) {
+            Log::warning("⚠️ Archivo no encontrado: {$nombreImagen} en {$this->tempPath}");
+            return null;
+        }
+
+        Log::debug("✅ Miembro encontrado en ZIP: {$entryName}");
+        return 'zip://' . $this->tempPath . '#' . $entryName;
+    }
+
+    /**
+     * ✅ Mismos filtros que el recorrido: sin directorios, vacíos, ocultos ni __MACOSX
+     */
+    private function isUsableZipEntry(array|false $stat): bool
+    {
+        if ($stat === false) {
+            return false;
+        }
+
+        $entryName = $stat['name'] ?? '';
+        $filename = basename(str_replace('\\', '/', $entryName));
+
+        return $stat['size'] !== 0 && !str_ends_with($entryName, '/') && !str_starts_with($filename, '.') &&
+            !str_contains(strtolower($entryName), '__macosx');
+    }
+
     /**
      * ✅ BÚSQUEDA OPTIMIZADA DE FOLDER CON CACHE
      */
@@ -19,11 +19,15 @@ class ImageAnalysisResult extends Model
         'finger_interruptions_count',
         'black_edges_count',
         'cells_with_different_intensity',
+        'cell_stats',
+        'triage',
         'ai_response_json',
     ];
 
     protected $casts = [
         'ai_response_json' => 'array',
+        'cell_stats' => 'array',
+        'triage' => 'array',
     ];
 
     public function image()
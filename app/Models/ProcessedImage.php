@@ -22,6 +22,8 @@ class ProcessedImage extends Model
         'public_view_enabled',
         'thumb_path',
         'thumb_url',
+        'report_path',
+        'preview_path',
     ];
 
     protected $casts = [
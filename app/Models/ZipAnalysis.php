@@ -77,6 +77,20 @@ public function getExtractedPath(): string
         return storage_path("app/temp_extract_{$this->id}");
     }
 
+    /**
+     * ✅ Origen de las imágenes: carpeta extraída o, si el análisis no extrajo, el propio ZIP
+     */
+    public function getImagesSourcePath(): ?string
+    {
+        $extractPath = $this->getExtractedPath();
+        if (is_dir($extractPath)) {
+            return $extractPath;
+        }
+
+        $zipPath = $this->file_path ? storage_path("app/{$this->file_path}") : null;
+        return $zipPath && is_file($zipPath) ? $zipPath : null;
+    }
+
     /**
      * ✅ Limpiar archivos al eliminar
      */
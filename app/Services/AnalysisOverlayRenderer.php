@@ -0,0 +1,163 @@
+<?php
+
+namespace App\Services;
+
+use App\Models\ProcessedImage;
+use Illuminate\Support\Facades\Log;
+use Illuminate\Support\Facades\Storage;
+
+class AnalysisOverlayRenderer
+{
+    /**
+     * ✅ Renderiza en lote las imágenes analizadas (cajas + etiquetas) con el pool de procesos Python
+     *
+     * @param iterable<ProcessedImage> $processedImages
+     * @param string $style 'zip' (GenerateDownloadZipJob) o 'report' (GenerateReportJob)
+     * @return array<int, string> id de ProcessedImage => ruta local del JPEG analizado
+     */
+    public function renderBatch(iterable $processedImages, string $workDir, string $style = 'zip'): array
+    {
+        $pythonPath = env('PYTHON_PATH', '/usr/bin/python3');
+        $scriptPath = storage_path('app/scripts/render_analysis_overlay.py');
+
+        if (!file_exists($scriptPath)) {
+            Log::warning("⚠️ Renderizador de análisis no encontrado: {$scriptPath}");
+            return [];
+        }
+
+        if (!file_exists($workDir)) {
+            mkdir($workDir, 0755, true);
+        }
+
+        $wasabi = Storage::disk('wasabi');
+        $entries = [];
+        $sources = [];
+
+        foreach ($processedImages as $processedImage) {
+            if (!$processedImage || !$processedImage->ai_response_json) {
+                continue;
+            }
+
+            $predictions = $this->predictionsFor($processedImage);
+            if (!$predictions) {
+                continue;
+            }
+
+            // ✅ El informe usa el derivado tamaño informe si existe
+            $sourcePath = $style === 'report' && $processedImage->report_path
+                ? $processedImage->report_path
+                : $processedImage->corrected_path;
+
+            try {
+                $content = $sourcePath ? $wasabi->get($sourcePath) : null;
+            } catch (\Throwable $e) {
+                $content = null;
+            }
+
+            if (!$content) {
+                Log::warning("⚠️ Imagen procesada no encontrada para análisis: {$sourcePath}");
+                continue;
+            }
+
+            $localSource = "{$workDir}/overlay_src_{$processedImage->id}.jpg";
+            file_put_contents($localSource, $content);
+            unset($content);
+
+            $sources[] = $localSource;
+            $entries[] = [
+                'id' => $processedImage->id,
+                'input_path' => $localSource,
+                'output_path' => "{$workDir}/overlay_{$processedImage->id}.jpg",
+                'predictions' => $predictions,
+            ];
+        }
+
+        if (empty($entries)) {
+            return [];
+        }
+
+        $manifestPath = "{$workDir}/overlay_manifest_" . uniqid() . '.json';
+        $resultsPath = $manifestPath . '.out';
+        $stderrPath = $manifestPath . '.err';
+        file_put_contents($manifestPath, json_encode($entries));
+
+        $cmd = sprintf(
+            '"%s" "%s" --batch "%s" --style %s',
+            $pythonPath,
+            $scriptPath,
+            $manifestPath,
+            escapeshellarg($style)
+        );
+
+        // ✅ stdout/stderr a archivo: una línea por imagen, sin riesgo de llenar el pipe
+        $descriptorspec = [
+            0 => ["pipe", "r"],
+            1 => ["file", $resultsPath, "w"],
+            2 => ["file", $stderrPath, "w"],
+        ];
+
+        $rendered = [];
+
+        try {
+            $process = proc_open($cmd, $descriptorspec, $pipes);
+            if (!is_resource($process)) {
+                throw new \Exception("No se pudo iniciar el renderizador");
+            }
+            fclose($pipes[0]);
+
+            $timeoutSeconds = env('OVERLAY_TIMEOUT_SECONDS', 600);
+            $start = time();
+
+            while (true) {
+                $status = proc_get_status($process);
+                if (!$status['running']) break;
+
+                if ((time() - $start) > $timeoutSeconds) {
+                    proc_terminate($process, 9);
+                    throw new \Exception("Timeout alcanzado al renderizar análisis (>{$timeoutSeconds}s)");
+                }
+                usleep(200000);
+            }
+            proc_close($process);
+
+            foreach (file($resultsPath, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES) ?: [] as $line) {
+                $result = json_decode($line, true);
+                if (!is_array($result) || !isset($result['id'])) {
+                    continue;
+                }
+
+                if (($result['success'] ?? false) && file_exists($result['output_path'] ?? '')) {
+                    $rendered[$result['id']] = $result['output_path'];
+                } else {
+                    Log::warning("⚠️ Renderizado fallido para imagen procesada {$result['id']}: " . ($result['error'] ?? 'desconocido'));
+                }
+            }
+
+            Log::info("🎨 Imágenes analizadas renderizadas: " . count($rendered) . "/" . count($entries));
+
+        } catch (\Throwable $e) {
+            $stderr = file_exists($stderrPath) ? substr((string) file_get_contents($stderrPath), -2000) : '';
+            Log::warning("⚠️ Renderizador de análisis falló: " . $e->getMessage() . " - STDERR: {$stderr}");
+        } finally {
+            foreach ($sources as $source) {
+                @unlink($source);
+            }
+            @unlink($manifestPath);
+            @unlink($resultsPath);
+            @unlink($stderrPath);
+        }
+
+        return $rendered;
+    }
+
+    /**
+     * ✅ Predicciones a dibujar: las ediciones manuales tienen prioridad sobre la respuesta de la IA
+     */
+    private function predictionsFor(ProcessedImage $processedImage): ?array
+    {
+        $raw = $processedImage->error_edits_json ?: $processedImage->ai_response_json;
+        $parsed = is_array($raw) ? $raw : json_decode($raw, true);
+
+        return is_array($parsed) ? $parsed : null;
+    }
+}
@@ -12,6 +12,21 @@
 
 class ImageProcessingService
 {
+    /**
+     * ✅ true cuando el último script YOLO se ejecutó con --cascade (ya probó las estrategias clásicas)
+     */
+    private bool $cascadeRan = false;
+
+    /**
+     * ✅ Código de rechazo temprano (panel_gate.py) de la última ejecución de YOLO, si lo hubo
+     */
+    private ?string $rejectCode = null;
+
+    /**
+     * ✅ Bytes de stderr del script que se conservan (los últimos) para logs y excepciones
+     */
+    private const STDERR_TAIL_BYTES = 16384;
+
     private function handleBatchError(?int $batchId, string $msg): void
     {
         if (!$batchId) return;
@@ -56,6 +71,17 @@ public function process(Image $image, $batchId = null): Image | null
             return $result;
         }
 
+        // ✅ Imagen inutilizable (negra, sobreexpuesta, truncada...): el fallback fallaría igual
+        if ($this->rejectCode) {
+            return $result;
+        }
+
+        // ✅ Con la cascada el script ya aplicó las estrategias clásicas sobre la misma descarga
+        if ($this->cascadeRan) {
+            Log::error("❌ YOLO y estrategias clásicas (cascada) fallaron para imagen {$image->id}");
+            return null;
+        }
+
         // ✅ ESTRATEGIA 2: Fallback al método mejorado
         Log::warning("⚠️ YOLO falló, usando fallback mejorado para imagen {$image->id}");
         return $this->processWithImprovedFallback($image, $batchId);
@@ -66,6 +92,9 @@ public function process(Image $image, $batchId = null): Image | null
      */
     private function processWithYolo(Image $image, $batchId = null): Image | null
     {
+        $this->cascadeRan = false;
+        $this->rejectCode = null;
+
         try {
             // ✅ CONFIGURACIÓN YOLO
             $pythonPath = env('PYTHON_PATH', '/usr/bin/python3');
@@ -105,24 +134,35 @@ private function processWithYolo(Image $image, $batchId = null): Image | null
             $outputTemp = $tmpDir . '/' . $filename;
             $wasabiProcessedPath = "projects/{$image->project_id}/images/processed/{$filename}";
 
-            // ✅ Descargar imagen desde Wasabi
             $wasabiDisk = Storage::disk('wasabi');
-            $stream = $wasabiDisk->readStream($image->original_path);
-            if (!$stream) {
-                throw new \Exception('No se pudo abrir el stream desde Wasabi');
-            }
+            $directS3 = $this->directS3Enabled();
+
+            if ($directS3) {
+                // ✅ El script lee el original y sube la procesada y los derivados directamente al bucket
+                $inputArg = $this->s3Uri($image->original_path);
+                $outputArg = $this->s3Uri($wasabiProcessedPath);
+            } else {
+                // ✅ Descargar imagen desde Wasabi
+                $stream = $wasabiDisk->readStream($image->original_path);
+                if (!$stream) {
+                    throw new \Exception('No se pudo abrir el stream desde Wasabi');
+                }
 
-            $local = fopen($originalTemp, 'w+b');
-            if (!$local) {
-                throw new \Exception("No se pudo crear archivo local: $originalTemp");
-            }
+                $local = fopen($originalTemp, 'w+b');
+                if (!$local) {
+                    throw new \Exception("No se pudo crear archivo local: $originalTemp");
+                }
 
-            stream_copy_to_stream($stream, $local);
-            fclose($stream);
-            fclose($local);
+                stream_copy_to_stream($stream, $local);
+                fclose($stream);
+                fclose($local);
 
-            if (!file_exists($originalTemp) || filesize($originalTemp) === 0) {
-                throw new \Exception("Archivo descargado está vacío o no existe");
+                if (!file_exists($originalTemp) || filesize($originalTemp) === 0) {
+                    throw new \Exception("Archivo descargado está vacío o no existe");
+                }
+
+                $inputArg = $originalTemp;
+                $outputArg = $outputTemp;
             }
 
             // ✅ EJECUTAR SCRIPT YOLO
@@ -130,69 +170,84 @@ private function processWithYolo(Image $image, $batchId = null): Image | null
                 '"%s" "%s" "%s" "%s" "%s" --filas %d --columnas %d --confidence %.2f',
                 $pythonPath,
                 $scriptPath,
-                $originalTemp,
-                $outputTemp,
+                $inputArg,
+                $outputArg,
                 $modelPath,
                 $filas,
                 $columnas,
                 $confidence
             );
 
-            $timeoutSeconds = env('YOLO_TIMEOUT_SECONDS', 120);
-            $descriptorspec = [
-                0 => ["pipe", "r"],
-                1 => ["pipe", "w"],
-                2 => ["pipe", "w"]
-            ];
+            if ($this->cascadeEnabled()) {
+                $cmd .= ' --cascade';
+            }
 
-            $process = proc_open($cmd, $descriptorspec, $pipes);
-            $start = time();
+            $cmd .= $this->derivativesArgument();
+            $cmd .= $this->cacheArgument();
+            $cmd .= $this->timingsArgument();
+            $cmd .= $this->diagnosticsArgument();
+
+            $timeoutSeconds = (int) env('YOLO_TIMEOUT_SECONDS', 120);
+            [$stdout, $stderr, $returnCode] = $this->runScript(
+                $cmd,
+                $timeoutSeconds,
+                $directS3 ? $this->s3Environment() : null,
+                "Timeout alcanzado al ejecutar YOLO (>{$timeoutSeconds}s)"
+            );
 
-            while (is_resource($process)) {
-                $status = proc_get_status($process);
-                if (!$status['running']) break;
+            // ✅ Rechazo temprano: el script descartó la imagen antes de cargar el modelo
+            $jsonData = $this->extractJsonFromOutput($stdout);
 
-                if ((time() - $start) > $timeoutSeconds) {
-                    proc_terminate($process, 9);
-                    throw new \Exception("Timeout alcanzado al ejecutar YOLO (>{$timeoutSeconds}s)");
-                }
-                usleep(200000);
+            // ✅ Solo se omite el fallback externo si el JSON confirma que la cascada se ejecutó
+            // (si el script murió antes: import, timeout, crash... se usa el fallback de siempre)
+            $this->cascadeRan = $this->cascadeEnabled() && is_array($jsonData)
+                && (($jsonData['method'] ?? null) === 'improved_fallback' || !empty($jsonData['cascade_ran']));
+            if (isset($jsonData['reject_code'])) {
+                $this->rejectCode = $jsonData['reject_code'];
+                $msg = "Imagen {$image->id} rechazada ({$this->rejectCode}): " . ($jsonData['gate']['motivo'] ?? $jsonData['error'] ?? '');
+                Log::warning("🚫 " . $msg);
+                if (isset($originalTemp)) @unlink($originalTemp);
+                if (isset($outputTemp)) @unlink($outputTemp);
+                $image->update(['status' => 'error']);
+                $this->handleBatchError($batchId, $msg);
+                return $image;
             }
 
-            fclose($pipes[0]);
-            $stdout = stream_get_contents($pipes[1]);
-            $stderr = stream_get_contents($pipes[2]);
-            fclose($pipes[1]);
-            fclose($pipes[2]);
-            $returnCode = proc_close($process);
-
             if ($returnCode !== 0) {
                 throw new \Exception("Script YOLO falló (código: {$returnCode}) - STDERR: {$stderr}");
             }
 
-            if (!file_exists($outputTemp) || filesize($outputTemp) === 0) {
-                throw new \Exception("Script YOLO no generó output válido");
-            }
+            if (!$directS3) {
+                if (!file_exists($outputTemp) || filesize($outputTemp) === 0) {
+                    throw new \Exception("Script YOLO no generó output válido");
+                }
 
-            // ✅ Subir imagen procesada
-            $wasabiDisk->put($wasabiProcessedPath, file_get_contents($outputTemp));
+                // ✅ Subir imagen procesada
+                $wasabiDisk->put($wasabiProcessedPath, file_get_contents($outputTemp));
 
-            // ✅ Cleanup
-            @unlink($originalTemp);
-            @unlink($outputTemp);
+                // ✅ Cleanup
+                @unlink($originalTemp);
+                @unlink($outputTemp);
+            }
 
-            // ✅ PARSEAR JSON
-            $jsonData = $this->extractJsonFromOutput($stdout);
+            // ✅ JSON ya parseado tras la ejecución
+            $this->logTimings('YOLO', $image->id, $jsonData);
             if (!$jsonData || !($jsonData['success'] ?? false)) {
                 throw new \Exception("YOLO reportó fallo: " . ($jsonData['error'] ?? 'Error desconocido'));
             }
 
+            if ($directS3 && ($jsonData['output_key'] ?? null) !== $wasabiProcessedPath) {
+                throw new \Exception("Script YOLO no subió la imagen procesada a {$wasabiProcessedPath}");
+            }
+
             // ✅ Guardar en BD
             $processed = $image->processedImage ?? new ProcessedImage();
             $processed->corrected_path = $wasabiProcessedPath;
             $image->processedImage()->save($processed);
 
-            $this->generateThumbnail($processed, $wasabiProcessedPath);
+            if (!$this->storeDerivatives($processed, $jsonData, $wasabiProcessedPath)) {
+                $this->generateThumbnail($processed, $wasabiProcessedPath);
+            }
 
             $analysis = $image->analysisResult ?? new ImageAnalysisResult();
             $analysis->fill([
@@ -201,27 +256,286 @@ private function processWithYolo(Image $image, $batchId = null): Image | null
                 'integrity_score' => $jsonData['integridad'] ?? null,
                 'luminosity_score' => $jsonData['luminosidad'] ?? null,
                 'uniformity_score' => $jsonData['uniformidad'] ?? null,
+                'cell_stats' => $jsonData['celdas'] ?? null,
+                'triage' => $jsonData['triage'] ?? null,
                 'detection_confidence' => $jsonData['confidence'] ?? null,
-                'processing_method' => 'yolo_segmentation',
-                'algorithm_version' => 'yolo_v8_segmentation',
+                'processing_method' => $jsonData['method'] ?? 'yolo_segmentation',
+                'algorithm_version' => $jsonData['algorithm_version'] ?? 'yolo_v8_segmentation',
             ]);
             $image->analysisResult()->save($analysis);
 
             $image->update(['status' => 'processed']);
             $image->load(['processedImage', 'analysisResult']);
 
-            Log::info("✅ YOLO exitoso para imagen {$image->id}");
+            Log::info("✅ Procesamiento exitoso para imagen {$image->id} (estrategia: " . ($jsonData['estrategia'] ?? 'yolo') . ")");
             return $image;
 
         } catch (\Throwable $e) {
             Log::warning("⚠️ YOLO falló para imagen {$image->id}: " . $e->getMessage());
             // ✅ Limpiar archivos temporales en caso de error
             if (isset($originalTemp)) @unlink($originalTemp);
-            if (isset($outputTemp)) @unlink($outputTemp);
+            if (isset($outputTemp)) {
+                @unlink($outputTemp);
+                $this->cleanupDerivatives($outputTemp);
+            }
             return null; // ✅ Retornar null para activar fallback
         }
     }
 
+    /**
+     * ✅ Ejecuta un script leyendo stdout/stderr mientras corre: el hijo nunca se bloquea
+     * con la tubería llena (64 KB) esperando a que PHP lea después de que termine
+     *
+     * @return array{0: string, 1: string, 2: int} [stdout, últimos bytes de stderr, código de salida]
+     */
+    private function runScript(string $cmd, int $timeoutSeconds, ?array $env, string $timeoutMessage): array
+    {
+        $descriptorspec = [
+            0 => ["pipe", "r"],
+            1 => ["pipe", "w"],
+            2 => ["pipe", "w"]
+        ];
+
+        $process = proc_open($cmd, $descriptorspec, $pipes, null, $env);
+        if (!is_resource($process)) {
+            throw new \Exception("No se pudo iniciar el proceso: {$cmd}");
+        }
+
+        fclose($pipes[0]);
+        stream_set_blocking($pipes[1], false);
+        stream_set_blocking($pipes[2], false);
+
+        $stdout = '';
+        $stderr = '';
+        $exitCode = null;
+        $start = time();
+
+        while (true) {
+            $read = [$pipes[1], $pipes[2]];
+            $write = null;
+            $except = null;
+            if (stream_select($read, $write, $except, 0, 200000) > 0) {
+                $bytes = 0;
+                foreach ($read as $pipe) {
+                    $chunk = (string) fread($pipe, 65536);
+                    $bytes += strlen($chunk);
+                    if ($pipe === $pipes[1]) {
+                        $stdout .= $chunk;
+                    } else {
+                        $stderr = substr($stderr . $chunk, -self::STDERR_TAIL_BYTES);
+                    }
+                }
+                if ($bytes === 0) {
+                    usleep(50000); // tuberías en EOF: el proceso está terminando
+                }
+            }
+
+            $status = proc_get_status($process);
+            if (!$status['running']) {
+                // ✅ El código solo es fiable en la primera lectura tras terminar; proc_close puede devolver -1
+                $exitCode = $status['exitcode'] >= 0 ? $status['exitcode'] : null;
+                break;
+            }
+
+            if ((time() - $start) > $timeoutSeconds) {
+                proc_terminate($process, 9);
+                fclose($pipes[1]);
+                fclose($pipes[2]);
+                proc_close($process);
+                throw new \Exception($timeoutMessage);
+            }
+        }
+
+        stream_set_blocking($pipes[1], true);
+        stream_set_blocking($pipes[2], true);
+        $stdout .= stream_get_contents($pipes[1]);
+        $stderr = substr($stderr . stream_get_contents($pipes[2]), -self::STDERR_TAIL_BYTES);
+        fclose($pipes[1]);
+        fclose($pipes[2]);
+        $closeCode = proc_close($process);
+
+        return [$stdout, $stderr, $exitCode ?? $closeCode];
+    }
+
+    /**
+     * ✅ Modo diagnóstico de los scripts (opt-in): detalle al log, a stderr solo avisos y errores acotados.
+     * El log se comparte entre workers y se rota fuera (logrotate); los scripts lo reabren al rotar.
+     */
+    private function diagnosticsArgument(): string
+    {
+        if (!filter_var(env('PANEL_DIAGNOSTICS', false), FILTER_VALIDATE_BOOLEAN)) {
+            return '';
+        }
+
+        return sprintf(
+            ' --log-level %s --log-file %s',
+            escapeshellarg(env('PANEL_LOG_LEVEL', 'info')),
+            escapeshellarg(env('PANEL_LOG_FILE', storage_path('logs/panel_scripts.log')))
+        );
+    }
+
+    /**
+     * ✅ Cascada en un solo proceso: YOLO -> contorno EL -> recorte directo
+     */
+    private function cascadeEnabled(): bool
+    {
+        return filter_var(env('YOLO_CASCADE', false), FILTER_VALIDATE_BOOLEAN);
+    }
+
+    /**
+     * ✅ Derivados generados por el script desde la imagen en memoria (opt-in: thumb, report, webp).
+     * Sin ellos se mantiene generateThumbnail como hasta ahora.
+     */
+    private function derivativesArgument(): string
+    {
+        $derivatives = env('PANEL_DERIVATIVES', '');
+        return $derivatives ? ' --derivatives ' . escapeshellarg($derivatives) : '';
+    }
+
+    /**
+     * ✅ Caché de resultados por contenido (opt-in, ocupa hasta PANEL_CACHE_MAX_MB en disco):
+     * re-subidas y relanzamientos no vuelven a ejecutar el pipeline
+     */
+    private function cacheArgument(): string
+    {
+        if (!filter_var(env('PANEL_CACHE', false), FILTER_VALIDATE_BOOLEAN)) {
+            return '';
+        }
+
+        return sprintf(
+            ' --cache-dir %s --cache-max-mb %d',
+            escapeshellarg(env('PANEL_CACHE_DIR', storage_path('app/panel_cache'))),
+            (int) env('PANEL_CACHE_MAX_MB', 2048)
+        );
+    }
+
+    /**
+     * ✅ Tiempos y pico de RSS por etapa en el JSON del script, volcados a un log que agrega system:monitor
+     */
+    private function timingsArgument(): string
+    {
+        if (!filter_var(env('PANEL_TIMINGS', false), FILTER_VALIDATE_BOOLEAN)) {
+            return '';
+        }
+
+        return ' --timings --metrics-out ' . escapeshellarg(env('PANEL_METRICS_OUT', storage_path('logs/panel_timings.jsonl')));
+    }
+
+    private function logTimings(string $method, int $imageId, ?array $jsonData): void
+    {
+        $timings = $jsonData['timings'] ?? null;
+        if (!$timings) {
+            return;
+        }
+
+        $stages = collect($timings['etapas'] ?? [])
+            ->map(fn ($stage, $name) => "{$name}=" . round($stage['ms'] ?? 0) . 'ms')
+            ->implode(' ');
+
+        Log::info("⏱️ Tiempos {$method} imagen {$imageId}: total=" . round($timings['total_ms'] ?? 0) . "ms "
+            . "pico RSS=" . ($timings['peak_rss_mb'] ?? '?') . "MB {$stages}");
+    }
+
+    /**
+     * ✅ E/S directa contra el bucket: sin descarga a disco en PHP ni subida posterior
+     */
+    private function directS3Enabled(): bool
+    {
+        return filter_var(env('PANEL_DIRECT_S3', false), FILTER_VALIDATE_BOOLEAN);
+    }
+
+    private function s3Uri(string $key): string
+    {
+        return 's3://' . config('filesystems.disks.wasabi.bucket') . '/' . ltrim($key, '/');
+    }
+
+    /**
+     * ✅ Credenciales del disco wasabi para panel_s3.py (mismos nombres de variable que el .env)
+     */
+    private function s3Environment(): array
+    {
+        $disk = config('filesystems.disks.wasabi');
+
+        return array_merge(getenv(), array_filter([
+            'WASABI_KEY' => $disk['key'] ?? null,
+            'WASABI_SECRET' => $disk['secret'] ?? null,
+            'WASABI_REGION' => $disk['region'] ?? null,
+            'WASABI_BUCKET' => $disk['bucket'] ?? null,
+            'WASABI_ENDPOINT' => $disk['endpoint'] ?? null,
+        ]));
+    }
+
+    /**
+     * ✅ Sube los derivados listados en el JSON del script; devuelve true si incluía la miniatura
+     * (los que traen "key" ya los subió el script en modo PANEL_DIRECT_S3)
+     */
+    private function storeDerivatives(ProcessedImage $processed, array $jsonData, string $processedPath): bool
+    {
+        $disk = Storage::disk('wasabi');
+        $baseDir = dirname(dirname($processedPath));
+        $name = pathinfo($processedPath, PATHINFO_FILENAME);
+        $hasThumb = false;
+
+        foreach ($jsonData['derivados'] ?? [] as $derivative) {
+            $localPath = $derivative['path'] ?? null;
+            $uploaded = !empty($derivative['key']);
+            if (!$uploaded && (!$localPath || !file_exists($localPath) || filesize($localPath) === 0)) {
+                continue;
+            }
+
+            try {
+                switch ($derivative['tipo'] ?? null) {
+                    case 'thumb':
+                        // ✅ Misma ruta que generateThumbnail para no romper a los consumidores actuales
+                        $thumbPath = 'thumbnails/480_' . basename($processedPath);
+                        if (!$uploaded) {
+                            $disk->put($thumbPath, file_get_contents($localPath));
+                        }
+                        $processed->thumb_path = $thumbPath;
+                        $processed->thumb_url = $disk->url($thumbPath);
+                        $hasThumb = true;
+                        break;
+
+                    case 'report':
+                        $reportPath = "{$baseDir}/report/{$name}.jpg";
+                        if (!$uploaded) {
+                            $disk->put($reportPath, file_get_contents($localPath));
+                        }
+                        $processed->report_path = $reportPath;
+                        break;
+
+                    case 'webp':
+                        $previewPath = "{$baseDir}/preview/{$name}.webp";
+                        if (!$uploaded) {
+                            $disk->put($previewPath, file_get_contents($localPath));
+                        }
+                        $processed->preview_path = $previewPath;
+                        break;
+                }
+            } catch (\Throwable $e) {
+                Log::warning("Error subiendo derivado {$localPath}: " . $e->getMessage());
+            } finally {
+                if ($localPath) {
+                    @unlink($localPath);
+                }
+            }
+        }
+
+        if ($processed->isDirty()) {
+            $processed->save();
+        }
+
+        return $hasThumb;
+    }
+
+    private function cleanupDerivatives(string $outputPath): void
+    {
+        $pattern = preg_replace('/\.[^.\/]+$/', '', $outputPath) . '_*';
+        foreach (glob($pattern) ?: [] as $file) {
+            @unlink($file);
+        }
+    }
+
     private function generateThumbnail(ProcessedImage $processed, string $sourcePath): void
     {
         try {
@@ -311,36 +625,20 @@ private function processWithImprovedFallback(Image $image, $batchId = null): Ima
                 $filas,
                 $columnas
             );
+            $cmd .= $this->derivativesArgument();
+            $cmd .= $this->cacheArgument();
+            $cmd .= $this->timingsArgument();
+            $cmd .= $this->diagnosticsArgument();
 
             Log::debug("🔧 Ejecutando comando mejorado: {$cmd}");
 
-            $descriptorspec = [
-                0 => ["pipe", "r"],  // stdin
-                1 => ["pipe", "w"],  // stdout
-                2 => ["pipe", "w"]   // stderr
-            ];
-
-            $process = proc_open($cmd, $descriptorspec, $pipes);
-            $start = time();
             $timeout = 90; // Timeout para fallback
-
-            while (is_resource($process)) {
-                $status = proc_get_status($process);
-                if (!$status['running']) break;
-
-                if ((time() - $start) > $timeout) {
-                    proc_terminate($process, 9);
-                    throw new \Exception("Timeout en método mejorado (>{$timeout}s)");
-                }
-                usleep(200000);
-            }
-
-            fclose($pipes[0]);
-            $stdout = stream_get_contents($pipes[1]);
-            $stderr = stream_get_contents($pipes[2]);
-            fclose($pipes[1]);
-            fclose($pipes[2]);
-            $returnCode = proc_close($process);
+            [$stdout, $stderr, $returnCode] = $this->runScript(
+                $cmd,
+                $timeout,
+                null,
+                "Timeout en método mejorado (>{$timeout}s)"
+            );
 
             Log::debug("🔧 Resultado comando mejorado:", [
                 'return_code' => $returnCode,
@@ -377,6 +675,7 @@ private function processWithImprovedFallback(Image $image, $batchId = null): Ima
 
             // ✅ BUSCAR JSON EN STDOUT - MISMO MÉTODO QUE YOLO
             $jsonData = $this->extractJsonFromOutput($stdout);
+            $this->logTimings('mejorado', $image->id, $jsonData);
 
             if (!$jsonData) {
                 Log::warning("⚠️ No se pudo parsear JSON del método mejorado, usando valores por defecto");
@@ -395,7 +694,9 @@ private function processWithImprovedFallback(Image $image, $batchId = null): Ima
             $processed->corrected_path = $wasabiProcessedPath;
             $image->processedImage()->save($processed);
 
-            $this->generateThumbnail($processed, $wasabiProcessedPath);
+            if (!$this->storeDerivatives($processed, $jsonData, $wasabiProcessedPath)) {
+                $this->generateThumbnail($processed, $wasabiProcessedPath);
+            }
 
             $analysis = $image->analysisResult ?? new ImageAnalysisResult();
             $analysis->fill([
@@ -404,6 +705,8 @@ private function processWithImprovedFallback(Image $image, $batchId = null): Ima
                 'integrity_score' => $jsonData['integridad'] ?? 75.0,
                 'luminosity_score' => $jsonData['luminosidad'] ?? 128.0,
                 'uniformity_score' => $jsonData['uniformidad'] ?? 50.0,
+                'cell_stats' => $jsonData['celdas'] ?? null,
+                'triage' => $jsonData['triage'] ?? null,
                 'processing_method' => 'improved_fallback',
                 'algorithm_version' => 'opencv_improved_v2',
             ]);
@@ -422,7 +725,10 @@ private function processWithImprovedFallback(Image $image, $batchId = null): Ima
 
             // ✅ Cleanup en caso de error
             if (isset($originalTemp)) @unlink($originalTemp);
-            if (isset($outputTemp)) @unlink($outputTemp);
+            if (isset($outputTemp)) {
+                @unlink($outputTemp);
+                $this->cleanupDerivatives($outputTemp);
+            }
 
             // ✅ NO marcar como error aquí, dejar que el job maneje el error
             return null;
@@ -0,0 +1,147 @@
+<?php
+
+namespace App\Services;
+
+use App\Models\Image;
+use Illuminate\Support\Facades\File;
+use Illuminate\Support\Facades\Log;
+use Illuminate\Support\Facades\Storage;
+
+/**
+ * ✅ Recorte manual contra el servicio caliente de manual_crop_transform.py
+ *
+ * Con MANUAL_CROP_SOCKET apuntando al socket de `manual_crop_transform.py --serve`
+ * las vistas previas y el recorte final van al proceso ya arrancado, que guarda
+ * los originales decodificados por image_id y lee/escribe Wasabi directamente.
+ * Sin socket, la vista previa lanza el script con --once sobre una copia local.
+ */
+class ManualCropService
+{
+    private const SOCKET_TIMEOUT = 30;
+
+    public function available(): bool
+    {
+        $socket = env('MANUAL_CROP_SOCKET');
+
+        return $socket && file_exists($socket);
+    }
+
+    /**
+     * ✅ Vista previa en baja resolución (JPEG en base64)
+     *
+     * @param array<int, array{0: float, 1: float}> $points
+     */
+    public function preview(Image $image, array $points, ?int $previewSize = null): array
+    {
+        $payload = [
+            'mode' => 'preview',
+            'image_id' => $image->id,
+            'points' => $this->pointsArgument($points),
+            'preview_size' => $previewSize,
+        ];
+
+        if ($this->available()) {
+            return $this->send($payload + ['input_path' => $this->s3Uri($image->original_path)]);
+        }
+
+        $tempDir = storage_path("app/temp_crop_preview_{$image->id}_" . uniqid());
+        File::makeDirectory($tempDir, 0755, true);
+
+        try {
+            $tempInput = "$tempDir/input.jpg";
+            File::put($tempInput, Storage::disk('wasabi')->get($image->original_path));
+
+            return $this->runOnce($payload + ['input_path' => $tempInput]);
+        } finally {
+            File::deleteDirectory($tempDir);
+        }
+    }
+
+    /**
+     * ✅ Recorte a resolución completa escrito directamente en Wasabi (requiere el servicio)
+     */
+    public function commit(Image $image, array $points, string $relativeProcessed): array
+    {
+        return $this->send([
+            'mode' => 'commit',
+            'image_id' => $image->id,
+            'input_path' => $this->s3Uri($image->original_path),
+            'points' => $this->pointsArgument($points),
+            'output_path' => $this->s3Uri($relativeProcessed),
+        ]);
+    }
+
+    public function pointsArgument(array $points): string
+    {
+        return implode(',', array_map(fn($p) => implode('_', $p), $points));
+    }
+
+    private function s3Uri(string $key): string
+    {
+        return 's3://' . config('filesystems.disks.wasabi.bucket') . '/' . ltrim($key, '/');
+    }
+
+    /**
+     * ✅ Una petición JSON-lines al socket del servicio
+     */
+    private function send(array $payload): array
+    {
+        $socket = env('MANUAL_CROP_SOCKET');
+        $conn = @stream_socket_client("unix://{$socket}", $errno, $errstr, self::SOCKET_TIMEOUT);
+
+        if (!$conn) {
+            Log::error("❌ Servicio de recorte manual no disponible", ['socket' => $socket, 'error' => $errstr]);
+            return ['error' => "Servicio de recorte manual no disponible: {$errstr}"];
+        }
+
+        try {
+            stream_set_timeout($conn, self::SOCKET_TIMEOUT);
+            fwrite($conn, json_encode($payload) . "\n");
+            $line = fgets($conn);
+        } finally {
+            fclose($conn);
+        }
+
+        $json = $line !== false ? json_decode($line, true) : null;
+        if (!is_array($json)) {
+            return ['error' => 'Respuesta inválida del servicio de recorte manual'];
+        }
+
+        return $json;
+    }
+
+    /**
+     * ✅ Sin servicio: una sola petición con `manual_crop_transform.py --once`
+     */
+    private function runOnce(array $payload): array
+    {
+        $pythonPath = env('PYTHON_PATH', 'python3');
+        $scriptPath = storage_path('app/scripts/manual_crop_transform.py');
+
+        $process = proc_open(
+            [$pythonPath, $scriptPath, '--once'],
+            [0 => ['pipe', 'r'], 1 => ['pipe', 'w'], 2 => ['pipe', 'w']],
+            $pipes
+        );
+
+        if (!is_resource($process)) {
+            return ['error' => 'No se pudo iniciar el recorte manual'];
+        }
+
+        fwrite($pipes[0], json_encode($payload));
+        fclose($pipes[0]);
+        $stdout = stream_get_contents($pipes[1]);
+        $stderr = stream_get_contents($pipes[2]);
+        fclose($pipes[1]);
+        fclose($pipes[2]);
+        proc_close($process);
+
+        $json = json_decode(trim($stdout), true);
+        if (!is_array($json)) {
+            Log::error("❌ Vista previa de recorte fallida", ['stderr' => substr($stderr, -2000)]);
+            return ['error' => 'Respuesta inválida del recorte manual'];
+        }
+
+        return $json;
+    }
+}
@@ -0,0 +1,22 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration {
+    public function up(): void
+    {
+        Schema::table('processed_images', function (Blueprint $table) {
+            $table->string('report_path')->nullable()->after('thumb_url');
+            $table->string('preview_path')->nullable()->after('report_path');
+        });
+    }
+
+    public function down(): void
+    {
+        Schema::table('processed_images', function (Blueprint $table) {
+            $table->dropColumn(['report_path', 'preview_path']);
+        });
+    }
+};
@@ -0,0 +1,21 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration {
+    public function up(): void
+    {
+        Schema::table('image_analysis_results', function (Blueprint $table) {
+            $table->json('cell_stats')->nullable()->after('cells_with_different_intensity');
+        });
+    }
+
+    public function down(): void
+    {
+        Schema::table('image_analysis_results', function (Blueprint $table) {
+            $table->dropColumn('cell_stats');
+        });
+    }
+};
@@ -160,6 +160,7 @@
 
 Route::get('/images/{image}/base64', [ImageController::class, 'base64']);
 Route::post('/images/{image}/manual-crop', [ImageController::class, 'manualCrop']);
+Route::post('/images/{image}/manual-crop/preview', [ImageController::class, 'manualCropPreview']);
 Route::post('/images/{image}/manual-errors', [ImageController::class, 'saveManualErrors']);
 Route::post('/images/{image}/status-processed', [ImageController::class, 'imageProcessedStatus']);
 Route::post('/images/{image}/status-analysis', [ImageController::class, 'imageAnalysisStatus']);
@@ -0,0 +1,121 @@
+"""
+Microbenchmark del motor de métricas fusionado (panel_metrics) frente a las
+funciones originales (una conversión de color por métrica).
+
+Verifica además que los valores redondeados sean idénticos.
+
+Uso:
+  python bench_metrics.py [imagen1.jpg imagen2.jpg ...] [--repeat 5] [--size 4000x5500]
+Sin imágenes se usan paneles sintéticos del tamaño indicado.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from panel_metrics import analizar_gris, calcular_metricas, es_imagen_totalmente_inutilizable, \
+    es_imagen_electroluminiscencia
+
+# ---- Implementación original (referencia) ----
+
+def legacy_integridad(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    non_black = np.count_nonzero(gray > 30)
+    return round((non_black / gray.size) * 100, 2)
+
+def legacy_luminosidad(img):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    return round(np.mean(hsv[:, :, 2]), 5)
+
+def legacy_uniformidad(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return round(np.std(gray), 3)
+
+def legacy_inutilizable(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    mean_val = np.mean(gray)
+    std_val = np.std(gray)
+    return (mean_val < 5 and std_val < 3) or (mean_val > 250 and std_val < 3)
+
+def legacy_el(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+    black_ratio = np.sum(hist[0:50]) / gray.size
+    bright_ratio = np.sum(hist[150:256]) / gray.size
+    return bool(black_ratio > 0.6 and bright_ratio > 0.1)
+
+def legacy(img):
+    return {
+        "inutilizable": bool(legacy_inutilizable(img)),
+        "es_EL": legacy_el(img),
+        "integridad": legacy_integridad(img),
+        "luminosidad": legacy_luminosidad(img),
+        "uniformidad": legacy_uniformidad(img),
+    }
+
+def fused(img):
+    stats = analizar_gris(img)
+    metricas = calcular_metricas(img, umbral_integridad=30, stats_gris=stats)
+    return {
+        "inutilizable": es_imagen_totalmente_inutilizable(stats)[0],
+        "es_EL": es_imagen_electroluminiscencia(stats),
+        **metricas,
+    }
+
+def panel_sintetico(w, h, seed):
+    """Panel EL sintético: fondo oscuro con ruido y celdas brillantes"""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 20, (h, w, 3), dtype=np.uint8)
+    x0, y0, x1, y1 = w // 8, h // 10, w - w // 8, h - h // 10
+    img[y0:y1, x0:x1] = rng.integers(120, 230, (y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    return img
+
+def cronometrar(fn, img, repeat):
+    tiempos = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resultado = fn(img)
+        tiempos.append((time.perf_counter() - start) * 1000)
+    return resultado, min(tiempos)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Microbenchmark de métricas fusionadas vs originales')
+    parser.add_argument('images', nargs='*', help='Imágenes a medir (por defecto, sintéticas)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--size', default='4000x5500', help='Tamaño de las imágenes sintéticas (ancho x alto)')
+    parser.add_argument('--synthetic', type=int, default=3, help='Número de imágenes sintéticas')
+    args = parser.parse_args()
+
+    if args.images:
+        muestras = [(path, cv2.imread(path)) for path in args.images]
+    else:
+        w, h = (int(v) for v in args.size.lower().split('x'))
+        muestras = [(f"sintetica_{i}", panel_sintetico(w, h, i)) for i in range(args.synthetic)]
+
+    filas = []
+    for nombre, img in muestras:
+        if img is None:
+            print(f"❌ No se pudo cargar: {nombre}", file=sys.stderr)
+            continue
+
+        ref, t_legacy = cronometrar(legacy, img, args.repeat)
+        nuevo, t_fused = cronometrar(fused, img, args.repeat)
+        filas.append({
+            "imagen": nombre,
+            "pixeles": int(img.shape[0] * img.shape[1]),
+            "legacy_ms": round(t_legacy, 2),
+            "fused_ms": round(t_fused, 2),
+            "speedup": round(t_legacy / t_fused, 2) if t_fused else None,
+            "identico": ref == nuevo,
+        })
+        print(f"📊 {nombre}: {t_legacy:.1f} ms -> {t_fused:.1f} ms (idéntico: {ref == nuevo})", file=sys.stderr)
+
+    print(json.dumps({
+        "resultados": filas,
+        "todos_identicos": all(f["identico"] for f in filas),
+    }, ensure_ascii=True))
+    sys.exit(0 if all(f["identico"] for f in filas) else 1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Constructor de ZIPs de descarga con recompresión en paralelo.
+
+Reemplaza el bucle serie de GenerateDownloadZipJob (descarga -> toJpeg(70) ->
+addFromString) por:
+  * un pool de procesos que descarga y recomprime los JPEG a calidad 70,
+  * un escritor único que añade cada entrada al ZIP en cuanto está lista,
+    como STORED para datos ya comprimidos (JPEG/PNG/WebP) y DEFLATED el resto,
+  * una ventana acotada de tareas en vuelo: la memoria no crece con el tamaño
+    del proyecto.
+
+Manifiesto (JSON o JSON-lines), una entrada por archivo del ZIP, con la misma
+ruta "{root}/{folderPath}/{tipo}/{filename}" que construye el job:
+  {"name": "...", "path": "/ruta/local.jpg" | "url": "https://...",
+   "recompress": true, "image_id": 123}
+
+Uso:
+  build_download_zip.py manifest.json salida.zip [--workers N] [--quality 70]
+  build_download_zip.py manifest.json - > salida.zip   (ZIP en streaming por stdout)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import urllib.request
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+# Extensiones que ya van comprimidas: deflate solo gasta CPU
+EXTENSIONES_STORED = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip'}
+EXTENSIONES_RECOMPRIMIBLES = {'.jpg', '.jpeg'}
+TAMANO_MINIMO_RECOMPRESION = 1024
+REINTENTOS_DESCARGA = 3
+
+def _iniciar_worker():
+    cv2.setNumThreads(1)
+
+def descargar(entry, timeout=120):
+    """Bytes de la entrada desde disco o URL (p.ej. URL temporal firmada de Wasabi)"""
+    if entry.get("path"):
+        with open(entry["path"], 'rb') as f:
+            return f.read()
+
+    ultimo_error = None
+    for intento in range(REINTENTOS_DESCARGA):
+        try:
+            with urllib.request.urlopen(entry["url"], timeout=timeout) as response:
+                return response.read()
+        except Exception as e:
+            ultimo_error = e
+            time.sleep(0.5 * (intento + 1))
+    raise Exception(f"No se pudo descargar {entry['name']}: {ultimo_error}")
+
+def recomprimir(data, calidad=70):
+    """Mismo criterio que compressImageIfNeeded: ante cualquier fallo se devuelve el original"""
+    if len(data) < TAMANO_MINIMO_RECOMPRESION:
+        return data
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return data
+
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, int(calidad)])
+    if not ok or buf.size == 0:
+        return data
+    return buf.tobytes()
+
+def preparar_entrada(entry, calidad=70):
+    """Worker del pool: descarga y (si procede) recomprime; nunca lanza"""
+    try:
+        data = descargar(entry)
+        if not data:
+            raise Exception(f"Archivo vacío: {entry['name']}")
+
+        ext = os.path.splitext(entry["name"])[1].lower()
+        if entry.get("recompress", True) and ext in EXTENSIONES_RECOMPRIMIBLES:
+            data = recomprimir(data, calidad)
+        return entry, data, None
+    except Exception as e:
+        return entry, None, str(e)
+
+def tipo_compresion(name):
+    ext = os.path.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if ext in EXTENSIONES_STORED else zipfile.ZIP_DEFLATED
+
+def escribir_entrada(zf, name, data):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = tipo_compresion(name)
+    info.external_attr = 0o644 << 16
+    zf.writestr(info, data)
+
+def load_manifest(manifest_path):
+    """Manifiesto JSON (lista) o JSON-lines ("-" para stdin)"""
+    if manifest_path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    content = content.strip()
+    if not content:
+        return []
+    entries = json.loads(content) if content.startswith('[') else \
+        [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("name") or not (entry.get("path") or entry.get("url")):
+            raise Exception(f"Entrada {i} del manifiesto inválida: se requieren name y path o url")
+    return entries
+
+def build_zip(entries, output, workers=None, calidad=70, ventana=None):
+    """
+    Construye el ZIP escribiendo cada entrada en cuanto su worker termina.
+    Como máximo `ventana` entradas preparadas en memoria a la vez.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    ventana = max(workers, ventana or workers * 2)
+    start = time.perf_counter()
+
+    nombres = set()
+    errores = []
+    ok_ids = set()
+    escritas = 0
+    bytes_datos = 0
+
+    print(f"🗜️ ZIP: {len(entries)} entrada(s), {workers} proceso(s), ventana {ventana}", file=sys.stderr)
+
+    with zipfile.ZipFile(output, 'w', allowZip64=True) as zf, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker) as pool:
+        pendientes = iter(entries)
+        en_vuelo = set()
+
+        def rellenar():
+            for entry in pendientes:
+                en_vuelo.add(pool.submit(preparar_entrada, entry, calidad))
+                if len(en_vuelo) >= ventana:
+                    return
+
+        rellenar()
+        while en_vuelo:
+            terminadas, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for future in terminadas:
+                en_vuelo.discard(future)
+                entry, data, error = future.result()
+
+                if error is None and entry["name"] in nombres:
+                    error = "Entrada duplicada en el ZIP"
+                if error is not None:
+                    print(f"⚠️ {entry['name']}: {error}", file=sys.stderr)
+                    errores.append({"name": entry["name"], "image_id": entry.get("image_id"), "error": error})
+                    continue
+
+                escribir_entrada(zf, entry["name"], data)
+                nombres.add(entry["name"])
+                escritas += 1
+                bytes_datos += len(data)
+                if entry.get("image_id") is not None:
+                    ok_ids.add(entry["image_id"])
+
+            rellenar()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ ZIP completado: {escritas}/{len(entries)} entradas en {elapsed:.1f}s", file=sys.stderr)
+
+    return {
+        "success": True,
+        "entries": escritas,
+        "total": len(entries),
+        "bytes": bytes_datos,
+        "image_ids": sorted(ok_ids),
+        "errors": errores,
+        "seconds": round(elapsed, 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Construye un ZIP de descarga recomprimiendo en paralelo')
+    parser.add_argument('manifest', help='Manifiesto JSON o JSON-lines ("-" para stdin)')
+    parser.add_argument('output', help='Ruta del ZIP ("-" = ZIP en streaming por stdout)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ZIP_WORKERS', 0)) or None,
+                        help='Procesos de descarga/recompresión (por defecto, núcleos disponibles)')
+    parser.add_argument('--quality', type=int, default=70, help='Calidad JPEG de la recompresión')
+    parser.add_argument('--window', type=int, default=None,
+                        help='Máximo de entradas preparadas en memoria (por defecto 2 x workers)')
+    args = parser.parse_args()
+
+    try:
+        entries = load_manifest(args.manifest)
+        if args.output == '-':
+            summary = build_zip(entries, sys.stdout.buffer, args.workers, args.quality, args.window)
+            sys.stdout.buffer.flush()
+            print(json.dumps(summary, ensure_ascii=True), file=sys.stderr)
+        else:
+            summary = build_zip(entries, args.output, args.workers, args.quality, args.window)
+            summary["zip_path"] = args.output
+            print(json.dumps(summary, ensure_ascii=True))
+    except Exception as e:
+        # Con salida "-" stdout es el propio ZIP: el error va a stderr
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=True),
+              file=sys.stderr if args.output == '-' else sys.stdout)
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,174 @@
+"""
+Lectura de dimensiones desde las cabeceras de imagen, sin decodificar píxeles.
+
+JPEG: marcadores hasta el SOFn (más la orientación EXIF de APP1).
+PNG: chunk IHDR. GIF / BMP / WebP: cabecera fija.
+
+leer_cabecera(stream) consume solo los bytes necesarios de cualquier objeto
+con read() (archivo, miembro de ZIP, BytesIO) y devuelve un dict con
+formato, ancho, alto, orientacion_exif y, si no se pudo leer, corrupto/motivo.
+"""
+
+import struct
+
+# SOFn con dimensiones (excluye DHT C4, JPG C8 y DAC CC)
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_SIN_LONGITUD = {0x01} | set(range(0xD0, 0xD8))
+PNG_FIRMA = b'\x89PNG\r\n\x1a\n'
+
+# Orientaciones EXIF que intercambian ancho y alto (cv2.imread las aplica al cargar)
+ORIENTACIONES_TRANSPUESTAS = {5, 6, 7, 8}
+
+class CabeceraInvalida(Exception):
+    pass
+
+def _leer(stream, n):
+    datos = stream.read(n)
+    if len(datos) < n:
+        raise CabeceraInvalida("Cabecera truncada")
+    return datos
+
+def _saltar(stream, n):
+    # read() en bloques: los miembros comprimidos de un ZIP no admiten seek barato
+    while n > 0:
+        bloque = stream.read(min(n, 65536))
+        if not bloque:
+            raise CabeceraInvalida("Cabecera truncada")
+        n -= len(bloque)
+
+def orientacion_exif(app1):
+    """Tag 0x0112 del IFD0 de un segmento APP1 Exif; None si no está"""
+    if not app1.startswith(b'Exif\x00\x00') or len(app1) < 14:
+        return None
+    tiff = app1[6:]
+    orden = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if orden is None:
+        return None
+
+    try:
+        (ifd,) = struct.unpack(orden + 'I', tiff[4:8])
+        (entradas,) = struct.unpack(orden + 'H', tiff[ifd:ifd + 2])
+        for i in range(entradas):
+            base = ifd + 2 + i * 12
+            tag, tipo = struct.unpack(orden + 'HH', tiff[base:base + 4])
+            if tag == 0x0112 and tipo == 3:
+                (valor,) = struct.unpack(orden + 'H', tiff[base + 8:base + 10])
+                return valor if 1 <= valor <= 8 else None
+    except struct.error:
+        return None
+    return None
+
+def cabecera_jpeg(stream):
+    if _leer(stream, 2) != b'\xff\xd8':
+        raise CabeceraInvalida("Firma JPEG inválida")
+
+    orientacion = None
+    while True:
+        byte = _leer(stream, 1)
+        if byte != b'\xff':
+            raise CabeceraInvalida("Marcador JPEG inválido")
+        marcador = _leer(stream, 1)[0]
+        while marcador == 0xFF:  # bytes de relleno
+            marcador = _leer(stream, 1)[0]
+
+        if marcador in JPEG_SIN_LONGITUD:
+            continue
+        if marcador in (0xD9, 0xDA):
+            raise CabeceraInvalida("Sin marcador SOF antes de los datos")
+
+        (longitud,) = struct.unpack('>H', _leer(stream, 2))
+        if longitud < 2:
+            raise CabeceraInvalida("Segmento JPEG inválido")
+
+        if marcador in JPEG_SOF:
+            _, alto, ancho = struct.unpack('>BHH', _leer(stream, 5))
+            return {"formato": "jpeg", "ancho": ancho, "alto": alto, "orientacion_exif": orientacion}
+
+        if marcador == 0xE1 and orientacion is None:
+            orientacion = orientacion_exif(_leer(stream, longitud - 2))
+        else:
+            _saltar(stream, longitud - 2)
+
+def cabecera_png(stream):
+    if _leer(stream, 8) != PNG_FIRMA:
+        raise CabeceraInvalida("Firma PNG inválida")
+    longitud, tipo = struct.unpack('>I4s', _leer(stream, 8))
+    if tipo != b'IHDR' or longitud < 8:
+        raise CabeceraInvalida("Falta el chunk IHDR")
+    ancho, alto = struct.unpack('>II', _leer(stream, 8))
+    return {"formato": "png", "ancho": ancho, "alto": alto, "orientacion_exif": None}
+
+def cabecera_gif(inicio):
+    ancho, alto = struct.unpack('<HH', inicio[6:10])
+    return {"formato": "gif", "ancho": ancho, "alto": alto, "orientacion_exif": None}
+
+def cabecera_bmp(inicio):
+    ancho, alto = struct.unpack('<ii', inicio[18:26])
+    return {"formato": "bmp", "ancho": abs(ancho), "alto": abs(alto), "orientacion_exif": None}
+
+def cabecera_webp(inicio):
+    chunk = inicio[12:16]
+    if chunk == b'VP8X':
+        ancho = int.from_bytes(inicio[24:27], 'little') + 1
+        alto = int.from_bytes(inicio[27:30], 'little') + 1
+    elif chunk == b'VP8L':
+        bits = int.from_bytes(inicio[21:25], 'little')
+        ancho, alto = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8 ':
+        ancho, alto = struct.unpack('<HH', inicio[26:30])
+        ancho, alto = ancho & 0x3FFF, alto & 0x3FFF
+    else:
+        raise CabeceraInvalida("Chunk WebP desconocido")
+    return {"formato": "webp", "ancho": ancho, "alto": alto, "orientacion_exif": None}
+
+class _Prefijo:
+    """Devuelve primero los bytes ya leídos para detectar el formato y luego el resto del stream"""
+
+    def __init__(self, prefijo, stream):
+        self.prefijo = prefijo
+        self.stream = stream
+
+    def read(self, n):
+        if self.prefijo:
+            datos, self.prefijo = self.prefijo[:n], self.prefijo[n:]
+            if len(datos) < n:
+                datos += self.stream.read(n - len(datos))
+            return datos
+        return self.stream.read(n)
+
+def leer_cabecera(stream):
+    """Dimensiones y orientación desde la cabecera; nunca lanza"""
+    try:
+        inicio = stream.read(32)
+        if inicio[:2] == b'\xff\xd8':
+            info = cabecera_jpeg(_Prefijo(inicio, stream))
+        elif inicio[:8] == PNG_FIRMA:
+            info = cabecera_png(_Prefijo(inicio, stream))
+        elif inicio[:6] in (b'GIF87a', b'GIF89a') and len(inicio) >= 10:
+            info = cabecera_gif(inicio)
+        elif inicio[:2] == b'BM' and len(inicio) >= 26:
+            info = cabecera_bmp(inicio)
+        elif inicio[:4] == b'RIFF' and inicio[8:12] == b'WEBP' and len(inicio) >= 30:
+            info = cabecera_webp(inicio)
+        elif not inicio:
+            raise CabeceraInvalida("Archivo vacío")
+        else:
+            raise CabeceraInvalida("Formato de imagen no reconocido")
+
+        if info["ancho"] <= 0 or info["alto"] <= 0:
+            raise CabeceraInvalida("Dimensiones nulas en la cabecera")
+        info["corrupto"] = False
+        info["motivo"] = None
+        return info
+
+    except (CabeceraInvalida, struct.error) as e:
+        return {"formato": None, "ancho": None, "alto": None, "orientacion_exif": None,
+                "corrupto": True, "motivo": str(e)}
+
+def dimensiones_efectivas(info):
+    """Ancho y alto tras aplicar la orientación EXIF (lo que verá cv2.imread)"""
+    if info.get("ancho") is None:
+        return None, None
+    if info.get("orientacion_exif") in ORIENTACIONES_TRANSPUESTAS:
+        return info["alto"], info["ancho"]
+    return info["ancho"], info["alto"]
@@ -1,52 +1,103 @@
+"""
+Recorte manual por 4 puntos.
+
+Uso:
+  manual_crop_transform.py input.jpg output.jpg 'x1_y1,x2_y2,x3_y3,x4_y4'
+  manual_crop_transform.py --serve [--socket /tmp/manual_crop.sock]
+  manual_crop_transform.py --once < peticion.json
+  manual_crop_transform.py --batch manifiesto.jsonl [--workers 8]
+
+En modo servidor el proceso queda caliente y atiende peticiones JSON-lines
+{"mode", "image_id", "input_path", "points", "output_path", "preview_size"}:
+  * preview: decodificación JPEG reducida (IMREAD_REDUCED_*) al factor justo
+    para el tamaño pedido y warp solo del ROI de los 4 puntos; devuelve la
+    vista previa en base64 en decenas de milisegundos,
+  * commit: warp a resolución completa (idéntico al modo CLI) escrito en
+    output_path (ruta local o s3://).
+Los originales decodificados (y sus bytes) se guardan en una LRU por image_id,
+así que los ajustes sucesivos de esquinas no vuelven a descargar ni decodificar.
+--once atiende una sola petición por stdin (mismo protocolo, sin servidor).
+
+--batch recorta una fila entera de paneles en un solo proceso: manifiesto JSON
+(lista) o JSON-lines con {input_path, output_path, points} por imagen. Las
+homografías se calculan todas antes de empezar, los warps se reparten en un pool
+de hilos (OpenCV libera el GIL) y se emite una línea JSON por imagen.
+"""
 
 import cv2
 import numpy as np
 import sys
 import json
 import os
+import io
+import base64
+import argparse
+import tempfile
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from image_headers import dimensiones_efectivas, leer_cabecera
+from panel_diagnostics import anotar, instalar
+from panel_io import guardar_imagen, leer_imagen
+from panel_s3 import descargar, es_s3, publicar, salida_local
+from panel_timings import medir, nuevo, registrar, usar
+
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+PREVIEW_SIZE_DEFECTO = 800
+PREVIEW_QUALITY = 80
 
 def parse_points(points_str):
+    """'x1_y1,x2_y2,...' o lista [[x, y], ...] -> array (4, 2)"""
     try:
-        points = []
-        pairs = points_str.split(',')
-        for pair in pairs:
-            x, y = map(float, pair.split('_'))
-            points.append([x, y])
+        if isinstance(points_str, str):
+            points = [list(map(float, pair.split('_'))) for pair in points_str.split(',')]
+        else:
+            points = [[float(x), float(y)] for x, y in points_str]
         if len(points) != 4:
             raise ValueError("Se esperaban exactamente 4 puntos")
         return np.array(points, dtype='float32')
     except Exception as e:
         raise ValueError("Formato de puntos inválido: " + str(e))
 
-def crop_and_warp(input_path, output_path, points):
-    # Ordenar los puntos
-    def order_points(pts):
-        rect = np.zeros((4, 2), dtype="float32")
-        s = pts.sum(axis=1)
-        rect[0] = pts[np.argmin(s)]
-        rect[2] = pts[np.argmax(s)]
-        diff = np.diff(pts, axis=1)
-        rect[1] = pts[np.argmin(diff)]
-        rect[3] = pts[np.argmax(diff)]
-        return rect
+def order_points(pts):
+    rect = np.zeros((4, 2), dtype="float32")
+    s = pts.sum(axis=1)
+    rect[0] = pts[np.argmin(s)]
+    rect[2] = pts[np.argmax(s)]
+    diff = np.diff(pts, axis=1)
+    rect[1] = pts[np.argmin(diff)]
+    rect[3] = pts[np.argmax(diff)]
+    return rect
 
+def homografia(points):
+    """Puntos ordenados, tamaño de salida y matriz de perspectiva a resolución completa"""
     pts = order_points(points)
 
     width = int(max(np.linalg.norm(pts[1] - pts[0]), np.linalg.norm(pts[2] - pts[3])))
     height = int(max(np.linalg.norm(pts[3] - pts[0]), np.linalg.norm(pts[2] - pts[1])))
+    if width < 1 or height < 1:
+        raise ValueError("Los puntos no definen un área válida")
 
     dst = np.array([[0, 0], [width-1, 0], [width-1, height-1], [0, height-1]], dtype="float32")
-    M = cv2.getPerspectiveTransform(pts, dst)
+    return pts, width, height, cv2.getPerspectiveTransform(pts, dst)
+
+def crop_and_warp(input_path, output_path, points):
+    _, width, height, M = homografia(points)
 
-    img = cv2.imread(input_path)
+    with medir("decode"):
+        img = cv2.imread(input_path)
     if img is None:
         raise Exception("No se pudo cargar la imagen")
 
-    warped = cv2.warpPerspective(img, M, (width, height))
+    with medir("warp"):
+        warped = cv2.warpPerspective(img, M, (width, height))
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    cv2.imwrite(output_path, warped)
+    with medir("encode_write"):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, warped)
 
     result = {
         "ok": True,
@@ -54,17 +105,394 @@ def crop_and_warp(input_path, output_path, points):
         "height": height
     }
 
-    print(json.dumps(result, ensure_ascii=True))
+    return result
+
+# ============================================================
+# ✅ MODO SERVIDOR: originales decodificados en una LRU por image_id
+# ============================================================
+
+class OriginalesLRU:
+    """
+    image_id -> bytes codificados + decodificaciones por factor (1 = completa).
+    Se expulsan las entradas menos usadas al pasar de max_entradas o max_mb.
+    """
+
+    def __init__(self, max_entradas=8, max_mb=1024):
+        self.max_entradas = max(1, int(max_entradas))
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self.entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entrada(self, image_id, input_path):
+        with self._lock:
+            entrada = self.entradas.get(image_id)
+            if entrada is not None and entrada["input_path"] == input_path:
+                self.entradas.move_to_end(image_id)
+                return entrada, True
+
+        with medir("decode"):
+            datos = descargar(input_path)
+            if isinstance(datos, str):
+                with open(datos, 'rb') as f:
+                    datos = f.read()
+        cabecera = leer_cabecera(io.BytesIO(datos))
+        ancho, alto = dimensiones_efectivas(cabecera)
+        entrada = {"input_path": input_path, "datos": datos, "ancho": ancho, "alto": alto, "imagenes": {}}
+
+        with self._lock:
+            self.entradas[image_id] = entrada
+            self.entradas.move_to_end(image_id)
+        return entrada, False
+
+    def obtener(self, image_id, input_path, factor=1):
+        """(imagen decodificada al factor pedido, entrada, acierto)"""
+        entrada, hit = self._entrada(image_id, input_path)
+        img = entrada["imagenes"].get(factor)
+        if img is None:
+            hit = False
+            with medir("decode"):
+                img = leer_imagen(entrada["datos"], REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+            if img is None:
+                raise Exception(f"No se pudo cargar la imagen: {input_path}")
+            if factor == 1 or not entrada["ancho"]:
+                # Sin cabecera legible las dimensiones salen de la decodificación
+                entrada["ancho"] = entrada["ancho"] or img.shape[1] * factor
+                entrada["alto"] = entrada["alto"] or img.shape[0] * factor
+            entrada["imagenes"][factor] = img
+            self._expulsar(image_id)
+        return img, entrada, hit
+
+    def _tamano(self, entrada):
+        return len(entrada["datos"]) + sum(img.nbytes for img in entrada["imagenes"].values())
+
+    def _expulsar(self, actual):
+        with self._lock:
+            total = sum(self._tamano(entrada) for entrada in self.entradas.values())
+            for image_id in list(self.entradas):
+                if len(self.entradas) <= self.max_entradas and total <= self.max_bytes:
+                    break
+                if image_id == actual:
+                    continue
+                total -= self._tamano(self.entradas.pop(image_id))
+                print(f"🧹 Original {image_id} expulsado de la caché", file=sys.stderr)
+
+def factor_preview(width, height, preview_size):
+    """Mayor factor de decodificación reducida que aún da la resolución de la vista previa"""
+    escala = min(1.0, float(preview_size) / max(width, height))
+    for factor in (8, 4, 2):
+        if escala * factor <= 1.0:
+            return escala, factor
+    return escala, 1
+
+def preview(originales, request):
+    points = parse_points(request["points"])
+    pts, width, height, _ = homografia(points)
+    escala, factor = factor_preview(width, height, int(request.get("preview_size") or PREVIEW_SIZE_DEFECTO))
+
+    img, entrada, hit = originales.obtener(request["image_id"], request["input_path"], factor)
+
+    with medir("warp"):
+        # Puntos en coordenadas de la imagen reducida y warp solo del ROI que encierran
+        p = pts * np.array([img.shape[1] / float(entrada["ancho"]), img.shape[0] / float(entrada["alto"])],
+                           dtype=np.float32)
+        x0 = int(max(0, np.floor(p[:, 0].min()) - 1))
+        y0 = int(max(0, np.floor(p[:, 1].min()) - 1))
+        x1 = int(min(img.shape[1], np.ceil(p[:, 0].max()) + 2))
+        y1 = int(min(img.shape[0], np.ceil(p[:, 1].max()) + 2))
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("Los puntos quedan fuera de la imagen")
+        roi = img[y0:y1, x0:x1]
+
+        pw = max(1, int(round(width * escala)))
+        ph = max(1, int(round(height * escala)))
+        dst = np.array([[0, 0], [pw-1, 0], [pw-1, ph-1], [0, ph-1]], dtype="float32")
+        M = cv2.getPerspectiveTransform(p - np.array([x0, y0], dtype=np.float32), dst)
+        warped = cv2.warpPerspective(roi, M, (pw, ph))
+
+    with medir("encode_write"):
+        ok, buf = cv2.imencode('.jpg', warped, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY])
+        if not ok:
+            raise Exception("Error codificando la vista previa")
+
+    return {
+        "ok": True,
+        "mode": "preview",
+        "width": width,
+        "height": height,
+        "preview_width": pw,
+        "preview_height": ph,
+        "decode_factor": factor,
+        "cache": "hit" if hit else "miss",
+        "image_base64": base64.b64encode(buf.tobytes()).decode('ascii'),
+    }
+
+def commit(originales, request):
+    if not request.get("output_path"):
+        raise ValueError("Falta el campo obligatorio: output_path")
+
+    _, width, height, M = homografia(parse_points(request["points"]))
+    img, _, hit = originales.obtener(request["image_id"], request["input_path"], 1)
+
+    with medir("warp"):
+        warped = cv2.warpPerspective(img, M, (width, height))
+
+    output_path = request["output_path"]
+    local = salida_local(output_path, tempfile.gettempdir())
+    with medir("encode_write"):
+        guardar_imagen(warped, local)
+
+    result = {"ok": True, "mode": "commit", "width": width, "height": height, "cache": "hit" if hit else "miss"}
+    if es_s3(output_path):
+        publicar(result, output_path, local)
+    return result
+
+def handle_request(originales, request):
+    """Procesa una petición preview/commit y devuelve el dict de respuesta (nunca lanza)"""
+    start = time.perf_counter()
+    crono = nuevo()
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("La petición debe ser un objeto JSON")
+        for campo in ("image_id", "input_path", "points"):
+            if request.get(campo) in (None, ''):
+                raise ValueError(f"Falta el campo obligatorio: {campo}")
+
+        modo = request.get("mode", "preview")
+        if modo not in ("preview", "commit"):
+            raise ValueError(f"Modo desconocido: {modo} (preview o commit)")
+
+        with usar(crono):
+            result = preview(originales, request) if modo == "preview" else commit(originales, request)
+    except Exception as e:
+        print(f"💀 ERROR EN RECORTE MANUAL: {e}", file=sys.stderr)
+        result = {"error": str(e)}
+
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return registrar(result, crono, "manual_crop_transform", request.get("input_path") if isinstance(request, dict) else None)
+
+def handle_line(originales, line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        response = {"error": f"JSON inválido: {e}"}
+    else:
+        response = handle_request(originales, request)
+    return json.dumps(response, ensure_ascii=True) + "\n"
+
+def serve_lines(originales, rfile, wfile):
+    for raw in rfile:
+        response = handle_line(originales, raw.decode("utf-8", errors="replace"))
+        if response is not None:
+            wfile.write(response.encode("utf-8"))
+            wfile.flush()
+
+def run_server(originales, socket_path=None):
+    """stdin/stdout o socket Unix; con socket, una conexión por hilo (OpenCV libera el GIL)"""
+    sys.stdout = sys.stderr
+    if not socket_path:
+        print("🟢 Servidor de recorte manual escuchando en stdin", file=sys.stderr)
+        serve_lines(originales, sys.stdin.buffer, sys.__stdout__.buffer)
+        return
+
+    import socketserver
+
+    class CropRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_lines(originales, self.rfile, self.wfile)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, CropRequestHandler) as server:
+        server.daemon_threads = True
+        print(f"🟢 Servidor de recorte manual escuchando en {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+# ============================================================
+# ✅ MODO LOTE: un proceso para todo el manifiesto
+# ============================================================
+
+PROGRESO_CADA = 50
+MAX_BUFFERS_HILO = 4
+
+_buffers = threading.local()
+
+def buffer_salida(height, width, canales):
+    """Buffer de salida del hilo para ese tamaño: los paneles de una fila suelen repetir dimensiones"""
+    pool = getattr(_buffers, 'pool', None)
+    if pool is None:
+        pool = _buffers.pool = OrderedDict()
+    clave = (height, width, canales)
+    buf = pool.get(clave)
+    if buf is None:
+        buf = pool[clave] = np.empty(clave, dtype=np.uint8)
+        if len(pool) > MAX_BUFFERS_HILO:
+            pool.popitem(last=False)
+    pool.move_to_end(clave)
+    return buf
+
+def load_manifest(manifest_path):
+    """Manifiesto JSON (lista) o JSON-lines con entradas {input_path, output_path, points} ("-" para stdin)"""
+    if manifest_path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    content = content.strip()
+    if not content:
+        return []
+    entries = json.loads(content) if content.startswith('[') else \
+        [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("input_path") or not entry.get("output_path") \
+                or not entry.get("points"):
+            raise Exception(f"Entrada {i} del manifiesto inválida: se requieren input_path, output_path y points")
+    return entries
+
+def preparar_lote(entries):
+    """Homografías de todo el lote por adelantado: (entry, (width, height, M) o None, error)"""
+    trabajos = []
+    for entry in entries:
+        try:
+            _, width, height, M = homografia(parse_points(entry["points"]))
+            trabajos.append((entry, (width, height, M), None))
+        except Exception as e:
+            trabajos.append((entry, None, str(e)))
+    return trabajos
+
+def recortar_entrada(entry, geometria):
+    """Worker del pool de hilos: nunca lanza, devuelve el dict de resultado o de error"""
+    start = time.perf_counter()
+    crono = nuevo()
+    try:
+        width, height, M = geometria
+        output = salida_local(entry["output_path"], tempfile.gettempdir())
+        with usar(crono):
+            with medir("decode"):
+                img = leer_imagen(descargar(entry["input_path"]))
+            if img is None:
+                raise Exception(f"No se pudo cargar la imagen: {entry['input_path']}")
+
+            with medir("warp"):
+                warped = cv2.warpPerspective(img, M, (width, height),
+                                             dst=buffer_salida(height, width, img.shape[2]))
+            del img
+
+            with medir("encode_write"):
+                guardar_imagen(warped, output)
+
+        result = publicar({"ok": True, "width": width, "height": height}, entry["output_path"], output)
+    except Exception as e:
+        result = {"ok": False, "error": str(e)}
+
+    result["input_path"] = entry.get("input_path")
+    result["output_path"] = entry.get("output_path") if result["ok"] else None
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return registrar(result, crono, "manual_crop_transform", entry.get("input_path"))
+
+def run_batch(entries, workers=None, out=None):
+    """Reparte los warps en un pool de hilos y emite una línea JSON por imagen en orden de finalización"""
+    out = out or sys.stdout
+    workers = max(1, workers or os.cpu_count() or 1)
+    start = time.perf_counter()
+    total_ok = terminadas = 0
+
+    trabajos = preparar_lote(entries)
+    if workers > 1:
+        # Paralelismo entre imágenes: sin hilos internos de OpenCV compitiendo entre sí
+        cv2.setNumThreads(1)
+
+    def emitir(result):
+        nonlocal total_ok, terminadas
+        terminadas += 1
+        if result.get("ok"):
+            total_ok += 1
+        out.write(json.dumps(result, ensure_ascii=True) + "\n")
+        out.flush()
+        if terminadas % PROGRESO_CADA == 0:
+            elapsed = time.perf_counter() - start
+            print(f"⏱️ {terminadas}/{len(entries)} ({terminadas / elapsed:.1f} imágenes/s)", file=sys.stderr)
+
+    print(f"🚀 Lote de recorte manual: {len(entries)} imagen(es) con {workers} hilo(s)", file=sys.stderr)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crop') as pool:
+        futures = []
+        for entry, geometria, error in trabajos:
+            if error is not None:
+                emitir({"ok": False, "error": error, "input_path": entry.get("input_path"), "output_path": None})
+            else:
+                futures.append(pool.submit(recortar_entrada, entry, geometria))
+        for future in as_completed(futures):
+            emitir(future.result())
+
+    elapsed = time.perf_counter() - start
+    velocidad = len(entries) / elapsed if elapsed > 0 else 0.0
+    print(f"🎉 Lote de recorte manual completado: {total_ok}/{len(entries)} en {elapsed:.1f}s "
+          f"({velocidad:.1f} imágenes/s)", file=sys.stderr)
+    return {"total": len(entries), "ok": total_ok, "seconds": round(elapsed, 2),
+            "images_per_second": round(velocidad, 2), "workers": workers}
+
+def main_servicio(argv):
+    parser = argparse.ArgumentParser(description='Recorte manual: servicio (preview / commit) o lote')
+    parser.add_argument('--serve', action='store_true', help='Servidor JSON-lines caliente')
+    parser.add_argument('--once', action='store_true', help='Atender una sola petición JSON por stdin')
+    parser.add_argument('--batch', default=None, metavar='MANIFEST',
+                        help='Manifiesto JSON / JSON-lines con {input_path, output_path, points} ("-" = stdin)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('MANUAL_CROP_WORKERS', 0)) or None,
+                        help='Hilos del modo --batch (por defecto, uno por núcleo)')
+    parser.add_argument('--socket', default=os.environ.get('MANUAL_CROP_SOCKET'),
+                        help='Socket Unix del servidor (por defecto MANUAL_CROP_SOCKET o stdin/stdout)')
+    parser.add_argument('--cache-size', type=int, default=int(os.environ.get('MANUAL_CROP_CACHE_SIZE', 8)),
+                        help='Originales decodificados que se mantienen en memoria')
+    parser.add_argument('--cache-mb', type=float, default=float(os.environ.get('MANUAL_CROP_CACHE_MB', 1024)),
+                        help='Memoria máxima de la caché de originales en MB')
+    args = parser.parse_args(argv)
+    if not (args.serve or args.once or args.batch):
+        parser.error('se requiere --serve, --once o --batch')
+
+    if args.batch:
+        run_batch(load_manifest(args.batch), args.workers)
+        return
+
+    originales = OriginalesLRU(args.cache_size, args.cache_mb)
+    if args.once:
+        try:
+            response = handle_request(originales, json.loads(sys.stdin.read()))
+        except ValueError as e:
+            response = {"error": f"JSON inválido: {e}"}
+        print(json.dumps(response, ensure_ascii=True))
+        sys.exit(1 if "error" in response else 0)
+
+    run_server(originales, args.socket)
 
 if __name__ == "__main__":
+    instalar()  # PANEL_LOG_LEVEL / PANEL_LOG_FILE
+    if len(sys.argv) > 1 and sys.argv[1].startswith('--'):
+        main_servicio(sys.argv[1:])
+        sys.exit(0)
+
     try:
         if len(sys.argv) != 4:
             raise Exception("Uso: script.py input_path output_path 'x1_y1,x2_y2,x3_y3,x4_y4'")
         input_path = sys.argv[1]
         output_path = sys.argv[2]
         points = parse_points(sys.argv[3])
-        crop_and_warp(input_path, output_path, points)
+        # Con PANEL_TIMINGS / PANEL_METRICS_OUT se añade "timings" al JSON
+        crono = nuevo()
+        with usar(crono):
+            result = crop_and_warp(input_path, output_path, points)
+        print(json.dumps(registrar(result, crono, "manual_crop_transform", input_path), ensure_ascii=True))
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
         traceback.print_exc()
+        print(json.dumps(anotar({"error": str(e)})))
         sys.exit(1)
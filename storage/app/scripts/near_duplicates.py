@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Detección de casi-duplicados por hash perceptual.
+
+Cada imagen se decodifica reducida y en gris (cv2.IMREAD_REDUCED_GRAYSCALE_8:
+el JPEG se escala en el dominio DCT, sin decodificar a resolución completa) en
+un pool de procesos. Los hashes se calculan después para todo el lote a la vez
+con NumPy:
+  * dHash: gradiente horizontal sobre 9x8 -> 64 bits
+  * pHash: DCT 2D de 32x32 (producto de matrices sobre el lote completo),
+           8x8 de baja frecuencia comparados con su mediana -> 64 bits
+
+Los grupos se forman con un índice multi-index hashing: el hash se parte en
+4 tramos de 16 bits y, por el palomar, dos hashes a distancia <= d están a
+<= d // 4 en al menos un tramo. Solo se verifican los candidatos que comparten
+tramo (no todas las parejas), con búsquedas vectorizadas sobre el lote, y los
+vecinos se unen con union-find. En cada grupo el representante es la imagen
+más nítida (varianza del laplaciano), que es la que conviene procesar.
+
+Uso:
+  near_duplicates.py img1.jpg img2.jpg ...      [--hash phash|dhash] [--distance 8]
+  near_duplicates.py --dir carpeta/
+  near_duplicates.py --manifest lista.json      (lista de rutas o de {input_path})
+  near_duplicates.py --zip archivo.zip          (miembros de imagen, sin extraer)
+  ... [--members-out representantes.json]        (rutas de miembro completas para zip_ingest.py --members)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+LADO_PHASH = 32
+LADO_PHASH_BAJA = 8
+DISTANCIA_DEFECTO = 8
+
+def _iniciar_worker():
+    cv2.setNumThreads(1)
+
+def miniaturas(data):
+    """Gris reducido -> (9x8 para dHash, 32x32 para pHash, nitidez); None si no se puede decodificar"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    gris = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gris is None or gris.size == 0:
+        gris = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+    if gris is None or gris.size == 0:
+        return None
+
+    # Misma orientación que el pipeline: las horizontales se rotan a vertical
+    if gris.shape[1] > gris.shape[0]:
+        gris = cv2.rotate(gris, cv2.ROTATE_90_CLOCKWISE)
+
+    nitidez = float(cv2.Laplacian(gris, cv2.CV_32F).var())
+    d = cv2.resize(gris, (9, 8), interpolation=cv2.INTER_AREA)
+    p = cv2.resize(gris, (LADO_PHASH, LADO_PHASH), interpolation=cv2.INTER_AREA)
+    return d, p, nitidez
+
+def preparar(origen):
+    """Worker del pool: (nombre, bytes | ruta) -> (nombre, miniaturas | None, error)"""
+    nombre, fuente = origen
+    try:
+        if isinstance(fuente, str):
+            with open(fuente, 'rb') as f:
+                fuente = f.read()
+        resultado = miniaturas(fuente)
+        if resultado is None:
+            return nombre, None, "No se pudo decodificar la imagen"
+        return nombre, resultado, None
+    except Exception as e:
+        return nombre, None, str(e)
+
+# ============================================================
+# ✅ HASHES VECTORIZADOS (todo el lote a la vez)
+# ============================================================
+
+def _bits_a_enteros(bits):
+    """(N, 64) bool -> lista de enteros de 64 bits"""
+    empaquetados = np.packbits(bits.astype(np.uint8), axis=1)
+    return [int.from_bytes(fila.tobytes(), 'big') for fila in empaquetados]
+
+def dhash_lote(pequenas):
+    """(N, 8, 9) uint8 -> dHash de cada imagen"""
+    d = np.asarray(pequenas, dtype=np.int16)
+    return _bits_a_enteros((d[:, :, 1:] > d[:, :, :-1]).reshape(len(d), -1))
+
+def _matriz_dct(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+def phash_lote(medianas):
+    """(N, 32, 32) uint8 -> pHash de cada imagen (DCT-II 2D como D @ X @ D.T sobre el lote)"""
+    x = np.asarray(medianas, dtype=np.float32)
+    d = _matriz_dct(LADO_PHASH).astype(np.float32)
+    dct = np.matmul(np.matmul(d, x), d.T)[:, :LADO_PHASH_BAJA, :LADO_PHASH_BAJA].reshape(len(x), -1)
+    # La mediana excluye el coeficiente DC, que solo refleja el brillo medio
+    mediana = np.median(dct[:, 1:], axis=1, keepdims=True)
+    return _bits_a_enteros(dct > mediana)
+
+# Popcount de cada byte, para la distancia de Hamming vectorizada
+POPCOUNT_BYTE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# ============================================================
+# ✅ MULTI-INDEX HASHING + UNION-FIND
+# ============================================================
+
+TRAMOS = 4
+
+def tramos(radio, bits=64):
+    """
+    Tramos disjuntos de 16 bits y el radio de búsqueda en cada uno: por el palomar,
+    dos hashes a distancia <= radio están a <= radio // 4 en al menos un tramo.
+    """
+    limites = np.linspace(0, bits, TRAMOS + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(limites[:-1], limites[1:])], radio // TRAMOS
+
+def mascaras(ancho, radio):
+    """Máscaras XOR de `ancho` bits con como mucho `radio` bits a 1 (vecinos de una clave)"""
+    resultado = [0]
+    for _ in range(radio):
+        resultado = list({m | (1 << b) for m in resultado for b in range(ancho)} | set(resultado))
+    return resultado
+
+def pares_cercanos(hashes, radio):
+    """
+    Parejas (i, j, distancia) con i < j y distancia <= radio, por multi-index hashing
+    vectorizado: en cada tramo, las claves vecinas (clave ^ máscara) se buscan en
+    una tabla densa de recuentos y los candidatos se verifican con la distancia
+    completa, todo sobre arrays del lote completo.
+    """
+    h = np.asarray(hashes, dtype=np.uint64)
+    limites, subradio = tramos(radio)
+    encontrados = []
+
+    for inicio, fin in limites:
+        ancho = fin - inicio
+        claves = ((h >> np.uint64(64 - fin)) & np.uint64((1 << ancho) - 1)).astype(np.int64)
+        orden = np.argsort(claves, kind='stable')
+        # Tabla densa clave -> (inicio, número) en el orden de `orden` (2^16 entradas por tramo)
+        por_clave = np.bincount(claves, minlength=1 << ancho)
+        inicios = np.cumsum(por_clave) - por_clave
+
+        for mascara in mascaras(ancho, subradio):
+            buscadas = claves ^ mascara
+            izquierda = inicios[buscadas]
+            cuantos = por_clave[buscadas]
+            con = np.nonzero(cuantos)[0]
+            if not len(con):
+                continue
+
+            # Expande cada rango [izquierda, izquierda + cuantos) a parejas (i, j)
+            repeticiones = cuantos[con]
+            i = np.repeat(con, repeticiones)
+            desplazamiento = np.arange(len(i)) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones)
+            j = orden[np.repeat(izquierda[con], repeticiones) + desplazamiento]
+
+            validos = i < j
+            i, j = i[validos], j[validos]
+            xor = np.bitwise_xor(h[i], h[j])
+            distancias = POPCOUNT_BYTE[xor.view(np.uint8)].reshape(len(xor), 8).sum(axis=1)
+            cercanos = distancias <= radio
+            encontrados.append((i[cercanos], j[cercanos], distancias[cercanos]))
+
+    if not encontrados:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    return tuple(np.concatenate(partes) for partes in zip(*encontrados))
+
+def _raiz(padres, i):
+    while padres[i] != i:
+        padres[i] = padres[padres[i]]
+        i = padres[i]
+    return i
+
+def agrupar(hashes, radio):
+    """Grupos de índices conectados por distancia <= radio y la distancia máxima observada en cada uno"""
+    if not len(hashes):
+        return []
+
+    padres = list(range(len(hashes)))
+    distancia_max = [0] * len(hashes)
+
+    for i, j, d in zip(*(a.tolist() for a in pares_cercanos(hashes, radio))):
+        ri, rj = _raiz(padres, i), _raiz(padres, j)
+        if ri != rj:
+            padres[ri] = rj
+        distancia_max[j] = max(distancia_max[j], d)
+
+    grupos = {}
+    for i in range(len(hashes)):
+        grupos.setdefault(_raiz(padres, i), []).append(i)
+    return [(miembros, max(distancia_max[i] for i in miembros)) for miembros in grupos.values()]
+
+# ============================================================
+# ✅ ORÍGENES: rutas, carpeta, manifiesto o ZIP
+# ============================================================
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+def origenes_rutas(rutas):
+    return [(ruta, ruta) for ruta in rutas]
+
+def origenes_directorio(directorio):
+    rutas = []
+    for raiz, _, archivos in os.walk(directorio):
+        for nombre in sorted(archivos):
+            if nombre.lower().endswith(EXTENSIONES_IMAGEN) and not nombre.startswith('.'):
+                rutas.append(os.path.join(raiz, nombre))
+    return origenes_rutas(sorted(rutas))
+
+def origenes_manifiesto(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        entradas = json.load(f)
+    return origenes_rutas([e["input_path"] if isinstance(e, dict) else str(e) for e in entradas])
+
+def origenes_zip(zip_path):
+    """Generador (nombre, bytes) de los miembros de imagen, en el orden del directorio central"""
+    from zip_ingest import miembros_imagen
+
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in miembros_imagen(zf):
+            yield info.filename, zf.read(info)
+
+def detectar(origenes, tipo_hash="phash", radio=DISTANCIA_DEFECTO, workers=None):
+    """Hashes y grupos de casi-duplicados para un iterable de (nombre, bytes | ruta)"""
+    workers = max(1, workers or os.cpu_count() or 1)
+    start = time.perf_counter()
+
+    preparadas, errores = {}, []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker) as pool:
+        # Ventana acotada: con un ZIP solo hay 4 x workers miembros en memoria a la vez
+        pendientes = iter(enumerate(origenes))
+        en_vuelo = {}
+
+        def rellenar():
+            for posicion, origen in pendientes:
+                en_vuelo[pool.submit(preparar, origen)] = posicion
+                if len(en_vuelo) >= workers * 4:
+                    return
+
+        rellenar()
+        while en_vuelo:
+            terminadas, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for future in terminadas:
+                posicion = en_vuelo.pop(future)
+                nombre, resultado, error = future.result()
+                if error is not None:
+                    print(f"⚠️ {nombre}: {error}", file=sys.stderr)
+                    errores.append({"name": nombre, "error": error})
+                else:
+                    preparadas[posicion] = (nombre,) + resultado
+            rellenar()
+
+    # Orden de entrada, independiente del orden de finalización
+    ordenadas = [preparadas[posicion] for posicion in sorted(preparadas)]
+    nombres = [p[0] for p in ordenadas]
+    pequenas = [p[1] for p in ordenadas]
+    medianas = [p[2] for p in ordenadas]
+    nitidez = [p[3] for p in ordenadas]
+
+    hashes = []
+    if nombres:
+        hashes = phash_lote(medianas) if tipo_hash == "phash" else dhash_lote(pequenas)
+
+    grupos = []
+    for miembros, distancia in sorted(agrupar(hashes, radio), key=lambda g: min(g[0])):
+        representante = max(miembros, key=lambda i: nitidez[i])
+        grupos.append({
+            "representante": nombres[representante],
+            "miembros": [nombres[i] for i in miembros],
+            "distancia_max": distancia,
+        })
+
+    elapsed = time.perf_counter() - start
+    duplicados = sum(len(g["miembros"]) - 1 for g in grupos)
+    print(f"🧬 {len(nombres)} imágenes, {len(grupos)} grupo(s), {duplicados} casi-duplicado(s) en {elapsed:.1f}s",
+          file=sys.stderr)
+
+    return {
+        "success": True,
+        "hash": tipo_hash,
+        "distancia": radio,
+        "total": len(nombres),
+        "grupos_total": len(grupos),
+        "duplicados": duplicados,
+        "representantes": [g["representante"] for g in grupos],
+        "grupos": [g for g in grupos if len(g["miembros"]) > 1],
+        "hashes": {nombre: f"{valor:016x}" for nombre, valor in zip(nombres, hashes)},
+        "errores": errores,
+        "segundos": round(elapsed, 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Agrupa imágenes casi duplicadas por hash perceptual')
+    parser.add_argument('paths', nargs='*', help='Imágenes a comparar')
+    parser.add_argument('--dir', default=None, help='Carpeta con imágenes (recursiva)')
+    parser.add_argument('--manifest', default=None, help='JSON con rutas o entradas {input_path}')
+    parser.add_argument('--zip', default=None, help='ZIP cuyos miembros de imagen se comparan sin extraer')
+    parser.add_argument('--hash', default='phash', choices=['phash', 'dhash'], help='Hash perceptual a usar')
+    parser.add_argument('--distance', type=int, default=DISTANCIA_DEFECTO,
+                        help='Distancia de Hamming máxima (de 64 bits) para considerar dos imágenes casi iguales')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DEDUP_WORKERS', 0)) or None,
+                        help='Procesos de decodificación (por defecto, núcleos disponibles)')
+    parser.add_argument('--members-out', default=None,
+                        help='Escribe las rutas completas de los representantes (una imagen por grupo) '
+                             'para zip_ingest.py --members')
+    args = parser.parse_args()
+
+    try:
+        if args.zip:
+            origenes = origenes_zip(args.zip)
+        elif args.dir:
+            origenes = origenes_directorio(args.dir)
+        elif args.manifest:
+            origenes = origenes_manifiesto(args.manifest)
+        elif args.paths:
+            origenes = origenes_rutas(args.paths)
+        else:
+            parser.error('Se requieren rutas, --dir, --manifest o --zip')
+
+        result = detectar(origenes, args.hash, args.distance, args.workers)
+        if args.members_out:
+            with open(args.members_out, 'w', encoding='utf-8') as f:
+                json.dump(result["representantes"], f, ensure_ascii=True)
+        print(json.dumps(result, ensure_ascii=True))
+    except Exception as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=True))
+        traceback.print_exc()
+        sys.exit(1)
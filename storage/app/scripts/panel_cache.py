@@ -0,0 +1,246 @@
+"""
+Caché de resultados direccionada por contenido.
+
+Clave = sha256 de (bytes de entrada, hash del modelo, algorithm_version y
+parámetros que cambian la salida: filas, columnas, confidence, derivados...).
+Valor = JSON del resultado + imagen procesada + derivados, en un directorio
+por entrada dentro de la caché:
+
+  <cache_dir>/<clave[:2]>/<clave>/result.json
+                                  output<ext>
+                                  <tipo><ext>   (derivados)
+
+Un acierto copia los archivos a las rutas pedidas y devuelve el JSON sin
+cargar el modelo ni decodificar la imagen. La expulsión es LRU por tamaño: cada
+acierto actualiza el mtime de la entrada y, al superar el máximo, se borran las
+entradas con el mtime más antiguo.
+
+La caché se activa con --cache-dir o PANEL_CACHE_DIR; el tamaño máximo con
+--cache-max-mb o PANEL_CACHE_MAX_MB (2048 por defecto).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from panel_derivatives import ruta_derivado
+from panel_io import extension_salida
+
+TAMANO_BLOQUE = 1024 * 1024
+MAX_MB_DEFECTO = 2048
+
+def hash_origen(origen):
+    """sha256 de bytes en memoria o de un archivo leído por bloques"""
+    h = hashlib.sha256()
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        h.update(origen)
+        return h.hexdigest()
+
+    with open(origen, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _tamano_directorio(ruta):
+    total = 0
+    for nombre in os.listdir(ruta):
+        try:
+            total += os.path.getsize(os.path.join(ruta, nombre))
+        except OSError:
+            pass
+    return total
+
+class ResultCache:
+    def __init__(self, directorio, max_mb=MAX_MB_DEFECTO):
+        self.directorio = directorio
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self._total = None
+        self._hash_modelos = {}
+        os.makedirs(directorio, exist_ok=True)
+
+    @classmethod
+    def desde_argumentos(cls, directorio=None, max_mb=None):
+        """Instancia a partir de CLI / entorno; None si la caché no está activada"""
+        directorio = directorio or os.environ.get('PANEL_CACHE_DIR')
+        if not directorio:
+            return None
+        max_mb = max_mb or os.environ.get('PANEL_CACHE_MAX_MB') or MAX_MB_DEFECTO
+        try:
+            return cls(directorio, max_mb)
+        except OSError as e:
+            print(f"⚠️ Caché de resultados desactivada ({directorio}): {e}", file=sys.stderr)
+            return None
+
+    # ------------------------------------------------------------
+    # Claves
+    # ------------------------------------------------------------
+
+    def hash_modelo(self, model_path):
+        """Hash del archivo del modelo, memorizado por (ruta, tamaño, mtime) dentro de la caché"""
+        if not model_path or not os.path.exists(model_path):
+            return None
+
+        stat = os.stat(model_path)
+        firma = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        if firma in self._hash_modelos:
+            return self._hash_modelos[firma]
+
+        # Hashear un .pt de decenas de MB en cada ejecución CLI anularía el acierto: se guarda en disco
+        marca = os.path.join(self.directorio, 'modelos', hashlib.sha256(firma.encode('utf-8')).hexdigest())
+        try:
+            with open(marca, 'r', encoding='ascii') as f:
+                valor = f.read().strip()
+        except OSError:
+            valor = hash_origen(model_path)
+            os.makedirs(os.path.dirname(marca), exist_ok=True)
+            with open(marca, 'w', encoding='ascii') as f:
+                f.write(valor)
+
+        self._hash_modelos[firma] = valor
+        return valor
+
+    def clave(self, origen, output, model_path, algorithm_version, **params):
+        """Clave de la entrada; el formato de salida (extensión o stream) también forma parte de ella"""
+        partes = {
+            "input": hash_origen(origen),
+            "output": extension_salida(output) if isinstance(output, str) else "stream",
+            "model": self.hash_modelo(model_path),
+            "algorithm_version": algorithm_version,
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(partes, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    # ------------------------------------------------------------
+    # Lectura / escritura
+    # ------------------------------------------------------------
+
+    def obtener(self, clave, output):
+        """
+        Si la clave existe, escribe la imagen en `output` (ruta o BytesIO), copia los
+        derivados junto a ella y devuelve el dict de resultado; None si no hay acierto.
+        """
+        ruta = self._ruta(clave)
+        try:
+            with open(os.path.join(ruta, 'result.json'), 'r', encoding='utf-8') as f:
+                result = json.load(f)
+
+            imagen = os.path.join(ruta, result.pop("_cache_output"))
+            if isinstance(output, str):
+                if os.path.dirname(output):
+                    os.makedirs(os.path.dirname(output), exist_ok=True)
+                shutil.copyfile(imagen, output)
+            else:
+                with open(imagen, 'rb') as f:
+                    output.write(f.read())
+
+            if "derivados" in result and not isinstance(output, str):
+                result["derivados"] = []  # igual que generar_derivados con salida en memoria
+            for derivado in result.get("derivados") or []:
+                derivado["path"] = ruta_derivado(output, derivado["tipo"])
+                shutil.copyfile(os.path.join(ruta, derivado.pop("_cache_file")), derivado["path"])
+
+            os.utime(ruta)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        result["cache"] = "hit"
+        print(f"⚡ Resultado en caché: {clave[:12]}", file=sys.stderr)
+        return result
+
+    def guardar(self, clave, result, output):
+        """Guarda el resultado correcto y sus archivos; los fallos de la caché nunca rompen el procesamiento"""
+        if not result.get("success", True):
+            return
+
+        ruta = self._ruta(clave)
+        temporal = None
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            temporal = tempfile.mkdtemp(prefix='.tmp_', dir=os.path.dirname(ruta))
+
+            guardado = json.loads(json.dumps(result))
+            guardado["_cache_output"] = "output" + extension_salida(output)
+            destino = os.path.join(temporal, guardado["_cache_output"])
+            if isinstance(output, str):
+                shutil.copyfile(output, destino)
+            else:
+                with open(destino, 'wb') as f:
+                    f.write(output.getvalue())
+
+            for derivado in guardado.get("derivados") or []:
+                if not derivado.get("path"):
+                    raise OSError(f"Derivado {derivado.get('tipo')} sin archivo")
+                derivado["_cache_file"] = derivado["tipo"] + os.path.splitext(derivado["path"])[1]
+                shutil.copyfile(derivado["path"], os.path.join(temporal, derivado["_cache_file"]))
+
+            with open(os.path.join(temporal, 'result.json'), 'w', encoding='utf-8') as f:
+                json.dump(guardado, f, ensure_ascii=True)
+
+            # rename atómico: otro proceso nunca ve una entrada a medias
+            try:
+                os.rename(temporal, ruta)
+            except OSError:
+                shutil.rmtree(temporal, ignore_errors=True)  # otro proceso ya la guardó
+                return
+            temporal = None
+
+            self._sumar(_tamano_directorio(ruta))
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar en caché: {e}", file=sys.stderr)
+        finally:
+            if temporal:
+                shutil.rmtree(temporal, ignore_errors=True)
+
+    # ------------------------------------------------------------
+    # Expulsión LRU por tamaño
+    # ------------------------------------------------------------
+
+    def _entradas(self):
+        """(mtime, tamaño, ruta) de cada entrada completa de la caché"""
+        entradas = []
+        for prefijo in os.listdir(self.directorio):
+            carpeta = os.path.join(self.directorio, prefijo)
+            if len(prefijo) != 2 or not os.path.isdir(carpeta):
+                continue
+            for clave in os.listdir(carpeta):
+                ruta = os.path.join(carpeta, clave)
+                if clave.startswith('.'):
+                    continue
+                try:
+                    entradas.append((os.stat(ruta).st_mtime, _tamano_directorio(ruta), ruta))
+                except OSError:
+                    pass
+        return entradas
+
+    def _sumar(self, tamano):
+        # El total se calcula una vez por proceso y después se lleva incrementalmente
+        if self._total is None:
+            self._total = sum(t for _, t, _ in self._entradas())
+        else:
+            self._total += tamano
+        if self._total > self.max_bytes:
+            self.expulsar()
+
+    def expulsar(self):
+        """Borra las entradas menos usadas hasta quedar en el 90% del máximo"""
+        entradas = sorted(self._entradas())
+        total = sum(t for _, t, _ in entradas)
+        objetivo = int(self.max_bytes * 0.9)
+        borradas = 0
+
+        for _, tamano, ruta in entradas:
+            if total <= objetivo:
+                break
+            shutil.rmtree(ruta, ignore_errors=True)
+            total -= tamano
+            borradas += 1
+
+        self._total = total
+        if borradas:
+            print(f"🧹 Caché: {borradas} entrada(s) expulsadas, {total / 1048576:.1f} MB en uso", file=sys.stderr)
@@ -0,0 +1,106 @@
+"""
+Derivados de la imagen procesada generados en la misma pasada.
+
+A partir del array `enhanced` que ya está en memoria se codifican versiones
+reducidas (miniatura, tamaño informe y previsualización WebP opcional), cada
+una con sus propios parámetros de codificación. Se evita volver a descargar y
+decodificar la imagen procesada en PHP (Imagick) para generarlas.
+
+Los derivados se escriben junto a la salida principal: <base>_<tipo><ext>.
+"""
+
+import os
+import sys
+
+import cv2
+
+from panel_io import guardar_imagen
+
+# Lado mayor máximo (solo se reduce, nunca se amplía) y parámetros de codificación
+DERIVADOS = {
+    "thumb": {
+        "lado": 480,
+        "ext": ".jpg",
+        "formato": "jpeg",
+        "calidad": 80,
+        "params": [cv2.IMWRITE_JPEG_QUALITY, 80],
+    },
+    "report": {
+        "lado": 1600,
+        "ext": ".jpg",
+        "formato": "jpeg",
+        "calidad": 85,
+        "params": [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+    },
+    "webp": {
+        "lado": 1024,
+        "ext": ".webp",
+        "formato": "webp",
+        "calidad": 75,
+        "params": [cv2.IMWRITE_WEBP_QUALITY, 75],
+    },
+}
+
+def parse_derivados(texto):
+    """Lista de tipos a partir de "thumb,report,webp"; lanza Exception si alguno no existe"""
+    if not texto:
+        return []
+    if isinstance(texto, (list, tuple)):
+        tipos = [str(t).strip() for t in texto]
+    else:
+        tipos = [t.strip() for t in str(texto).split(',')]
+    tipos = [t for t in tipos if t]
+
+    desconocidos = [t for t in tipos if t not in DERIVADOS]
+    if desconocidos:
+        raise Exception(f"Derivados desconocidos: {', '.join(desconocidos)} (válidos: {', '.join(DERIVADOS)})")
+    return list(dict.fromkeys(tipos))
+
+def ruta_derivado(output_path, tipo):
+    base = os.path.splitext(output_path)[0]
+    return f"{base}_{tipo}{DERIVADOS[tipo]['ext']}"
+
+def reducir(img, lado):
+    """Equivalente a scaleDown(lado, lado): encaja en un cuadrado sin ampliar"""
+    h, w = img.shape[:2]
+    factor = min(1.0, lado / float(max(h, w)))
+    if factor >= 1.0:
+        return img
+    size = (max(1, int(round(w * factor))), max(1, int(round(h * factor))))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def generar_derivados(img, output_path, tipos):
+    """
+    Codifica los derivados pedidos desde el array en memoria y devuelve su
+    descripción para el JSON de salida. Se reducen de mayor a menor lado,
+    cada uno a partir del anterior, para no recorrer la imagen completa más
+    de una vez.
+    """
+    if not tipos:
+        return []
+
+    if not isinstance(output_path, str):
+        print("⚠️ Derivados omitidos: la salida principal no es una ruta en disco", file=sys.stderr)
+        return []
+
+    derivados = []
+    fuente = img
+    for tipo in sorted(tipos, key=lambda t: DERIVADOS[t]["lado"], reverse=True):
+        spec = DERIVADOS[tipo]
+        fuente = reducir(fuente, spec["lado"])
+        path = ruta_derivado(output_path, tipo)
+        size = guardar_imagen(fuente, path, spec["params"])
+
+        derivados.append({
+            "tipo": tipo,
+            "path": path,
+            "ancho": int(fuente.shape[1]),
+            "alto": int(fuente.shape[0]),
+            "formato": spec["formato"],
+            "calidad": spec["calidad"],
+            "bytes": int(size),
+        })
+        print(f"🖼️ Derivado {tipo}: {fuente.shape[1]}x{fuente.shape[0]} ({size} bytes)", file=sys.stderr)
+
+    # Mismo orden en el que se pidieron
+    return sorted(derivados, key=lambda d: tipos.index(d["tipo"]))
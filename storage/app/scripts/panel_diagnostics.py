@@ -0,0 +1,210 @@
+"""
+Canal de diagnóstico acotado: ningún script puede bloquearse con la tubería de stderr llena.
+
+PHP lee stdout/stderr del proceso hijo con proc_open; si el hijo escribe más
+de lo que cabe en la tubería (64 KB) antes de que alguien la lea, se queda
+bloqueado en write() y el job parece una imagen lenta hasta el timeout.
+
+Con el modo diagnóstico activo (--log-level / --log-file, o PANEL_LOG_LEVEL /
+PANEL_LOG_FILE / PANEL_DIAGNOSTICS) sys.stderr se sustituye por un canal que:
+  * clasifica cada línea por nivel a partir de su prefijo: 💀/❌/Traceback =
+    error, ⚠️ = warning, detalle de cada paso (📐 🔍 🔄 💾 ...) = debug, resto = info,
+  * guarda las líneas del nivel pedido en un buffer circular (PANEL_LOG_RING
+    líneas) y, si hay --log-file, las añade al archivo con un
+    logging.handlers.WatchedFileHandler: varios procesos pueden compartir el
+    archivo y la rotación es externa (logrotate); cada proceso reabre el
+    archivo en cuanto detecta que lo han rotado,
+  * deja pasar al stderr real solo warning y error, hasta PANEL_LOG_STDERR_KB
+    en total; el resto se cuenta como suprimido.
+El descriptor 2 se redirige a /dev/null (nunca al log compartido, que no
+controlaría la rotación), así que tampoco las librerías nativas (libjpeg,
+OpenCV) pueden llenar la tubería.
+
+anotar(result) añade al JSON un resumen acotado en "diagnostico" (contadores
+por nivel y las últimas líneas relevantes) y recorta el traceback.
+"""
+
+import atexit
+import collections
+import io
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+NIVELES = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+PREFIJOS_ERROR = ("💀", "❌", "Traceback")
+PREFIJOS_WARNING = ("⚠️", "⚠")
+PREFIJOS_DEBUG = ("📐", "🔍", "🔎", "🔄", "📂", "💾", "📉", "📏", "🖼", "✨", "🤖", "📥")
+RING_DEFECTO = 200
+STDERR_KB_DEFECTO = 16
+MAX_LINEA = 300
+MAX_RESUMEN = 20
+MAX_TRACEBACK = 4000
+
+_instalado = None
+
+def _nombre(nivel):
+    return next(nombre for nombre, valor in NIVELES.items() if valor == nivel)
+
+def parse_nivel(nivel):
+    nivel = (nivel or 'info').lower()
+    if nivel not in NIVELES:
+        raise Exception(f"Nivel de log desconocido: {nivel} (válidos: {', '.join(NIVELES)})")
+    return NIVELES[nivel]
+
+class CanalDiagnostico(io.TextIOBase):
+    def __init__(self, nivel, consola, log_file=None):
+        super().__init__()
+        self.nivel = nivel
+        self.consola = consola
+        self.log_file = log_file
+        self.ring = collections.deque(maxlen=int(os.environ.get('PANEL_LOG_RING', RING_DEFECTO)))
+        self.por_nivel = collections.Counter()
+        self.cupo_consola = int(float(os.environ.get('PANEL_LOG_STDERR_KB', STDERR_KB_DEFECTO)) * 1024)
+        self.suprimidas = 0
+        self._pendiente = ''
+        self._en_traceback = False
+        self._lock = threading.RLock()
+        self._log = logging.handlers.WatchedFileHandler(log_file, encoding='utf-8') if log_file else None
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def write(self, texto):
+        with self._lock:
+            self._pendiente += texto
+            *lineas, self._pendiente = self._pendiente.split('\n')
+            for linea in lineas:
+                self._linea(linea)
+        return len(texto)
+
+    def flush(self):
+        with self._lock:
+            if self._log:
+                self._log.flush()
+            try:
+                self.consola.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _clasificar(self, linea):
+        if linea.startswith("Traceback"):
+            self._en_traceback = True
+            return NIVELES["error"]
+        if self._en_traceback:
+            # El traceback termina con la primera línea sin sangría (la excepción)
+            if not linea.startswith((' ', '\t')):
+                self._en_traceback = False
+            return NIVELES["error"]
+        if linea.startswith(PREFIJOS_ERROR):
+            return NIVELES["error"]
+        if linea.startswith(PREFIJOS_WARNING):
+            return NIVELES["warning"]
+        if linea.startswith(PREFIJOS_DEBUG):
+            return NIVELES["debug"]
+        return NIVELES["info"]
+
+    def _linea(self, linea):
+        if not linea.strip():
+            return
+        nivel = self._clasificar(linea)
+        self.por_nivel[_nombre(nivel)] += 1
+        if nivel < self.nivel:
+            return
+
+        self.ring.append((nivel, linea[:MAX_LINEA]))
+        if self._log:
+            self._escribir_log(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {_nombre(nivel).upper()} "
+                               f"[{os.getpid()}] {linea}\n")
+
+        if nivel >= NIVELES["warning"]:
+            datos = (linea[:MAX_LINEA] + '\n').encode('utf-8', 'replace')
+            if len(datos) <= self.cupo_consola:
+                self.cupo_consola -= len(datos)
+                try:
+                    self.consola.write(datos.decode('utf-8', 'replace'))
+                    self.consola.flush()
+                except (OSError, ValueError):
+                    pass
+            else:
+                self.suprimidas += 1
+
+    def _escribir_log(self, registro):
+        # Directo al stream del handler, sin LogRecord: los scripts desactivan logging para silenciar Ultralytics
+        try:
+            self._log.reopenIfNeeded()
+            self._log.stream.write(registro)
+            self._log.stream.flush()
+        except (OSError, ValueError, AttributeError):
+            self._log = None  # sin log antes que romper el procesamiento
+
+    def resumen(self):
+        with self._lock:
+            relevantes = [(n, l) for n, l in self.ring if n >= NIVELES["warning"]] or list(self.ring)
+            return {
+                "nivel": _nombre(self.nivel),
+                "lineas": dict(self.por_nivel),
+                "stderr_suprimidas": self.suprimidas,
+                "log_file": self.log_file,
+                "ultimas": [f"{_nombre(n)}: {l}" for n, l in relevantes[-MAX_RESUMEN:]],
+            }
+
+    def cerrar(self):
+        with self._lock:
+            if self._pendiente:
+                self._linea(self._pendiente)
+                self._pendiente = ''
+            if self.suprimidas:
+                aviso = f"⚠️ {self.suprimidas} línea(s) de diagnóstico no enviadas a stderr"
+                aviso += f" (ver {self.log_file})\n" if self.log_file else " (ver \"diagnostico\" en el JSON)\n"
+                try:
+                    self.consola.write(aviso)
+                    self.consola.flush()
+                except (OSError, ValueError):
+                    pass
+            if self._log:
+                self._log.close()
+                self._log = None
+
+def instalar(nivel=None, log_file=None):
+    """
+    Activa el canal si se pidió por argumento o entorno; devuelve el canal o None.
+    Debe llamarse al arrancar el script, antes de cualquier salida por stderr.
+    """
+    global _instalado
+    nivel = nivel or os.environ.get('PANEL_LOG_LEVEL')
+    log_file = log_file or os.environ.get('PANEL_LOG_FILE') or None
+    activado = nivel or log_file or os.environ.get('PANEL_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+    if not activado or _instalado is not None:
+        return _instalado
+
+    if log_file and os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    # stderr real para warning/error; el descriptor 2 pasa a /dev/null para la salida nativa
+    sys.stderr.flush()
+    consola = os.fdopen(os.dup(2), 'w', encoding='utf-8', errors='replace', buffering=1)
+    nativo = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(nativo, 2)
+    os.close(nativo)
+
+    _instalado = CanalDiagnostico(parse_nivel(nivel), consola, log_file)
+    sys.stderr = _instalado
+    atexit.register(_instalado.cerrar)
+    return _instalado
+
+def anotar(result):
+    """Añade el resumen acotado al resultado y recorta el traceback (solo con el canal activo)"""
+    if _instalado is None or not isinstance(result, dict):
+        return result
+    if isinstance(result.get("traceback"), str) and len(result["traceback"]) > MAX_TRACEBACK:
+        result["traceback"] = "..." + result["traceback"][-MAX_TRACEBACK:]
+    result["diagnostico"] = _instalado.resumen()
+    return result
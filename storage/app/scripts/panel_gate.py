@@ -0,0 +1,132 @@
+"""
+Compuerta de rechazo temprano: descarta en milisegundos, antes de cargar el
+modelo, las imágenes que ninguna estrategia va a poder procesar.
+
+Orden de comprobaciones (se corta en la primera que falla):
+  1. cabecera (image_headers, sin leer el archivo entero): archivo vacío o
+     dimensiones por debajo de LADO_MINIMO,
+  2. decodificación reducida en gris (IMREAD_REDUCED_GRAYSCALE_8); una
+     cabecera que image_headers no reconoce (TIFF...) o no puede leer, o un
+     JPEG sin marcador EOI (FFD9) en los últimos bytes (truncado, o con datos
+     de fabricante/térmicos añadidos tras el EOI) solo se rechaza si OpenCV
+     tampoco la decodifica,
+  3. estadísticas sobre una muestra con paso fijo de la imagen reducida:
+     los mismos umbrales que es_imagen_totalmente_inutilizable.
+
+evaluar() devuelve {"ok", "codigo", "motivo", "ms", ...}; comprobar() es lo
+que llaman los scripts: None si la imagen pasa, o el dict de error con
+"reject_code" si se rechaza. Se desactiva con PANEL_EARLY_REJECT=0.
+
+Un archivo que no existe o no se puede leer no se rechaza aquí: es un error
+normal del script, no una imagen inutilizable.
+
+Códigos de rechazo: archivo_vacio, formato_no_reconocido,
+cabecera_invalida, dimensiones_insuficientes, jpeg_truncado, no_decodificable,
+imagen_negra, imagen_sobreexpuesta.
+"""
+
+import io
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from image_headers import leer_cabecera
+from panel_metrics import es_imagen_totalmente_inutilizable
+from panel_timings import medir
+
+LADO_MINIMO = 64
+COLA_EOI = 4096          # bytes finales donde buscar FFD9; sin él decide la decodificación
+MUESTRAS_OBJETIVO = 4096
+
+def activada():
+    return os.environ.get('PANEL_EARLY_REJECT', '1').lower() not in ('0', 'false', 'no')
+
+def _cabecera_y_cola(origen):
+    """Cabecera y últimos COLA_EOI bytes sin leer el archivo entero (OSError si no se puede leer)"""
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        datos = bytes(origen)
+        return leer_cabecera(io.BytesIO(datos)), datos[-COLA_EOI:]
+    with open(origen, 'rb') as f:
+        info = leer_cabecera(f)
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - COLA_EOI))
+        return info, f.read()
+
+def _decodificar_reducida(origen):
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(origen, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    return cv2.imread(origen, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+def _rechazo(codigo, motivo, start, **extra):
+    return dict({"ok": False, "codigo": codigo, "motivo": motivo,
+                 "ms": round((time.perf_counter() - start) * 1000, 2)}, **extra)
+
+def codigo_cabecera(info):
+    motivo = info.get("motivo") or ""
+    if motivo == "Archivo vacío":
+        return "archivo_vacio"
+    if motivo == "Formato de imagen no reconocido":
+        return "formato_no_reconocido"
+    return "cabecera_invalida"
+
+def evaluar(origen):
+    """
+    Comprueba una imagen (ruta o bytes codificados). Un archivo que no se puede
+    leer no es una imagen inutilizable sino un error de ruta/configuración:
+    el OSError se propaga al camino de error normal del script.
+    """
+    start = time.perf_counter()
+    info, cola = _cabecera_y_cola(origen)
+
+    if info["corrupto"] and codigo_cabecera(info) == "archivo_vacio":
+        return _rechazo("archivo_vacio", info["motivo"], start)
+    # Cabecera no reconocida (TIFF...) o dudosa: decide la decodificación de OpenCV
+    if not info["corrupto"] and min(info["ancho"], info["alto"]) < LADO_MINIMO:
+        return _rechazo("dimensiones_insuficientes", f"Imagen de {info['ancho']}x{info['alto']} px", start)
+    # Sin EOI en la cola puede ser un JPEG truncado o uno con datos añadidos tras el EOI
+    sin_eoi = not info["corrupto"] and info["formato"] == "jpeg" and b'\xff\xd9' not in cola
+
+    reducida = _decodificar_reducida(origen)
+    if reducida is None or reducida.size == 0:
+        if info["corrupto"]:
+            return _rechazo(codigo_cabecera(info), info["motivo"], start)
+        if sin_eoi:
+            return _rechazo("jpeg_truncado", "JPEG sin marcador de fin de imagen (archivo truncado)", start)
+        return _rechazo("no_decodificable", "OpenCV no pudo decodificar la imagen", start)
+
+    paso = max(1, int(np.sqrt(reducida.size / MUESTRAS_OBJETIVO)))
+    muestra = reducida[::paso, ::paso].astype(np.float32)
+    media, std = float(muestra.mean()), float(muestra.std())
+    inutilizable, mensaje = es_imagen_totalmente_inutilizable({"media": media, "std": std})
+    estadisticas = {"media": round(media, 2), "std": round(std, 2), "muestras": int(muestra.size)}
+    if inutilizable:
+        return _rechazo("imagen_negra" if media < 128 else "imagen_sobreexpuesta", mensaje, start,
+                        estadisticas=estadisticas)
+
+    return {"ok": True, "codigo": None, "motivo": None, "ms": round((time.perf_counter() - start) * 1000, 2),
+            "formato": info["formato"], "estadisticas": estadisticas}
+
+def resultado_rechazo(gate):
+    """Dict de error de los scripts para una imagen rechazada por la compuerta"""
+    return {
+        "success": False,
+        "error": f"Imagen rechazada antes del procesamiento: {gate['motivo']}",
+        "method": "early_reject",
+        "reject_code": gate["codigo"],
+        "gate": gate,
+    }
+
+def comprobar(origen):
+    """None si la imagen pasa la compuerta (o está desactivada); si no, el dict de error del script.
+    Los errores de lectura (OSError) se propagan al camino de error normal."""
+    if not activada():
+        return None
+    with medir("gate"):
+        gate = evaluar(origen)
+    if gate["ok"]:
+        return None
+    print(f"🚫 Imagen rechazada ({gate['codigo']}) en {gate['ms']} ms: {gate['motivo']}", file=sys.stderr)
+    return resultado_rechazo(gate)
@@ -0,0 +1,90 @@
+"""
+Estadísticas por celda del panel ya recortado (filas x columnas).
+
+Con una imagen integral del gris (y su integral de cuadrados) la suma de
+cualquier celda son cuatro lecturas, así que media y desviación de todas las
+celdas salen en O(1) por celda, vectorizado sobre la rejilla completa. La
+fracción oscura usa una tercera integral de la máscara gris < umbral_oscuro.
+
+El resultado va en la clave "celdas" del JSON:
+
+  {"filas": 24, "columnas": 6, "transpuesta": false, "umbral_oscuro": 50,
+   "media": [[...], ...], "std": [[...], ...], "oscuro": [[...], ...],
+   "atipicas": [{"fila": 3, "columna": 1, "motivo": "oscura", "z": -5.2}, ...]}
+
+Las filas van siempre a lo largo del lado mayor del panel cuando filas >=
+columnas (y al revés), así que la matriz no depende de si el recorte salió
+vertical u horizontal. Una celda es atípica si su media o su desviación se
+aleja de la mediana del panel más de UMBRAL_Z desviaciones robustas (MAD).
+"""
+
+import cv2
+import numpy as np
+
+from panel_metrics import canal_gris
+
+VERSION = 1
+UMBRAL_OSCURO = 50
+UMBRAL_Z = 3.5
+MAD_MINIMA = 1.0  # en niveles de gris: paneles muy uniformes no marcan celdas por ruido
+
+def limites(total, partes):
+    """Bordes enteros de `partes` tramos lo más iguales posible"""
+    return np.linspace(0, total, partes + 1).round().astype(np.intp)
+
+def sumas_celdas(integral, ys, xs):
+    """Suma de cada celda (len(ys)-1 x len(xs)-1) con cuatro lecturas de la integral"""
+    return (integral[ys[1:, None], xs[None, 1:]] - integral[ys[:-1, None], xs[None, 1:]]
+            - integral[ys[1:, None], xs[None, :-1]] + integral[ys[:-1, None], xs[None, :-1]])
+
+def z_robusto(valores):
+    mediana = np.median(valores)
+    mad = max(np.median(np.abs(valores - mediana)) * 1.4826, MAD_MINIMA)
+    return (valores - mediana) / mad
+
+def estadisticas_celdas(img, filas, columnas, umbral_oscuro=UMBRAL_OSCURO, gray=None):
+    """Matrices filas x columnas de media, std y fracción oscura, más las celdas atípicas"""
+    filas, columnas = int(filas), int(columnas)
+    gray = canal_gris(img) if gray is None else gray
+
+    suma, suma_cuadrados = cv2.integral2(gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    oscuros = cv2.integral((gray < umbral_oscuro).view(np.uint8), sdepth=cv2.CV_32S)
+
+    # La integral de la traspuesta es la traspuesta de la integral: basta con una vista
+    transpuesta = (gray.shape[0] >= gray.shape[1]) != (filas >= columnas)
+    if transpuesta:
+        suma, suma_cuadrados, oscuros = suma.T, suma_cuadrados.T, oscuros.T
+
+    alto, ancho = suma.shape[0] - 1, suma.shape[1] - 1
+    filas = max(1, min(filas, alto))
+    columnas = max(1, min(columnas, ancho))
+
+    ys = limites(alto, filas)
+    xs = limites(ancho, columnas)
+    areas = np.diff(ys)[:, None] * np.diff(xs)[None, :]
+
+    media = sumas_celdas(suma, ys, xs) / areas
+    varianza = sumas_celdas(suma_cuadrados, ys, xs) / areas - media ** 2
+    std = np.sqrt(np.maximum(varianza, 0.0))
+    oscuro = sumas_celdas(oscuros, ys, xs) / areas
+
+    atipicas = []
+    z_media = z_robusto(media)
+    z_std = z_robusto(std)
+    for fila, columna in zip(*np.nonzero((np.abs(z_media) > UMBRAL_Z) | (np.abs(z_std) > UMBRAL_Z))):
+        if abs(z_media[fila, columna]) > UMBRAL_Z:
+            motivo, z = ("oscura" if z_media[fila, columna] < 0 else "brillante"), z_media[fila, columna]
+        else:
+            motivo, z = "irregular" if z_std[fila, columna] > 0 else "plana", z_std[fila, columna]
+        atipicas.append({"fila": int(fila), "columna": int(columna), "motivo": motivo, "z": round(float(z), 2)})
+
+    return {
+        "filas": filas,
+        "columnas": columnas,
+        "transpuesta": bool(transpuesta),
+        "umbral_oscuro": int(umbral_oscuro),
+        "media": media.round(1).tolist(),
+        "std": std.round(1).tolist(),
+        "oscuro": oscuro.round(3).tolist(),
+        "atipicas": atipicas,
+    }
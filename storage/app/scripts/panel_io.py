@@ -0,0 +1,113 @@
+"""
+E/S de imágenes sin archivos temporales para los scripts de procesamiento.
+
+- Entrada: ruta en disco o bytes codificados (JPEG/PNG) decodificados con cv2.imdecode.
+- Salida: ruta en disco o cualquier objeto con write() (p.ej. io.BytesIO) que
+  recibe los bytes codificados con cv2.imencode.
+
+Protocolos de stdin/stdout:
+  * Modo CLI con input "-" / output "-": stdin contiene la imagen codificada
+    completa; stdout recibe una línea JSON (con "output_bytes": N) seguida de
+    exactamente N bytes de la imagen procesada.
+  * Modo servidor --framed: cada mensaje es un frame [uint32 big-endian longitud][datos].
+    Petición = frame JSON + frame imagen; respuesta = frame JSON + frame imagen
+    (longitud 0 si no hay imagen).
+"""
+
+import json
+import os
+import struct
+import sys
+
+import cv2
+import numpy as np
+
+STDIO = '-'
+
+FRAME_HEADER = struct.Struct('>I')
+
+def es_stdio(path):
+    return path == STDIO
+
+def describir(origen):
+    """Texto para logs/errores: la ruta o el tamaño de los bytes recibidos"""
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        return f"<{len(origen)} bytes en memoria>"
+    return str(origen)
+
+def leer_imagen(origen, flags=cv2.IMREAD_COLOR):
+    """Decodifica desde una ruta o desde bytes codificados; devuelve None si no se puede"""
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        if len(origen) == 0:
+            return None
+        return cv2.imdecode(np.frombuffer(origen, dtype=np.uint8), flags)
+    return cv2.imread(origen, flags)
+
+def extension_salida(destino, default='.jpg'):
+    if hasattr(destino, 'write'):
+        return default
+    ext = os.path.splitext(str(destino))[1].lower()
+    return ext or default
+
+def guardar_imagen(img, destino, params=None):
+    """Escribe en disco (ruta) o codifica en memoria (objeto con write); devuelve los bytes escritos"""
+    params = params or []
+
+    if hasattr(destino, 'write'):
+        ok, buf = cv2.imencode(extension_salida(destino), img, params)
+        if not ok:
+            raise Exception("Error codificando imagen de salida")
+        destino.write(buf.tobytes())
+        return int(buf.size)
+
+    directorio = os.path.dirname(destino)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    if not cv2.imwrite(destino, img, params):
+        raise Exception(f"Error guardando imagen: {destino}")
+    return os.path.getsize(destino)
+
+def leer_stdin():
+    """Lee la imagen codificada completa desde stdin"""
+    return sys.stdin.buffer.read()
+
+def escribir_resultado(result, payload=b'', out=None):
+    """Línea JSON seguida de los bytes de la imagen (protocolo CLI con output '-')"""
+    out = out or sys.stdout.buffer
+    result = dict(result)
+    result["output_bytes"] = len(payload)
+    out.write((json.dumps(result, ensure_ascii=True) + "\n").encode("ascii"))
+    if payload:
+        out.write(payload)
+    out.flush()
+
+def leer_frame(stream):
+    """Lee un frame [uint32 BE longitud][datos]; devuelve None en EOF limpio"""
+    cabecera = _leer_exacto(stream, FRAME_HEADER.size)
+    if cabecera is None:
+        return None
+    (longitud,) = FRAME_HEADER.unpack(cabecera)
+    if longitud == 0:
+        return b''
+    datos = _leer_exacto(stream, longitud)
+    if datos is None:
+        raise Exception("Frame truncado: EOF antes de completar los datos")
+    return datos
+
+def escribir_frame(stream, datos):
+    stream.write(FRAME_HEADER.pack(len(datos)))
+    if datos:
+        stream.write(datos)
+
+def _leer_exacto(stream, n):
+    partes = []
+    restante = n
+    while restante > 0:
+        bloque = stream.read(restante)
+        if not bloque:
+            if restante == n:
+                return None
+            raise Exception("Frame truncado: EOF inesperado")
+        partes.append(bloque)
+        restante -= len(bloque)
+    return b''.join(partes)
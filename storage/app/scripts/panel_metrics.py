@@ -0,0 +1,91 @@
+"""
+Motor de métricas compartido por los scripts de procesamiento.
+
+Una sola conversión a gris y una sola extracción del canal V por imagen;
+integridad, luminosidad, uniformidad y los checks de imagen inutilizable /
+electroluminiscencia salen de los histogramas de esos dos canales.
+Los valores redondeados son idénticos a los de las funciones originales
+(np.mean / np.std / np.count_nonzero sobre la imagen completa).
+"""
+
+import cv2
+import numpy as np
+
+# calcHist acumula en float32: por debajo de 2^24 píxeles por franja el conteo es exacto
+MAX_PIXELES_FRANJA = 1 << 24
+
+NIVELES = np.arange(256, dtype=np.float64)
+
+def histograma(canal):
+    """Histograma exacto (int64, 256 bins) de un canal uint8"""
+    filas_por_franja = max(1, MAX_PIXELES_FRANJA // max(1, canal.shape[1]))
+    hist = np.zeros(256, dtype=np.int64)
+    for y in range(0, canal.shape[0], filas_por_franja):
+        franja = canal[y:y + filas_por_franja]
+        hist += cv2.calcHist([franja], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    return hist
+
+def estadisticas(hist):
+    """Media y desviación estándar (np.float64) de un canal a partir de su histograma"""
+    n = int(hist.sum())
+    media = np.float64(int(np.dot(hist, np.arange(256, dtype=np.int64)))) / n
+    varianza = np.dot(hist.astype(np.float64), (NIVELES - media) ** 2) / n
+    return {"hist": hist, "n": n, "media": media, "std": np.sqrt(varianza)}
+
+def canal_gris(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def canal_v(img):
+    """Canal V de HSV (= máximo de B, G, R)"""
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 2]
+
+def analizar_gris(img, gray=None):
+    """Estadísticas del canal gris: una conversión, un histograma"""
+    return estadisticas(histograma(canal_gris(img) if gray is None else gray))
+
+def es_imagen_totalmente_inutilizable(stats):
+    """Detecta si una imagen es literalmente totalmente negra o blanca (stats de analizar_gris)"""
+    mean_val = stats["media"]
+    std_val = stats["std"]
+
+    # Si es casi totalmente negra (media muy baja, desviación muy baja)
+    if mean_val < 5 and std_val < 3:
+        return True, "Imagen totalmente negra o inutilizable"
+
+    # Si es casi totalmente blanca (media muy alta, desviación muy baja)
+    if mean_val > 250 and std_val < 3:
+        return True, "Imagen totalmente blanca o sobreexpuesta"
+
+    return False, "Imagen procesable"
+
+def es_imagen_electroluminiscencia(stats):
+    """Detecta si es una imagen de electroluminiscencia por su histograma gris"""
+    hist = stats["hist"]
+
+    # En imágenes EL, hay mucho negro (valores bajos) y una región brillante
+    black_ratio = hist[0:50].sum() / stats["n"]  # Píxeles muy oscuros
+    bright_ratio = hist[150:256].sum() / stats["n"]  # Píxeles brillantes
+
+    # Si >60% es negro y >10% es brillante, probablemente es EL
+    return bool(black_ratio > 0.6 and bright_ratio > 0.1)
+
+def integridad_desde_hist(hist, umbral=30, decimales=2):
+    """Porcentaje de píxeles con valor > umbral"""
+    non_black = int(hist[umbral + 1:].sum())
+    return round((non_black / int(hist.sum())) * 100, decimales)
+
+def calcular_metricas(img, umbral_integridad=30, decimales_integridad=2, decimales_luminosidad=5,
+                      decimales_uniformidad=3, gray=None, v=None, stats_gris=None):
+    """
+    Integridad (% gris > umbral), luminosidad (media de V) y uniformidad (std del
+    gris) en una pasada. gray / v / stats_gris permiten reutilizar lo ya calculado.
+    """
+    gris = stats_gris if stats_gris is not None else analizar_gris(img, gray)
+    hist_v = histograma(canal_v(img) if v is None else v)
+    media_v = estadisticas(hist_v)["media"]
+
+    return {
+        "integridad": integridad_desde_hist(gris["hist"], umbral_integridad, decimales_integridad),
+        "luminosidad": round(media_v, decimales_luminosidad),
+        "uniformidad": round(gris["std"], decimales_uniformidad),
+    }
@@ -0,0 +1,112 @@
+"""
+Utilidades de detección multi-escala compartidas por los scripts de recorte.
+
+La detección del cuadrilátero del panel se hace sobre una copia reducida y
+solo el warpPerspective final usa los píxeles a resolución completa:
+  1. reducir_para_deteccion / leer_reducida -> copia pequeña + factor de escala
+  2. escalar_puntos -> esquinas detectadas llevadas a coordenadas originales
+  3. refinar_esquinas -> ajuste sub-píxel local sobre la imagen original
+  4. deriva_esquinas -> diferencia frente a la detección a resolución completa
+"""
+
+import cv2
+import numpy as np
+
+from panel_io import leer_imagen
+
+# Flags de decodificación JPEG reducida (el decoder escala en el dominio DCT)
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def factor_reduccion(shape, detect_size):
+    """Factor (>= 1) para que el lado mayor quede en detect_size píxeles"""
+    if not detect_size or detect_size <= 0:
+        return 1.0
+    lado_mayor = max(shape[0], shape[1])
+    return max(1.0, lado_mayor / float(detect_size))
+
+def reducir_para_deteccion(img, detect_size):
+    """Devuelve (copia reducida, escala); con detect_size=0 devuelve la imagen original"""
+    escala = factor_reduccion(img.shape, detect_size)
+    if escala <= 1.0:
+        return img, 1.0
+
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (max(1, int(round(w / escala))), max(1, int(round(h / escala)))),
+                       interpolation=cv2.INTER_AREA)
+    return small, w / float(small.shape[1])
+
+def leer_reducida(origen, full_shape, detect_size):
+    """Decodifica el JPEG (ruta o bytes) directamente a 1/2, 1/4 o 1/8 sin pasar por la resolución completa"""
+    escala = factor_reduccion(full_shape, detect_size)
+    for factor, flag in REDUCED_FLAGS:
+        if escala >= factor:
+            img = leer_imagen(origen, flag)
+            if img is not None:
+                return img
+    return None
+
+def escalar_puntos(points, escala):
+    """Lleva puntos (N x 2) de la copia reducida a coordenadas de la imagen original"""
+    if points is None:
+        return None
+    return (np.asarray(points, dtype=np.float32) * np.float32(escala)).astype(np.float32)
+
+def refinar_esquinas(img, points, escala):
+    """Refina cada esquina con cornerSubPix en una ventana local de la imagen original"""
+    points = np.asarray(points, dtype=np.float32)
+    if escala <= 1.0:
+        return points
+
+    # Ventana proporcional al error de cuantización de la escala
+    win = max(3, int(np.ceil(escala * 2)))
+    h, w = img.shape[:2]
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.05)
+    refined = points.copy()
+
+    for i, (x, y) in enumerate(points):
+        x0, y0 = max(0, int(x) - 3 * win), max(0, int(y) - 3 * win)
+        x1, y1 = min(w, int(x) + 3 * win + 1), min(h, int(y) + 3 * win + 1)
+        if x1 - x0 < 2 * win + 5 or y1 - y0 < 2 * win + 5:
+            continue
+
+        roi = img[y0:y1, x0:x1]
+        if roi.ndim == 3:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+
+        corner = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+        try:
+            cv2.cornerSubPix(roi, corner, (win, win), (-1, -1), criteria)
+        except cv2.error:
+            continue
+
+        nuevo = corner[0, 0] + np.array([x0, y0], dtype=np.float32)
+        # Solo aceptar ajustes locales; un salto grande indica que no hay esquina real
+        if np.linalg.norm(nuevo - points[i]) <= win:
+            refined[i] = nuevo
+
+    return refined
+
+def _ordenar(pts):
+    pts = np.asarray(pts, dtype=np.float32).reshape(-1, 2)
+    rect = np.zeros((4, 2), dtype=np.float32)
+    s = pts.sum(axis=1)
+    rect[0] = pts[np.argmin(s)]
+    rect[2] = pts[np.argmax(s)]
+    diff = np.diff(pts, axis=1)
+    rect[1] = pts[np.argmin(diff)]
+    rect[3] = pts[np.argmax(diff)]
+    return rect
+
+def deriva_esquinas(points, reference):
+    """Deriva en píxeles (máx/media) entre dos cuadriláteros, con esquinas emparejadas"""
+    if points is None or reference is None:
+        return None
+    dist = np.linalg.norm(_ordenar(points) - _ordenar(reference), axis=1)
+    return {
+        "max_px": round(float(dist.max()), 2),
+        "mean_px": round(float(dist.mean()), 2),
+    }
@@ -0,0 +1,173 @@
+"""
+Etapas encadenadas con colas acotadas.
+
+Cada etapa es un grupo de hilos que toma elementos de una cola de entrada,
+aplica su función y deja el resultado en la cola de salida. Las colas tienen
+profundidad fija: si una etapa va más lenta, la anterior se bloquea en put()
+(contrapresión) y la memoria no crece. OpenCV y la inferencia liberan el GIL,
+así que decodificación, inferencia y codificación se solapan de verdad.
+
+Por etapa se mide el tiempo ocupado, el tiempo esperando entrada (la etapa
+anterior no da abasto) y el tiempo bloqueado en la salida (la siguiente no da
+abasto). La utilización = ocupado / (hilos x tiempo total) señala el cuello
+de botella.
+"""
+
+import sys
+import threading
+import time
+import traceback
+from queue import Queue
+
+FIN = object()
+
+class EstadisticasEtapa:
+    def __init__(self, nombre, hilos):
+        self.nombre = nombre
+        self.hilos = hilos
+        self.elementos = 0
+        self.ocupado = 0.0
+        self.espera_entrada = 0.0
+        self.espera_salida = 0.0
+        self._lock = threading.Lock()
+
+    def sumar(self, ocupado=0.0, espera_entrada=0.0, espera_salida=0.0, elementos=0):
+        with self._lock:
+            self.ocupado += ocupado
+            self.espera_entrada += espera_entrada
+            self.espera_salida += espera_salida
+            self.elementos += elementos
+
+    def resumen(self, total):
+        capacidad = self.hilos * total if total > 0 else 0.0
+        return {
+            "etapa": self.nombre,
+            "hilos": self.hilos,
+            "elementos": self.elementos,
+            "ocupado_s": round(self.ocupado, 3),
+            "espera_entrada_s": round(self.espera_entrada, 3),
+            "espera_salida_s": round(self.espera_salida, 3),
+            "utilizacion": round(self.ocupado / capacidad, 3) if capacidad else None,
+        }
+
+def cola(profundidad):
+    return Queue(maxsize=max(1, int(profundidad)))
+
+def _poner(salida, elemento, stats):
+    start = time.perf_counter()
+    salida.put(elemento)
+    stats.sumar(espera_salida=time.perf_counter() - start)
+
+def _fallo(nombre, en_error, elemento, error):
+    """Elemento que sustituye al que hizo fallar la etapa (None si no hay en_error)"""
+    if en_error is None:
+        return None
+    try:
+        return en_error(elemento, error)
+    except Exception as e:
+        print(f"💀 en_error de la etapa {nombre} también falló: {e}", file=sys.stderr)
+        return None
+
+def lanzar_etapa(nombre, funcion, entrada, salida, hilos=1, en_error=None):
+    """
+    Arranca `hilos` hilos que aplican funcion(elemento) -> resultado | None a cada
+    elemento de `entrada`. None no se reenvía. Si funcion lanza, se reenvía
+    en_error(elemento, excepcion) para que el elemento no desaparezca en silencio.
+    Cuando llega FIN, el último hilo en terminar lo propaga a `salida`.
+    Devuelve (hilos, estadísticas).
+    """
+    stats = EstadisticasEtapa(nombre, hilos)
+    vivos = [hilos]
+    lock = threading.Lock()
+
+    def trabajar():
+        while True:
+            start = time.perf_counter()
+            elemento = entrada.get()
+            stats.sumar(espera_entrada=time.perf_counter() - start)
+
+            if elemento is FIN:
+                entrada.put(FIN)  # para los demás hilos de la etapa
+                with lock:
+                    vivos[0] -= 1
+                    ultimo = vivos[0] == 0
+                if ultimo:
+                    salida.put(FIN)
+                return
+
+            start = time.perf_counter()
+            try:
+                resultado = funcion(elemento)
+            except Exception as e:
+                # La función debe devolver su propio resultado de error; esto es la red de seguridad
+                print(f"💀 Error no controlado en la etapa {nombre}: {e}", file=sys.stderr)
+                traceback.print_exc()
+                resultado = _fallo(nombre, en_error, elemento, e)
+            stats.sumar(ocupado=time.perf_counter() - start, elementos=1)
+
+            if resultado is not None:
+                _poner(salida, resultado, stats)
+
+    threads = [threading.Thread(target=trabajar, name=f"{nombre}-{i}", daemon=True) for i in range(hilos)]
+    for thread in threads:
+        thread.start()
+    return threads, stats
+
+def lanzar_lotes(nombre, funcion, entrada, salida, tamano_lote, en_error=None):
+    """
+    Etapa de un solo hilo que agrupa lo que ya está en la cola (hasta tamano_lote,
+    sin esperar a llenarlo) y llama funcion(lista) -> lista de resultados. Si
+    funcion lanza, se reenvía en_error(elemento, excepcion) por cada elemento del lote.
+    """
+    stats = EstadisticasEtapa(nombre, 1)
+
+    def trabajar():
+        terminado = False
+        while not terminado:
+            start = time.perf_counter()
+            lote = [entrada.get()]
+            stats.sumar(espera_entrada=time.perf_counter() - start)
+            while len(lote) < tamano_lote and not entrada.empty():
+                lote.append(entrada.get())
+
+            if FIN in lote:
+                terminado = True
+                lote = [elemento for elemento in lote if elemento is not FIN]
+
+            if lote:
+                start = time.perf_counter()
+                try:
+                    resultados = funcion(lote)
+                except Exception as e:
+                    print(f"💀 Error no controlado en la etapa {nombre}: {e}", file=sys.stderr)
+                    traceback.print_exc()
+                    resultados = [_fallo(nombre, en_error, elemento, e) for elemento in lote]
+                stats.sumar(ocupado=time.perf_counter() - start, elementos=len(lote))
+                for resultado in resultados:
+                    if resultado is not None:
+                        _poner(salida, resultado, stats)
+
+        salida.put(FIN)
+
+    thread = threading.Thread(target=trabajar, name=nombre, daemon=True)
+    thread.start()
+    return [thread], stats
+
+def alimentar(elementos, salida):
+    """Hilo que encola los elementos de origen (con contrapresión) y después FIN"""
+    def trabajar():
+        for elemento in elementos:
+            salida.put(elemento)
+        salida.put(FIN)
+
+    thread = threading.Thread(target=trabajar, name="origen", daemon=True)
+    thread.start()
+    return thread
+
+def consumir(entrada):
+    """Generador de los elementos de la última cola hasta FIN"""
+    while True:
+        elemento = entrada.get()
+        if elemento is FIN:
+            return
+        yield elemento
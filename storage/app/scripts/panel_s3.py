@@ -0,0 +1,197 @@
+"""
+E/S directa contra almacenamiento compatible con S3 (Wasabi, MinIO, moto).
+
+Las rutas s3://bucket/clave se leen y escriben sin pasar por PHP ni por
+archivos temporales de descarga:
+  * un único cliente boto3 por proceso con pool de conexiones reutilizadas
+    (max_pool_connections) y reintentos adaptativos,
+  * Prefetcher: GETs concurrentes de las próximas entradas de un lote, con una
+    ventana acotada de descargas en vuelo,
+  * subidas con upload_fileobj: multipart (en paralelo) a partir de
+    S3_MULTIPART_MB, PUT simple por debajo.
+
+Configuración con las mismas variables que el disco 'wasabi' de Laravel:
+WASABI_ENDPOINT, WASABI_KEY, WASABI_SECRET, WASABI_REGION (y WASABI_BUCKET
+para las claves sin bucket). Con path-style, igual que use_path_style_endpoint.
+S3_POOL_SIZE, S3_PREFETCH y S3_MULTIPART_MB ajustan el pool, la ventana de
+descargas y el umbral de multipart.
+"""
+
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFIJO = 's3://'
+POOL_DEFECTO = 16
+PREFETCH_DEFECTO = 8
+MULTIPART_MB_DEFECTO = 8
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
+
+_cliente = None
+_lock = threading.Lock()
+
+def es_s3(ruta):
+    return isinstance(ruta, str) and ruta.startswith(PREFIJO)
+
+def partir_uri(uri):
+    """s3://bucket/clave -> (bucket, clave); s3:///clave usa WASABI_BUCKET"""
+    resto = uri[len(PREFIJO):]
+    bucket, _, clave = resto.partition('/')
+    bucket = bucket or os.environ.get('WASABI_BUCKET')
+    if not bucket or not clave:
+        raise Exception(f"URI S3 inválida: {uri}")
+    return bucket, clave
+
+def uri(bucket, clave):
+    return f"{PREFIJO}{bucket}/{clave}"
+
+def cliente():
+    """Cliente boto3 compartido por todos los hilos del proceso (los clientes son thread-safe)"""
+    global _cliente
+    with _lock:
+        if _cliente is None:
+            import boto3
+            from botocore.config import Config
+
+            pool = int(os.environ.get('S3_POOL_SIZE', POOL_DEFECTO))
+            _cliente = boto3.session.Session().client(
+                's3',
+                endpoint_url=os.environ.get('WASABI_ENDPOINT') or None,
+                aws_access_key_id=os.environ.get('WASABI_KEY') or None,
+                aws_secret_access_key=os.environ.get('WASABI_SECRET') or None,
+                region_name=os.environ.get('WASABI_REGION') or None,
+                config=Config(
+                    max_pool_connections=pool,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'},
+                    s3={'addressing_style': 'path'},
+                ),
+            )
+            print(f"🪣 Cliente S3 listo ({os.environ.get('WASABI_ENDPOINT') or 'AWS'}, pool de {pool})",
+                  file=sys.stderr)
+        return _cliente
+
+def descargar(ruta):
+    """Bytes del objeto s3://...; las rutas locales se devuelven tal cual"""
+    if not es_s3(ruta):
+        return ruta
+    bucket, clave = partir_uri(ruta)
+    respuesta = cliente().get_object(Bucket=bucket, Key=clave)
+    with respuesta['Body'] as body:
+        return body.read()
+
+def subir(datos, destino):
+    """Sube bytes (o un archivo local) a s3://...; multipart en paralelo a partir del umbral"""
+    from boto3.s3.transfer import TransferConfig
+
+    bucket, clave = partir_uri(destino)
+    umbral = int(float(os.environ.get('S3_MULTIPART_MB', MULTIPART_MB_DEFECTO)) * 1024 * 1024)
+    config = TransferConfig(multipart_threshold=umbral, multipart_chunksize=umbral, max_concurrency=4,
+                            use_threads=True)
+    extra = {'ContentType': CONTENT_TYPES.get(os.path.splitext(clave)[1].lower(), 'application/octet-stream')}
+
+    if isinstance(datos, str):
+        with open(datos, 'rb') as f:
+            cliente().upload_fileobj(f, bucket, clave, ExtraArgs=extra, Config=config)
+    else:
+        cliente().upload_fileobj(io.BytesIO(datos), bucket, clave, ExtraArgs=extra, Config=config)
+
+class Prefetcher:
+    """
+    Itera (entry, origen, error) en el orden de las entradas descargando por
+    adelantado hasta `ventana` objetos s3:// con un pool de hilos. Las rutas
+    locales se entregan sin descargar.
+    """
+
+    def __init__(self, entries, campo='input_path', workers=None, ventana=None):
+        self.entries = entries
+        self.campo = campo
+        self.ventana = max(1, ventana or int(os.environ.get('S3_PREFETCH', PREFETCH_DEFECTO)))
+        self.workers = max(1, workers or self.ventana)
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='s3-get') as pool:
+            en_vuelo = []
+            pendientes = iter(self.entries)
+
+            def rellenar():
+                while len(en_vuelo) < self.ventana:
+                    entry = next(pendientes, None)
+                    if entry is None:
+                        return
+                    en_vuelo.append((entry, pool.submit(descargar, entry[self.campo])))
+
+            rellenar()
+            while en_vuelo:
+                entry, future = en_vuelo.pop(0)
+                rellenar()
+                try:
+                    yield entry, future.result(), None
+                except Exception as e:
+                    yield entry, None, e
+
+def origenes(entries, campo='input_path'):
+    """(entry, origen, error) por entrada; solo se lanzan descargas si alguna entrada es s3://"""
+    if any(es_s3(entry.get(campo)) for entry in entries):
+        return iter(Prefetcher(entries, campo))
+    return ((entry, entry[campo], None) for entry in entries)
+
+# ============================================================
+# ✅ SALIDAS: se procesa a un archivo local y se publica en S3
+# ============================================================
+
+def claves_derivados(clave_procesada):
+    """Mismas claves que ImageProcessingService::storeDerivatives"""
+    base_dir = os.path.dirname(os.path.dirname(clave_procesada))
+    nombre = os.path.splitext(os.path.basename(clave_procesada))[0]
+    return {
+        'thumb': f"thumbnails/480_{os.path.basename(clave_procesada)}",
+        'report': f"{base_dir}/report/{nombre}.jpg",
+        'webp': f"{base_dir}/preview/{nombre}.webp",
+    }
+
+def salida_local(destino, directorio):
+    """Ruta local donde escribir antes de subir (misma extensión que la clave)"""
+    if not es_s3(destino):
+        return destino
+    _, clave = partir_uri(destino)
+    os.makedirs(directorio, exist_ok=True)
+    return os.path.join(directorio, f"s3out_{os.getpid()}_{threading.get_ident()}_{os.path.basename(clave)}")
+
+def borrar_local(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def publicar(result, destino, local):
+    """
+    Sube la salida y sus derivados a S3, añade las claves al resultado y borra
+    los archivos locales. No sube nada si el destino no es s3:// o el resultado
+    falló; con destino s3:// los archivos locales (salida y derivados) se borran
+    siempre, también si una subida falla a mitad.
+    """
+    if not es_s3(destino):
+        return result
+
+    derivados = result.get("derivados") or []
+    try:
+        if not result.get("success", True):
+            return result
+
+        bucket, clave = partir_uri(destino)
+        subir(local, destino)
+        result["output_key"] = clave
+
+        claves = claves_derivados(clave)
+        for derivado in derivados:
+            if derivado.get("path") and derivado.get("tipo") in claves:
+                subir(derivado["path"], uri(bucket, claves[derivado["tipo"]]))
+                derivado["key"] = claves[derivado["tipo"]]
+    finally:
+        borrar_local(local)
+        for derivado in derivados:
+            borrar_local(derivado.get("path"))
+            derivado["path"] = None
+
+    print(f"☁️ Publicado en {destino}", file=sys.stderr)
+    return result
@@ -0,0 +1,234 @@
+"""
+Instrumentación por etapas: tiempo de reloj y pico de RSS.
+
+Cada imagen tiene un Cronometro; las funciones del pipeline marcan sus etapas
+con `with medir("warp"):` sin recibir el cronómetro como parámetro: se toma el
+activo del hilo (`with usar(crono):`). Sin cronómetro activo medir() no hace
+nada, así que la instrumentación no cuesta nada si está desactivada.
+
+Etapas: gate, decode, model_load, inference, contour, warp, enhance, encode_write,
+derivatives, metrics, triage. El resultado va en la clave "timings" del JSON:
+
+  {"total_ms": 812.4, "peak_rss_mb": 655.1,
+   "etapas": {"decode": {"ms": 95.2, "peak_rss_mb": 310.0, "rss_delta_mb": 88.4}, ...}}
+
+peak_rss_mb es el máximo del proceso (getrusage) al terminar la etapa y
+rss_delta_mb cuánto creció ese máximo durante ella; en los modos con hilos el
+pico es compartido por todas las imágenes en vuelo.
+
+Con --metrics-out (o PANEL_METRICS_OUT) cada resultado se añade además a:
+  * *.prom: textfile de Prometheus (node_exporter) con histogramas por etapa,
+    acumulados entre procesos con un estado JSON junto al archivo,
+  * cualquier otra extensión: JSON-lines {ts, script, input, success, timings}
+    que SystemMonitorCommand agrega en percentiles.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_local = threading.local()
+
+def activadas(flag=False):
+    """--timings, PANEL_TIMINGS o un destino de métricas configurado"""
+    return bool(flag) or os.environ.get('PANEL_TIMINGS', '').lower() in ('1', 'true', 'yes') \
+        or bool(os.environ.get('PANEL_METRICS_OUT'))
+
+def nuevo():
+    """Cronómetro para una imagen, o None si la instrumentación está desactivada"""
+    return Cronometro() if activadas() else None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else maxrss / 1024.0
+
+class Cronometro:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, nombre, ms, peak=None, delta=None):
+        """Acumula una etapa (las repetidas, p. ej. la cascada, suman tiempo y conservan el pico)"""
+        if peak is None:
+            peak = peak_rss_mb()
+        with self._lock:
+            etapa = self.etapas.setdefault(nombre, {"ms": 0.0, "peak_rss_mb": None, "rss_delta_mb": 0.0})
+            etapa["ms"] += ms
+            if peak is not None:
+                etapa["peak_rss_mb"] = max(etapa["peak_rss_mb"] or 0.0, peak)
+            if delta is not None:
+                etapa["rss_delta_mb"] = max(etapa["rss_delta_mb"], delta)
+
+    @contextlib.contextmanager
+    def etapa(self, nombre):
+        antes = peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            despues = peak_rss_mb()
+            self.sumar(nombre, (time.perf_counter() - start) * 1000, despues,
+                       despues - antes if despues is not None else None)
+
+    def resumen(self):
+        etapas = {
+            nombre: {
+                "ms": round(etapa["ms"], 2),
+                "peak_rss_mb": round(etapa["peak_rss_mb"], 1) if etapa["peak_rss_mb"] is not None else None,
+                "rss_delta_mb": round(etapa["rss_delta_mb"], 1),
+            }
+            for nombre, etapa in self.etapas.items()
+        }
+        peak = peak_rss_mb()
+        return {
+            "total_ms": round((time.perf_counter() - self.inicio) * 1000, 2),
+            "peak_rss_mb": round(peak, 1) if peak is not None else None,
+            "etapas": etapas,
+        }
+
+def activo():
+    return getattr(_local, 'crono', None)
+
+@contextlib.contextmanager
+def usar(crono):
+    """Hace de `crono` el cronómetro activo del hilo durante el bloque (None = sin medir)"""
+    anterior = activo()
+    _local.crono = crono
+    try:
+        yield crono
+    finally:
+        _local.crono = anterior
+
+@contextlib.contextmanager
+def medir(nombre):
+    crono = activo()
+    if crono is None:
+        yield
+        return
+    with crono.etapa(nombre):
+        yield
+
+# ============================================================
+# ✅ SALIDA: clave "timings" y destino de métricas
+# ============================================================
+
+def registrar(result, crono, script, input_path=None, destino=None):
+    """Añade "timings" al resultado y, si hay destino, lo vuelca (los fallos nunca rompen el procesamiento)"""
+    if crono is None:
+        return result
+
+    result["timings"] = crono.resumen()
+    destino = destino or os.environ.get('PANEL_METRICS_OUT')
+    if destino:
+        try:
+            if destino.endswith('.prom'):
+                _actualizar_prometheus(destino, script, result)
+            else:
+                _anadir_linea(destino, {
+                    "ts": round(time.time(), 3),
+                    "script": script,
+                    "input": input_path if isinstance(input_path, str) else None,
+                    "success": bool(result.get("success", True)),
+                    "timings": result["timings"],
+                })
+        except OSError as e:
+            print(f"⚠️ No se pudieron escribir las métricas en {destino}: {e}", file=sys.stderr)
+    return result
+
+@contextlib.contextmanager
+def _bloqueo(ruta):
+    """flock exclusivo: varios procesos (CLI, pool, jobs) escriben el mismo destino"""
+    if os.path.dirname(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + '.lock', 'a') as lock:
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        yield
+
+def _anadir_linea(ruta, registro):
+    with _bloqueo(ruta), open(ruta, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(registro, ensure_ascii=True) + "\n")
+
+def _actualizar_prometheus(ruta, script, result):
+    estado_path = ruta + '.state.json'
+    with _bloqueo(ruta):
+        try:
+            with open(estado_path, 'r', encoding='utf-8') as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            estado = {"etapas": {}, "imagenes": {}}
+
+        timings = result["timings"]
+        clave_ok = f"{script}|{'true' if result.get('success', True) else 'false'}"
+        estado["imagenes"][clave_ok] = estado["imagenes"].get(clave_ok, 0) + 1
+
+        observaciones = [(nombre, etapa["ms"], etapa["peak_rss_mb"]) for nombre, etapa in timings["etapas"].items()]
+        observaciones.append(("total", timings["total_ms"], timings["peak_rss_mb"]))
+        for nombre, ms, peak in observaciones:
+            serie = estado["etapas"].setdefault(f"{script}|{nombre}", {
+                "buckets": [0] * len(BUCKETS_SEGUNDOS), "sum": 0.0, "count": 0, "peak_rss_mb": 0.0})
+            segundos = ms / 1000.0
+            for i, limite in enumerate(BUCKETS_SEGUNDOS):
+                if segundos <= limite:
+                    serie["buckets"][i] += 1
+            serie["sum"] += segundos
+            serie["count"] += 1
+            serie["peak_rss_mb"] = max(serie["peak_rss_mb"], peak or 0.0)
+
+        lineas = [
+            "# HELP panel_stage_duration_seconds Tiempo de reloj por etapa del procesamiento de paneles",
+            "# TYPE panel_stage_duration_seconds histogram",
+        ]
+        for clave in sorted(estado["etapas"]):
+            nombre_script, etapa = clave.split('|')
+            serie = estado["etapas"][clave]
+            etiquetas = f'script="{nombre_script}",stage="{etapa}"'
+            for limite, n in zip(BUCKETS_SEGUNDOS, serie["buckets"]):
+                lineas.append(f'panel_stage_duration_seconds_bucket{{{etiquetas},le="{limite}"}} {n}')
+            lineas.append(f'panel_stage_duration_seconds_bucket{{{etiquetas},le="+Inf"}} {serie["count"]}')
+            lineas.append(f'panel_stage_duration_seconds_sum{{{etiquetas}}} {serie["sum"]:.6f}')
+            lineas.append(f'panel_stage_duration_seconds_count{{{etiquetas}}} {serie["count"]}')
+
+        lineas += [
+            "# HELP panel_stage_peak_rss_bytes Pico de RSS observado al terminar la etapa",
+            "# TYPE panel_stage_peak_rss_bytes gauge",
+        ]
+        for clave in sorted(estado["etapas"]):
+            nombre_script, etapa = clave.split('|')
+            lineas.append(f'panel_stage_peak_rss_bytes{{script="{nombre_script}",stage="{etapa}"}} '
+                          f'{int(estado["etapas"][clave]["peak_rss_mb"] * 1024 * 1024)}')
+
+        lineas += [
+            "# HELP panel_images_total Imágenes procesadas con instrumentación",
+            "# TYPE panel_images_total counter",
+        ]
+        for clave in sorted(estado["imagenes"]):
+            nombre_script, success = clave.split('|')
+            lineas.append(f'panel_images_total{{script="{nombre_script}",success="{success}"}} '
+                          f'{estado["imagenes"][clave]}')
+
+        # node_exporter puede leer en cualquier momento: escritura en temporal + rename
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        for destino, contenido in ((estado_path, json.dumps(estado)), (ruta, "\n".join(lineas) + "\n")):
+            fd, temporal = tempfile.mkstemp(prefix='.tmp_', dir=directorio)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(contenido)
+            os.replace(temporal, destino)
@@ -0,0 +1,133 @@
+"""
+Triaje local en CPU: ¿necesita este panel el análisis completo de la IA?
+
+Heurísticas vectorizadas (NumPy/OpenCV) sobre una copia gris reducida del
+panel procesado, la misma imagen que luego recibe el servicio de análisis:
+  * celdas oscuras: celdas interiores marcadas como "oscura" por la rejilla de
+    panel_grid (media muy por debajo de la mediana del panel),
+  * grietas: respuesta de líneas finas oscuras (black-hat) filtrada con núcleos
+    de línea diagonales; las líneas horizontales/verticales son busbars y
+    separaciones entre celdas, así que solo cuenta lo que no es axial,
+  * bordes negros: celdas cuyo anillo exterior es mucho más oscuro que su
+    núcleo (integral de la imagen: O(1) por celda).
+
+Cada señal da una puntuación en [0, 1]; la confianza es 1 - prod(1 - s) y el
+panel necesita análisis si supera el umbral (PANEL_TRIAGE_UMBRAL). El umbral
+por defecto es conservador: ante la duda se manda a la IA. triage_eval.py mide
+acuerdo y throughput frente a las etiquetas de la IA antes de cambiarlo.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from panel_grid import estadisticas_celdas, limites, sumas_celdas
+from panel_metrics import canal_gris
+
+VERSION = 1
+LADO_TRIAJE = 640
+UMBRAL_DEFECTO = 0.3
+
+BLACKHAT_KERNEL = 7
+LONGITUD_LINEA = 15
+RESPUESTA_GRIETA = 10.0      # niveles de gris de la respuesta diagonal
+FRACCION_GRIETA = 0.002      # fracción de píxeles con respuesta que satura la puntuación
+CELDAS_OSCURAS_SATURA = 3
+BORDE_CELDA = 0.12           # grosor del anillo exterior (fracción del lado de la celda)
+RATIO_BORDE_NEGRO = 0.6
+NUCLEO_MINIMO = 40.0         # núcleo demasiado oscuro: es celda oscura, no borde negro
+BORDES_NEGROS_SATURA = 2
+
+def umbral_triaje():
+    return float(os.environ.get('PANEL_TRIAGE_UMBRAL', UMBRAL_DEFECTO))
+
+def _nucleos_diagonales(longitud):
+    diagonal = np.eye(longitud, dtype=np.float32) / longitud
+    return diagonal, np.fliplr(diagonal).copy()
+
+NUCLEOS_DIAGONALES = _nucleos_diagonales(LONGITUD_LINEA)
+NUCLEOS_AXIALES = (
+    np.full((1, LONGITUD_LINEA), 1.0 / LONGITUD_LINEA, dtype=np.float32),
+    np.full((LONGITUD_LINEA, 1), 1.0 / LONGITUD_LINEA, dtype=np.float32),
+)
+
+def reducir(gray, lado=LADO_TRIAJE):
+    escala = lado / float(max(gray.shape[:2]))
+    if escala >= 1.0:
+        return gray
+    return cv2.resize(gray, (max(1, round(gray.shape[1] * escala)), max(1, round(gray.shape[0] * escala))),
+                      interpolation=cv2.INTER_AREA)
+
+def senal_grietas(gray):
+    """Fracción de píxeles con línea fina oscura diagonal más fuerte que cualquier axial"""
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (BLACKHAT_KERNEL, BLACKHAT_KERNEL))
+    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel).astype(np.float32)
+
+    diagonal = np.maximum(*(cv2.filter2D(blackhat, -1, k) for k in NUCLEOS_DIAGONALES))
+    axial = np.maximum(*(cv2.filter2D(blackhat, -1, k) for k in NUCLEOS_AXIALES))
+    respuesta = diagonal - axial
+    return float(np.count_nonzero(respuesta > RESPUESTA_GRIETA)) / respuesta.size
+
+def celdas_borde_negro(gray, filas, columnas):
+    """Celdas con el anillo exterior < RATIO_BORDE_NEGRO x núcleo (núcleo no oscuro)"""
+    integral = cv2.integral(gray, sdepth=cv2.CV_64F)
+    ys = limites(gray.shape[0], filas)
+    xs = limites(gray.shape[1], columnas)
+
+    # Núcleo: la celda sin un margen de BORDE_CELDA por cada lado
+    my = np.maximum(1, np.round(np.diff(ys) * BORDE_CELDA)).astype(np.intp)
+    mx = np.maximum(1, np.round(np.diff(xs) * BORDE_CELDA)).astype(np.intp)
+    y0, y1 = ys[:-1] + my, ys[1:] - my
+    x0, x1 = xs[:-1] + mx, xs[1:] - mx
+    if np.any(y1 <= y0) or np.any(x1 <= x0):
+        return 0
+
+    total = sumas_celdas(integral, ys, xs)
+    area_total = np.diff(ys)[:, None] * np.diff(xs)[None, :]
+    nucleo = (integral[y1[:, None], x1[None, :]] - integral[y0[:, None], x1[None, :]]
+              - integral[y1[:, None], x0[None, :]] + integral[y0[:, None], x0[None, :]])
+    area_nucleo = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+
+    media_nucleo = nucleo / area_nucleo
+    media_anillo = (total - nucleo) / np.maximum(area_total - area_nucleo, 1)
+    borde_negro = (media_nucleo >= NUCLEO_MINIMO) & (media_anillo < RATIO_BORDE_NEGRO * media_nucleo)
+    return int(np.count_nonzero(borde_negro))
+
+def triaje(img, filas, columnas, gray=None):
+    """Señales, puntuaciones y confianza de que el panel necesita el análisis completo"""
+    start = time.perf_counter()
+    filas, columnas = int(filas), int(columnas)
+    gray = reducir(canal_gris(img) if gray is None else gray)
+
+    # Misma orientación que la rejilla: filas a lo largo del lado mayor si filas >= columnas
+    if (gray.shape[0] >= gray.shape[1]) != (filas >= columnas):
+        gray = np.ascontiguousarray(gray.T)
+    filas = max(1, min(filas, gray.shape[0]))
+    columnas = max(1, min(columnas, gray.shape[1]))
+
+    celdas = estadisticas_celdas(gray, filas, columnas, gray=gray)
+    oscuras = sum(1 for celda in celdas["atipicas"] if celda["motivo"] == "oscura"
+                  and 0 < celda["fila"] < filas - 1 and 0 < celda["columna"] < columnas - 1)
+    grietas = senal_grietas(gray)
+    bordes = celdas_borde_negro(gray, filas, columnas)
+
+    puntuaciones = {
+        "celdas_oscuras": min(1.0, oscuras / float(CELDAS_OSCURAS_SATURA)),
+        "grietas": min(1.0, grietas / FRACCION_GRIETA),
+        "bordes_negros": min(1.0, bordes / float(BORDES_NEGROS_SATURA)),
+    }
+    confianza = 1.0 - float(np.prod([1.0 - s for s in puntuaciones.values()]))
+    umbral = umbral_triaje()
+
+    return {
+        "necesita_analisis": confianza >= umbral,
+        "confianza": round(confianza, 3),
+        "umbral": umbral,
+        "motivos": [nombre for nombre, s in puntuaciones.items() if s > 0],
+        "senales": {"celdas_oscuras": oscuras, "fraccion_grietas": round(grietas, 5), "bordes_negros": bordes},
+        "puntuaciones": {nombre: round(s, 3) for nombre, s in puntuaciones.items()},
+        "version": VERSION,
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+    }
@@ -6,38 +6,7 @@ import traceback
 import os
 import argparse
 
-def calcular_integridad(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    non_black = np.count_nonzero(gray > 30)
-    total = gray.size
-    return round((non_black / total) * 100, 2)
-
-def calcular_luminosidad(img):
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    brightness = hsv[:, :, 2]
-    return round(np.mean(brightness), 5)
-
-def calcular_uniformidad(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    return round(np.std(gray), 3)
-
-def es_imagen_totalmente_inutilizable(img):
-    """
-    Detecta si una imagen es literalmente totalmente negra o blanca.
-    """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    mean_val = np.mean(gray)
-    std_val = np.std(gray)
-
-    # Si es casi totalmente negra (media muy baja, desviación muy baja)
-    if mean_val < 5 and std_val < 3:
-        return True, "Imagen totalmente negra o inutilizable"
-
-    # Si es casi totalmente blanca (media muy alta, desviación muy baja)
-    if mean_val > 250 and std_val < 3:
-        return True, "Imagen totalmente blanca o sobreexpuesta"
-
-    return False, "Imagen procesable"
+from panel_metrics import analizar_gris, calcular_metricas, es_imagen_totalmente_inutilizable
 
 def order_points(pts):
     rect = np.zeros((4, 2), dtype="float32")
@@ -55,17 +24,15 @@ def process_image(input_path, output_path, filas=10, columnas=6):
         raise Exception(f"No se pudo cargar la imagen: {input_path}")
 
     # Verificar solo si la imagen es totalmente inutilizable
-    es_inutilizable, mensaje = es_imagen_totalmente_inutilizable(img)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    es_inutilizable, mensaje = es_imagen_totalmente_inutilizable(analizar_gris(img, gray))
     if es_inutilizable:
         raise Exception(f"Imagen no procesable: {mensaje}")
 
-    # Métricas iniciales
-    integridad = calcular_integridad(img)
-    luminosidad = calcular_luminosidad(img)
-    uniformidad = calcular_uniformidad(img)
+    # Métricas iniciales (reutilizando la conversión a gris)
+    metricas = calcular_metricas(img, umbral_integridad=30, gray=gray)
 
     # Preprocesamiento para contornos
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                    cv2.THRESH_BINARY, 11, 2)
     thresh = cv2.bitwise_not(thresh)
@@ -122,9 +89,9 @@ def process_image(input_path, output_path, filas=10, columnas=6):
 
     # Asegurar que todos los valores son tipos básicos de Python (no numpy)
     result_dict = {
-        "integridad": float(integridad),
-        "luminosidad": float(luminosidad),
-        "uniformidad": float(uniformidad),
+        "integridad": float(metricas["integridad"]),
+        "luminosidad": float(metricas["luminosidad"]),
+        "uniformidad": float(metricas["uniformidad"]),
         "filas": int(filas),
         "columnas": int(columnas),
         "microgrietas": int(microgrietas),
@@ -5,55 +5,37 @@ import json
 import traceback
 import os
 import argparse
-
-def calcular_integridad(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    non_black = np.count_nonzero(gray > 30)
-    total = gray.size
-    return round((non_black / total) * 100, 2)
-
-def calcular_luminosidad(img):
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    brightness = hsv[:, :, 2]
-    return round(np.mean(brightness), 5)
-
-def calcular_uniformidad(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    return round(np.std(gray), 3)
-
-def es_imagen_totalmente_inutilizable(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    mean_val = np.mean(gray)
-    std_val = np.std(gray)
-    if mean_val < 5 and std_val < 3:
-        return True, "Imagen totalmente negra o inutilizable"
-    if mean_val > 250 and std_val < 3:
-        return True, "Imagen totalmente blanca o sobreexpuesta"
-    return False, "Imagen procesable"
-
-def es_imagen_electroluminiscencia(img):
-    """Detecta si es una imagen de electroluminiscencia por sus características"""
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    # Calcular histograma
-    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-
-    # En imágenes EL, hay mucho negro (valores bajos) y una región brillante
-    total_pixels = gray.size
-    black_pixels = np.sum(hist[0:50])  # Píxeles muy oscuros
-    bright_pixels = np.sum(hist[150:256])  # Píxeles brillantes
-
-    black_ratio = black_pixels / total_pixels
-    bright_ratio = bright_pixels / total_pixels
-
-    # Si >60% es negro y >10% es brillante, probablemente es EL
-    if black_ratio > 0.6 and bright_ratio > 0.1:
-        return True
-
-    return False
-
-def detectar_panel_EL_avanzado(img):
-    """Estrategia especializada para imágenes de electroluminiscencia"""
+import io
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from panel_cache import ResultCache
+from panel_derivatives import generar_derivados, parse_derivados
+from panel_diagnostics import anotar, instalar
+from panel_grid import VERSION as VERSION_CELDAS, estadisticas_celdas
+from panel_io import describir, es_stdio, guardar_imagen, leer_imagen, leer_stdin, escribir_resultado
+from panel_metrics import (
+    analizar_gris, calcular_metricas, canal_gris, es_imagen_totalmente_inutilizable, es_imagen_electroluminiscencia
+)
+from panel_multiscale import reducir_para_deteccion, escalar_puntos, refinar_esquinas, deriva_esquinas
+from panel_s3 import descargar, publicar, salida_local
+from panel_timings import medir, nuevo, registrar, usar
+from panel_triage import VERSION as VERSION_TRIAJE, triaje
+
+ALGORITHM_VERSION = "opencv_improved_v2"
+
+def kernel_escalado(lado, escala=1.0):
+    """
+    Lado de kernel/bloque medido en píxeles de resolución completa llevado a
+    la copia de detección: impar y >= 3. Con escala 1 se conserva el original.
+    """
+    if escala <= 1.0:
+        return lado
+    return max(3, int(round(lado / escala)) | 1)
+
+def detectar_panel_EL_avanzado(img, escala=1.0):
+    """Estrategia especializada para imágenes de electroluminiscencia (kernels en píxeles de img x escala)"""
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     # 1. Umbralización adaptativa más agresiva
@@ -61,12 +43,13 @@ def detectar_panel_EL_avanzado(img):
     _, binary = cv2.threshold(gray, 50, 255, cv2.THRESH_BINARY)
 
     # 2. Operaciones morfológicas para limpiar ruido
-    kernel = np.ones((7, 7), np.uint8)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    k_close, k_open = kernel_escalado(7, escala), kernel_escalado(5, escala)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((k_close, k_close), np.uint8))
+    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, np.ones((k_open, k_open), np.uint8))
 
     # 3. Rellenar huecos en el interior del panel
-    kernel_fill = np.ones((15, 15), np.uint8)
+    k_fill = kernel_escalado(15, escala)
+    kernel_fill = np.ones((k_fill, k_fill), np.uint8)
     binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel_fill)
 
     # 4. Encontrar contornos
@@ -142,221 +125,520 @@ def recorte_razonable(warped, original_shape):
 
     return True
 
-def estrategia_recorte_directo_EL(img):
-    """Estrategia de recorte directo optimizada para imágenes EL"""
+def region_brillante_bbox(img, min_pixels=1000, escala=1.0):
+    """BBox (x_min, y_min, x_max, y_max) de la región brillante, sin margen (kernel en píxeles de img x escala)"""
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     # Umbral más alto para EL
     _, binary = cv2.threshold(gray, 40, 255, cv2.THRESH_BINARY)
 
     # Operaciones morfológicas para conectar regiones del panel
-    kernel = np.ones((10, 10), np.uint8)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-
-    # Encontrar todos los píxeles blancos
-    y_coords, x_coords = np.where(binary > 0)
+    k_close = kernel_escalado(10, escala)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((k_close, k_close), np.uint8))
 
-    if len(y_coords) < 1000:  # Aumentado el umbral mínimo
+    # Contar los píxeles blancos sin materializar sus coordenadas
+    if cv2.countNonZero(binary) < min_pixels:  # Aumentado el umbral mínimo
         return None
 
     # Obtener rectángulo que englobe toda la región brillante
-    x_min, x_max = np.min(x_coords), np.max(x_coords)
-    y_min, y_max = np.min(y_coords), np.max(y_coords)
+    x, y, w, h = cv2.boundingRect(binary)
+    return x, y, x + w - 1, y + h - 1
+
+def bbox_con_margen(bbox, img_shape):
+    """Añade el margen de recorte y valida que el resultado sea razonable"""
+    x_min, y_min, x_max, y_max = bbox
 
     # Añadir margen más pequeño para EL
-    margin = max(10, min(img.shape[0], img.shape[1]) // 100)
+    margin = max(10, min(img_shape[0], img_shape[1]) // 100)
     x_min = max(0, x_min - margin)
     y_min = max(0, y_min - margin)
-    x_max = min(img.shape[1] - 1, x_max + margin)
-    y_max = min(img.shape[0] - 1, y_max + margin)
+    x_max = min(img_shape[1] - 1, x_max + margin)
+    y_max = min(img_shape[0] - 1, y_max + margin)
 
     # Verificar que el recorte sea razonable
     w, h = x_max - x_min, y_max - y_min
     if w < 100 or h < 100:
         return None
 
-    return img[y_min:y_max, x_min:x_max]
+    return x_min, y_min, x_max, y_max
 
-def process_image(input_path, output_path, filas=10, columnas=6):
-    # Leer la imagen original
-    img = cv2.imread(input_path)
-    if img is None:
-        raise Exception(f"No se pudo cargar la imagen: {input_path}")
+def estrategia_recorte_directo_EL(img):
+    """Estrategia de recorte directo optimizada para imágenes EL"""
+    bbox = region_brillante_bbox(img)
+    if bbox is None:
+        return None
 
-    # 👉 ROTACIÓN AUTOMÁTICA si es horizontal
-    h, w = img.shape[:2]
-    if w > h:
-        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    bbox = bbox_con_margen(bbox, img.shape)
+    if bbox is None:
+        return None
 
-    # Verificar si la imagen es procesable
-    es_inutilizable, mensaje = es_imagen_totalmente_inutilizable(img)
-    if es_inutilizable:
-        raise Exception(f"Imagen no procesable: {mensaje}")
+    x_min, y_min, x_max, y_max = bbox
+    return img[y_min:y_max, x_min:x_max]
 
-    # 🔍 DETECCIÓN DE TIPO DE IMAGEN
-    es_EL = es_imagen_electroluminiscencia(img)
-    print(f"Imagen detectada como EL: {es_EL}", file=sys.stderr)
+def geometria_recorte_directo(det_img, img_shape, escala=1.0):
+    """Recorte directo buscado en la copia de detección y expresado en coordenadas originales"""
+    bbox = region_brillante_bbox(det_img, min_pixels=1000 / (escala * escala), escala=escala)
+    if bbox is None:
+        return None
+
+    x_min, y_min, x_max, y_max = bbox
+    if escala > 1.0:
+        x_min, y_min = int(x_min * escala), int(y_min * escala)
+        x_max, y_max = int((x_max + 1) * escala) - 1, int((y_max + 1) * escala) - 1
 
-    warped = None
+    bbox = bbox_con_margen((x_min, y_min, x_max, y_max), img_shape)
+    if bbox is None:
+        return None
 
+    x_min, y_min, x_max, y_max = bbox
+    puntos = np.array([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]], dtype=np.float32)
+    return {"tipo": "recorte", "bbox": bbox, "puntos": puntos}
+
+def geometria_warp(pts, img, escala, ratio_min, ratio_max):
+    """Cuadrilátero en coordenadas originales; si viene de una copia reducida se refina sobre img"""
+    pts = order_points(np.asarray(pts, dtype=np.float32))
+    if escala > 1.0:
+        pts = order_points(refinar_esquinas(img, pts, escala))
+    return {"tipo": "warp", "puntos": pts, "ratio": (ratio_min, ratio_max)}
+
+def detectar_geometria(det_img, img, es_EL, escala=1.0):
+    """
+    Ejecuta las estrategias de detección sobre det_img (copia reducida o la propia
+    imagen) y devuelve la geometría del panel en coordenadas de img. Kernels
+    morfológicos y bloques de umbral adaptativo están definidos a resolución
+    completa y se escalan a det_img (kernel_escalado); los umbrales de área son
+    fracciones de la imagen o se escalan por escala².
+    """
     # ESTRATEGIA ESPECÍFICA PARA ELECTROLUMINISCENCIA
     if es_EL:
         try:
             print("Aplicando estrategia EL especializada...", file=sys.stderr)
 
             # Método 1: Detección avanzada de contornos para EL
-            contour, binary = detectar_panel_EL_avanzado(img)
-
-            if contour is not None:
-                # Refinar el contorno
-                box = refinar_contorno_panel(contour, img.shape)
-                pts = order_points(box.reshape(4, 2).astype(np.float32))
-
-                # Calcular dimensiones del rectángulo
-                width_a = np.linalg.norm(pts[1] - pts[0])
-                width_b = np.linalg.norm(pts[2] - pts[3])
-                width = max(int(width_a), int(width_b))
-
-                height_a = np.linalg.norm(pts[3] - pts[0])
-                height_b = np.linalg.norm(pts[2] - pts[1])
-                height = max(int(height_a), int(height_b))
-
-                # Ajustar proporción si es necesario
-                if width / height < 0.4:
-                    width = int(height * 0.4)
-                elif width / height > 3.0:
-                    height = int(width / 3.0)
-
-                # Transformación de perspectiva
-                dst = np.array([[0, 0], [width-1, 0], [width-1, height-1], [0, height-1]], dtype="float32")
-                M = cv2.getPerspectiveTransform(pts, dst)
-                warped = cv2.warpPerspective(img, M, (width, height))
-
-                print("✅ Estrategia EL con contornos exitosa", file=sys.stderr)
-            else:
+            contour, binary = detectar_panel_EL_avanzado(det_img, escala)
+
+            if contour is None:
                 raise Exception("No se detectó contorno válido")
 
+            # Refinar el contorno (en coordenadas originales)
+            contour = escalar_puntos(contour.reshape(-1, 2), escala).reshape(-1, 1, 2)
+            box = refinar_contorno_panel(contour, img.shape)
+            geometria = geometria_warp(box.reshape(4, 2), img, escala, 0.4, 3.0)
+
+            print("✅ Estrategia EL con contornos exitosa", file=sys.stderr)
+            geometria["estrategia"] = "el_contorno"
+            return geometria
+
         except Exception as e:
             print(f"⚠️ Estrategia EL con contornos falló: {e}", file=sys.stderr)
-            try:
-                # Método 2: Recorte directo para EL
-                print("Aplicando recorte directo EL...", file=sys.stderr)
-                warped = estrategia_recorte_directo_EL(img)
-
-                if warped is not None:
-                    print("✅ Estrategia recorte directo EL exitosa", file=sys.stderr)
-                else:
-                    raise Exception("Recorte directo EL falló")
-
-            except Exception as e2:
-                print(f"❌ Todas las estrategias EL fallaron: {e2}", file=sys.stderr)
+
+            # Método 2: Recorte directo para EL
+            print("Aplicando recorte directo EL...", file=sys.stderr)
+            geometria = geometria_recorte_directo(det_img, img.shape, escala)
+
+            if geometria is None:
+                print("❌ Todas las estrategias EL fallaron: Recorte directo EL falló", file=sys.stderr)
                 raise Exception("No se pudo procesar la imagen EL")
 
+            print("✅ Estrategia recorte directo EL exitosa", file=sys.stderr)
+            geometria["estrategia"] = "el_recorte_directo"
+            return geometria
+
     # ESTRATEGIAS ORIGINALES para imágenes no-EL
-    else:
-        try:
-            # [Mantener las estrategias originales 1, 2 y 3 del código original]
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                          cv2.THRESH_BINARY, 11, 2)
-            thresh = cv2.bitwise_not(thresh)
-            thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
-
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            height, width = img.shape[:2]
-            area_total = height * width
-            contornos_validos = [
-                cnt for cnt in contours
-                if cv2.contourArea(cnt) > 0.05 * area_total
-            ]
-
-            if not contornos_validos:
-                raise Exception("Método 1 falló: No se encontró un contorno válido del panel")
-
-            panel_contour = max(contornos_validos, key=cv2.contourArea)
-            epsilon = 0.02 * cv2.arcLength(panel_contour, True)
-            approx = cv2.approxPolyDP(panel_contour, epsilon, True)
-
-            if len(approx) > 4:
-                box = cv2.boxPoints(cv2.minAreaRect(approx)).astype(np.int32)
-                approx = box.reshape(-1, 1, 2)
-            elif len(approx) < 4:
-                x, y, w, h = cv2.boundingRect(panel_contour)
-                approx = np.array([[[x, y]], [[x+w, y]], [[x+w, y+h]], [[x, y+h]]])
-
-            pts = order_points(approx.reshape(len(approx), 2))
-            width = int(max(np.linalg.norm(pts[1] - pts[0]), np.linalg.norm(pts[2] - pts[3])))
-            height = int(max(np.linalg.norm(pts[3] - pts[0]), np.linalg.norm(pts[2] - pts[1])))
-
-            if width / height < 0.5:
-                width = int(height * 0.5)
-            elif width / height > 2.0:
-                height = int(width / 2.0)
-
-            dst = np.array([[0, 0], [width-1, 0], [width-1, height-1], [0, height-1]], dtype="float32")
-            M = cv2.getPerspectiveTransform(pts, dst)
-            warped = cv2.warpPerspective(img, M, (width, height))
+    try:
+        # [Mantener las estrategias originales 1, 2 y 3 del código original]
+        gray = cv2.cvtColor(det_img, cv2.COLOR_BGR2GRAY)
+        bloque, k_close = kernel_escalado(11, escala), kernel_escalado(5, escala)
+        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                      cv2.THRESH_BINARY, bloque, 2)
+        thresh = cv2.bitwise_not(thresh)
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((k_close, k_close), np.uint8))
+
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        height, width = det_img.shape[:2]
+        area_total = height * width
+        contornos_validos = [
+            cnt for cnt in contours
+            if cv2.contourArea(cnt) > 0.05 * area_total
+        ]
+
+        if not contornos_validos:
+            raise Exception("Método 1 falló: No se encontró un contorno válido del panel")
+
+        panel_contour = max(contornos_validos, key=cv2.contourArea)
+        epsilon = 0.02 * cv2.arcLength(panel_contour, True)
+        approx = cv2.approxPolyDP(panel_contour, epsilon, True)
+
+        if len(approx) > 4:
+            box = cv2.boxPoints(cv2.minAreaRect(approx)).astype(np.int32)
+            approx = box.reshape(-1, 1, 2)
+        elif len(approx) < 4:
+            x, y, w, h = cv2.boundingRect(panel_contour)
+            approx = np.array([[[x, y]], [[x+w, y]], [[x+w, y+h]], [[x, y+h]]])
+
+        pts = escalar_puntos(approx.reshape(len(approx), 2), escala)
+        geometria = geometria_warp(pts, img, escala, 0.5, 2.0)
+        geometria["estrategia"] = "contorno_adaptativo"
+        return geometria
 
-        except Exception as e:
-            # [Mantener estrategias 2 y 3 del código original]
-            print(f"Métodos tradicionales fallaron, usando fallback: {e}", file=sys.stderr)
-            warped = estrategia_recorte_directo_EL(img)  # Usar como fallback
+    except Exception as e:
+        # [Mantener estrategias 2 y 3 del código original]
+        print(f"Métodos tradicionales fallaron, usando fallback: {e}", file=sys.stderr)
+        geometria = geometria_recorte_directo(det_img, img.shape, escala)  # Usar como fallback
+        if geometria is not None:
+            geometria["estrategia"] = "recorte_directo"
+        return geometria
+
+def aplicar_geometria(img, geometria):
+    """Aplica la geometría detectada sobre los píxeles a resolución completa"""
+    if geometria is None:
+        return None
+
+    if geometria["tipo"] == "recorte":
+        x_min, y_min, x_max, y_max = geometria["bbox"]
+        return img[y_min:y_max, x_min:x_max]
+
+    pts = geometria["puntos"]
+    ratio_min, ratio_max = geometria["ratio"]
+
+    # Calcular dimensiones del rectángulo
+    width = int(max(np.linalg.norm(pts[1] - pts[0]), np.linalg.norm(pts[2] - pts[3])))
+    height = int(max(np.linalg.norm(pts[3] - pts[0]), np.linalg.norm(pts[2] - pts[1])))
+
+    # Ajustar proporción si es necesario
+    if width / height < ratio_min:
+        width = int(height * ratio_min)
+    elif width / height > ratio_max:
+        height = int(width / ratio_max)
+
+    # Transformación de perspectiva
+    dst = np.array([[0, 0], [width-1, 0], [width-1, height-1], [0, height-1]], dtype="float32")
+    M = cv2.getPerspectiveTransform(pts, dst)
+    return cv2.warpPerspective(img, M, (width, height))
+
+def aplicar_con_respaldo(img, det_img, geometria, es_EL, escala=1.0):
+    """
+    aplicar_geometria con el mismo respaldo que tenían las estrategias: si el
+    warp de un cuadrilátero falla (p. ej. degenerado, alto 0) se reintenta con
+    el recorte directo. Devuelve (recorte | None, geometría aplicada).
+    """
+    try:
+        return aplicar_geometria(img, geometria), geometria
+    except Exception as e:
+        if geometria is None or geometria["tipo"] != "warp":
+            raise
+        print(f"⚠️ Warp de la estrategia {geometria['estrategia']} falló, usando recorte directo: {e}",
+              file=sys.stderr)
+
+    respaldo = geometria_recorte_directo(det_img, img.shape, escala)
+    if respaldo is None:
+        if es_EL:
+            raise Exception("No se pudo procesar la imagen EL")
+        return None, geometria
+    respaldo["estrategia"] = "el_recorte_directo" if es_EL else "recorte_directo"
+    return aplicar_geometria(img, respaldo), respaldo
+
+def procesar_imagen_cargada(img, output_path, filas=10, columnas=6, detect_size=0, report_drift=False,
+                            derivados=None):
+    """Pipeline clásico sobre una imagen ya decodificada y rotada; devuelve el dict de resultado"""
+    # Una sola conversión a gris para los checks de imagen inutilizable y EL (misma etapa que panel_gate)
+    with medir("gate"):
+        stats_entrada = analizar_gris(img)
+
+    # Verificar si la imagen es procesable
+    es_inutilizable, mensaje = es_imagen_totalmente_inutilizable(stats_entrada)
+    if es_inutilizable:
+        raise Exception(f"Imagen no procesable: {mensaje}")
+
+    # 🔍 DETECCIÓN DE TIPO DE IMAGEN
+    es_EL = es_imagen_electroluminiscencia(stats_entrada)
+    print(f"Imagen detectada como EL: {es_EL}", file=sys.stderr)
+
+    # 📉 Detección sobre copia reducida (si se pide) y warp con los píxeles originales
+    det_img, escala = reducir_para_deteccion(img, detect_size)
+    if escala > 1.0:
+        print(f"Detección sobre copia reducida: {det_img.shape[1]}x{det_img.shape[0]}", file=sys.stderr)
+
+    with medir("contour"):
+        geometria = detectar_geometria(det_img, img, es_EL, escala)
+    with medir("warp"):
+        warped, geometria = aplicar_con_respaldo(img, det_img, geometria, es_EL, escala)
+
+    corner_drift = None
+    if report_drift and escala > 1.0 and geometria is not None:
+        referencia = detectar_geometria(img, img, es_EL)
+        corner_drift = deriva_esquinas(geometria["puntos"], referencia["puntos"] if referencia else None)
+        print(f"Deriva de esquinas vs resolución completa: {corner_drift}", file=sys.stderr)
 
     # Verificar que el recorte sea razonable
     if warped is None or not recorte_razonable(warped, img.shape):
         raise Exception("No se pudo obtener un recorte válido del panel")
 
-    # Mejorar la imagen resultante (especialmente importante para EL)
-    if es_EL:
-        # Para imágenes EL, aplicar mejoras más suaves
-        hsv = cv2.cvtColor(warped, cv2.COLOR_BGR2HSV)
-        hsv[:, :, 2] = cv2.add(hsv[:, :, 2], 20)  # Brillo más suave
-        clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))  # CLAHE más suave
-        hsv[:, :, 2] = clahe.apply(hsv[:, :, 2])
-        result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-    else:
-        # Para imágenes normales, usar el procesamiento original
+    # Calcular métricas del panel ya recortado, reutilizando el canal V de la conversión HSV
+    with medir("metrics"):
         hsv = cv2.cvtColor(warped, cv2.COLOR_BGR2HSV)
-        hsv[:, :, 2] = cv2.add(hsv[:, :, 2], 30)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        hsv[:, :, 2] = clahe.apply(hsv[:, :, 2])
-        result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+        gray = canal_gris(warped)
+        metricas = calcular_metricas(warped, umbral_integridad=30, gray=gray, v=hsv[:, :, 2])
+        # Rejilla filas x columnas con la misma conversión a gris (integrales: O(1) por celda)
+        celdas = estadisticas_celdas(warped, filas, columnas, gray=gray)
 
-    # Guardar y devolver resultados
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    cv2.imwrite(output_path, result)
-
-    # Calcular métricas del panel ya recortado
-    integridad = calcular_integridad(warped)
-    luminosidad = calcular_luminosidad(warped)
-    uniformidad = calcular_uniformidad(warped)
+    # Mejorar la imagen resultante (especialmente importante para EL)
+    with medir("enhance"):
+        if es_EL:
+            # Para imágenes EL, aplicar mejoras más suaves
+            hsv[:, :, 2] = cv2.add(hsv[:, :, 2], 20)  # Brillo más suave
+            clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))  # CLAHE más suave
+            hsv[:, :, 2] = clahe.apply(hsv[:, :, 2])
+            result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+        else:
+            # Para imágenes normales, usar el procesamiento original
+            hsv[:, :, 2] = cv2.add(hsv[:, :, 2], 30)
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            hsv[:, :, 2] = clahe.apply(hsv[:, :, 2])
+            result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+    # Guardar y devolver resultados (en disco o codificado en memoria)
+    with medir("encode_write"):
+        guardar_imagen(result, output_path)
+    with medir("derivatives"):
+        archivos_derivados = generar_derivados(result, output_path, derivados)
+
+    # Triaje local sobre la misma imagen que recibirá el análisis de la IA
+    with medir("triage"):
+        triage = triaje(result, filas, columnas)
 
     result_dict = {
-        "integridad": float(integridad),
-        "luminosidad": float(luminosidad),
-        "uniformidad": float(uniformidad),
+        "integridad": float(metricas["integridad"]),
+        "luminosidad": float(metricas["luminosidad"]),
+        "uniformidad": float(metricas["uniformidad"]),
         "filas": int(filas),
         "columnas": int(columnas),
+        "celdas": celdas,
+        "triage": triage,
         "microgrietas": 0,
         "fingers": 0,
         "black_edges": 0,
         "intensidad": 0,
-        "tipo_imagen": "EL" if es_EL else "Normal"
+        "tipo_imagen": "EL" if es_EL else "Normal",
+        "estrategia": geometria["estrategia"]
     }
+    if escala > 1.0:
+        result_dict["detect_scale"] = round(float(escala), 3)
+    if corner_drift is not None:
+        result_dict["corner_drift"] = corner_drift
+    if derivados:
+        result_dict["derivados"] = archivos_derivados
+
+    return result_dict
+
+def procesar_origen(source, sink, filas=10, columnas=6, detect_size=0, report_drift=False, derivados=None, cache=None):
+    """Carga (ruta o bytes), rota y procesa una imagen, pasando por la caché si está activa"""
+    result_dict = clave = None
+    if cache is not None and (not isinstance(source, str) or os.path.exists(source)):
+        clave = cache.clave(source, sink, None, ALGORITHM_VERSION, filas=int(filas), columnas=int(columnas),
+                            detect_size=int(detect_size), report_drift=bool(report_drift),
+                            derivados=list(derivados or []), celdas=VERSION_CELDAS,
+                            triage=VERSION_TRIAJE)
+        result_dict = cache.obtener(clave, sink)
+
+    if result_dict is None:
+        with medir("decode"):
+            img = leer_imagen(source)
+            if img is None:
+                raise Exception(f"No se pudo cargar la imagen: {describir(source)}")
+
+            # 👉 ROTACIÓN AUTOMÁTICA si es horizontal
+            h, w = img.shape[:2]
+            if w > h:
+                img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+
+        result_dict = procesar_imagen_cargada(img, sink, filas, columnas, detect_size, report_drift, derivados)
+        if clave is not None:
+            cache.guardar(clave, result_dict, sink)
+
+    return result_dict
+
+def process_image(input_path, output_path, filas=10, columnas=6, detect_size=0, report_drift=False, derivados=None,
+                  cache=None):
+    # Leer la imagen original ("-" = bytes codificados por stdin, s3://bucket/clave = directo del bucket)
+    source = leer_stdin() if es_stdio(input_path) else descargar(input_path)
+    # "-" = línea JSON seguida de los bytes de la imagen procesada por stdout; s3:// = se sube al terminar
+    sink = io.BytesIO() if es_stdio(output_path) else salida_local(output_path, tempfile.gettempdir())
+
+    crono = nuevo()
+    with usar(crono):
+        result_dict = procesar_origen(source, sink, filas, columnas, detect_size, report_drift, derivados, cache)
+    result_dict = publicar(result_dict, output_path, sink)
+    registrar(result_dict, crono, "process_image_improved", input_path)
+    anotar(result_dict)
+
+    if es_stdio(output_path):
+        escribir_resultado(result_dict, sink.getvalue())
+    else:
+        print(json.dumps(result_dict, ensure_ascii=True))
+
+# ============================================================
+# ✅ MODO LOTE: pool de procesos sobre un manifiesto o una carpeta
+# ============================================================
 
-    print(json.dumps(result_dict, ensure_ascii=True))
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+PROGRESO_CADA = 50
+
+_cache_worker = None
+
+def _iniciar_worker(cache_dir=None, cache_max_mb=None):
+    # Un proceso por núcleo: sin hilos internos de OpenCV compitiendo entre sí
+    global _cache_worker
+    cv2.setNumThreads(1)
+    _cache_worker = ResultCache.desde_argumentos(cache_dir, cache_max_mb)
+
+def procesar_entrada(entry, filas=10, columnas=6, detect_size=0, derivados=None):
+    """Worker del pool: nunca lanza, devuelve el dict de resultado o de error"""
+    start = time.perf_counter()
+    crono = nuevo()
+    try:
+        entry_derivados = parse_derivados(entry.get("derivados", derivados))
+        # Cada proceso del pool mantiene su propio cliente S3 (y su pool de conexiones)
+        output = salida_local(entry["output_path"], tempfile.gettempdir())
+        with usar(crono):
+            result = procesar_origen(descargar(entry["input_path"]), output,
+                                     int(entry.get("filas", filas)), int(entry.get("columnas", columnas)),
+                                     int(entry.get("detect_size", detect_size)), derivados=entry_derivados,
+                                     cache=_cache_worker)
+        result.update({"success": True, "method": "improved_fallback", "algorithm_version": ALGORITHM_VERSION})
+        result = publicar(result, entry["output_path"], output)
+    except Exception as e:
+        result = {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+
+    result["input_path"] = entry.get("input_path")
+    result["output_path"] = entry.get("output_path") if result["success"] else None
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return registrar(result, crono, "process_image_improved", entry.get("input_path"))
+
+def entradas_directorio(input_dir, output_dir):
+    """Entradas {input_path, output_path} para cada imagen de la carpeta, conservando subcarpetas"""
+    entries = []
+    for raiz, _, archivos in os.walk(input_dir):
+        for nombre in sorted(archivos):
+            if not nombre.lower().endswith(EXTENSIONES_IMAGEN) or nombre.startswith('.'):
+                continue
+            relativa = os.path.relpath(os.path.join(raiz, nombre), input_dir)
+            entries.append({
+                "input_path": os.path.join(raiz, nombre),
+                "output_path": os.path.join(output_dir, os.path.splitext(relativa)[0] + '.jpg'),
+            })
+    return sorted(entries, key=lambda e: e["input_path"])
+
+def load_manifest(manifest_path):
+    """Manifiesto JSON (lista) o JSON-lines con entradas {input_path, output_path} ("-" para stdin)"""
+    if manifest_path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    content = content.strip()
+    if not content:
+        return []
+    entries = json.loads(content) if content.startswith('[') else \
+        [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("input_path") or not entry.get("output_path"):
+            raise Exception(f"Entrada {i} del manifiesto inválida: se requieren input_path y output_path")
+    return entries
+
+def run_batch(entries, workers=None, filas=10, columnas=6, detect_size=0, derivados=None, cache_dir=None,
+              cache_max_mb=None, out=None):
+    """Reparte las entradas en un pool de procesos y emite una línea JSON por imagen en orden de finalización"""
+    out = out or sys.stdout
+    workers = max(1, workers or os.cpu_count() or 1)
+    start = time.perf_counter()
+    total_ok = terminadas = 0
+
+    print(f"🚀 Lote clásico: {len(entries)} imagen(es) con {workers} proceso(s)", file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker,
+                             initargs=(cache_dir, cache_max_mb)) as pool:
+        futures = [pool.submit(procesar_entrada, entry, filas, columnas, detect_size, derivados) for entry in entries]
+        for future in as_completed(futures):
+            result = future.result()
+            terminadas += 1
+            if result.get("success"):
+                total_ok += 1
+            out.write(json.dumps(result, ensure_ascii=True) + "\n")
+            out.flush()
+
+            if terminadas % PROGRESO_CADA == 0:
+                elapsed = time.perf_counter() - start
+                print(f"⏱️ {terminadas}/{len(entries)} ({terminadas / elapsed:.1f} imágenes/s)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    velocidad = len(entries) / elapsed if elapsed > 0 else 0.0
+    print(f"🎉 Lote clásico completado: {total_ok}/{len(entries)} en {elapsed:.1f}s ({velocidad:.1f} imágenes/s)",
+          file=sys.stderr)
+    return {"total": len(entries), "ok": total_ok, "seconds": round(elapsed, 2),
+            "images_per_second": round(velocidad, 2), "workers": workers}
 
 if __name__ == "__main__":
     try:
         parser = argparse.ArgumentParser(description='Procesar imagen de panel solar')
-        parser.add_argument('input_path', help='Ruta de la imagen de entrada')
-        parser.add_argument('output_path', help='Ruta donde guardar la imagen procesada')
+        parser.add_argument('input_path', nargs='?', help='Ruta de la imagen de entrada ("-" = bytes por stdin)')
+        parser.add_argument('output_path', nargs='?',
+                            help='Ruta donde guardar la imagen procesada ("-" = línea JSON + bytes por stdout)')
         parser.add_argument('--filas', type=int, default=10)
         parser.add_argument('--columnas', type=int, default=6)
+        parser.add_argument('--detect-size', type=int, default=0,
+                            help='Lado mayor (px) de la copia usada para detectar el panel; 0 = resolución completa')
+        parser.add_argument('--report-drift', action='store_true',
+                            help='Detectar también a resolución completa y reportar la deriva de esquinas')
+        parser.add_argument('--derivatives', default=os.environ.get('PANEL_DERIVATIVES', ''),
+                            help='Derivados a generar junto a la salida, separados por comas: thumb,report,webp')
+        parser.add_argument('--cache-dir', default=None,
+                            help='Directorio de la caché de resultados por contenido (por defecto PANEL_CACHE_DIR)')
+        parser.add_argument('--cache-max-mb', type=float, default=None,
+                            help='Tamaño máximo de la caché en MB (por defecto PANEL_CACHE_MAX_MB o 2048)')
+        parser.add_argument('--batch', default=None, metavar='MANIFEST|DIR',
+                            help='Modo lote: manifiesto JSON o JSON-lines {input_path, output_path} ("-" para stdin) o carpeta de imágenes')
+        parser.add_argument('--output-dir', default=None,
+                            help='Carpeta de salida cuando --batch es una carpeta (se conservan las subcarpetas)')
+        parser.add_argument('--workers', type=int, default=int(os.environ.get('CLASSICAL_WORKERS', 0)) or None,
+                            help='Procesos del pool en modo lote (por defecto, núcleos disponibles)')
+        parser.add_argument('--log-level', default=None, choices=['debug', 'info', 'warning', 'error'],
+                            help='Modo diagnóstico: nivel del log (o PANEL_LOG_LEVEL); a stderr solo llegan warning/error, acotados')
+        parser.add_argument('--log-file', default=None,
+                            help='Modo diagnóstico: archivo de log completo (o PANEL_LOG_FILE)')
+        parser.add_argument('--timings', action='store_true',
+                            help='Añadir "timings" (ms y pico de RSS por etapa) al JSON (o PANEL_TIMINGS)')
+        parser.add_argument('--metrics-out', default=None,
+                            help='Volcar los tiempos a un textfile de Prometheus (*.prom) o a JSON-lines (o PANEL_METRICS_OUT)')
         args = parser.parse_args()
-        process_image(args.input_path, args.output_path, args.filas, args.columnas)
+        instalar(args.log_level, args.log_file)
+
+        # Se leen del entorno en cada imagen, también en los procesos del pool
+        if args.timings:
+            os.environ['PANEL_TIMINGS'] = '1'
+        if args.metrics_out:
+            os.environ['PANEL_METRICS_OUT'] = args.metrics_out
+
+        if args.batch:
+            if os.path.isdir(args.batch):
+                if not args.output_dir:
+                    parser.error('--output-dir es obligatorio cuando --batch es una carpeta')
+                entries = entradas_directorio(args.batch, args.output_dir)
+            else:
+                entries = load_manifest(args.batch)
+            run_batch(entries, args.workers, args.filas, args.columnas, args.detect_size,
+                      parse_derivados(args.derivatives), args.cache_dir, args.cache_max_mb)
+            sys.exit(0)
+
+        if not (args.input_path and args.output_path):
+            parser.error('input_path y output_path son obligatorios fuera del modo --batch')
+
+        process_image(args.input_path, args.output_path, args.filas, args.columnas,
+                      args.detect_size, args.report_drift, parse_derivados(args.derivatives),
+                      ResultCache.desde_argumentos(args.cache_dir, args.cache_max_mb))
     except Exception as e:
-        print(json.dumps({"error": str(e)}, ensure_ascii=True))
         traceback.print_exc()
+        print(json.dumps(anotar({"error": str(e)}), ensure_ascii=True))
         sys.exit(1)
@@ -2,6 +2,35 @@
 """
 Script YOLO para recorte de paneles solares - VERSIÓN PRODUCCIÓN
 Supresión TOTAL de mensajes de Ultralytics
+
+Uso:
+  process_image_wrapped.py input.jpg output.jpg best.pt [--filas N --columnas N --confidence C]
+                           [--derivatives thumb,report,webp]
+  process_image_wrapped.py - - best.pt < original.jpg   (bytes por stdin, JSON + bytes por stdout)
+  process_image_wrapped.py --serve [--model best.pt] [--socket /tmp/yolo.sock] [--framed]
+  process_image_wrapped.py --batch manifest.json [--model best.pt] [--batch-size 8]
+                           [--pipeline --readers 4 --writers N --queue-depth 16]
+
+En modo --serve el modelo se carga una sola vez y cada línea JSON
+{"input_path", "output_path", "filas", "columnas", "confidence", "derivados"} recibe
+como respuesta una línea JSON con el mismo resultado que el modo CLI.
+En modo --batch se emite una línea JSON por imagen del manifiesto; con --pipeline
+la lectura, la inferencia y el postproceso se solapan en etapas con colas
+acotadas y al final se informa la utilización de cada etapa por stderr.
+Con --derivatives los derivados (output_thumb.jpg, output_report.jpg,
+output_webp.webp) se listan en la clave "derivados" del JSON.
+Con --cache-dir (o PANEL_CACHE_DIR) una imagen ya procesada con el mismo modelo
+y parámetros se sirve desde la caché sin cargar el modelo ("cache": "hit").
+Las rutas s3://bucket/clave se leen y escriben directamente en el bucket
+(panel_s3.py): en --batch se descargan por adelantado y la salida y sus
+derivados se suben con las claves que usa ImageProcessingService ("output_key",
+"derivados"[].key).
+Con --timings (o PANEL_TIMINGS) cada JSON incluye "timings": ms y pico de RSS
+por etapa (panel_timings.py); --metrics-out los vuelca además a un textfile de
+Prometheus o a JSON-lines.
+Con --log-level / --log-file (o PANEL_LOG_LEVEL / PANEL_LOG_FILE) el detalle va
+a un log o a un buffer circular, a stderr solo llegan avisos y errores acotados
+y el JSON incluye un resumen en "diagnostico" (panel_diagnostics.py).
 """
 
 import cv2
@@ -14,6 +43,26 @@ import traceback
 import warnings
 import contextlib
 import io
+import itertools
+import tempfile
+import time
+
+from image_headers import dimensiones_efectivas, leer_cabecera
+from panel_io import describir, escribir_frame, escribir_resultado, es_stdio, guardar_imagen, leer_frame, \
+    leer_imagen, leer_stdin
+from panel_cache import ResultCache
+from panel_derivatives import generar_derivados, parse_derivados
+from panel_diagnostics import anotar, instalar
+from panel_gate import comprobar
+from panel_grid import VERSION as VERSION_CELDAS, estadisticas_celdas
+from panel_metrics import calcular_metricas
+from panel_pipeline import alimentar, cola, consumir, lanzar_etapa, lanzar_lotes
+from panel_s3 import descargar, origenes, publicar, salida_local
+from panel_timings import medir, nuevo, registrar, usar
+from panel_triage import VERSION as VERSION_TRIAJE, triaje
+from panel_multiscale import reducir_para_deteccion, leer_reducida, escalar_puntos, refinar_esquinas, deriva_esquinas
+
+ALGORITHM_VERSION = "yolo_v8_segmentation"
 
 # ✅ SUPRESIÓN AGRESIVA DE MENSAJES
 # Suprimir todos los warnings
@@ -42,9 +91,14 @@ def suppress_stdout():
             sys.stdout = old_stdout
             sys.stderr = old_stderr
 
-# ✅ Importar YOLO con supresión completa
-with suppress_stdout():
-    from ultralytics import YOLO
+def importar_yolo():
+    """
+    Importa YOLO con supresión completa solo cuando hace falta un modelo: un
+    acierto de caché o un rechazo de la compuerta no pagan el import de torch.
+    """
+    with suppress_stdout():
+        from ultralytics import YOLO
+    return YOLO
 
 def order_points(pts):
     """Ordena puntos en orden: top-left, top-right, bottom-right, bottom-left"""
@@ -57,29 +111,148 @@ def order_points(pts):
     rect[3] = pts[np.argmax(diff)]    # bottom-left
     return rect
 
-def load_yolo_model(model_path):
-    """Carga el modelo YOLO con supresión total"""
+# ✅ Backends de inferencia disponibles (torch = runtime PyTorch original)
+BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino')
+
+def resolve_backend(backend=None):
+    """Devuelve el backend pedido por flag o por YOLO_BACKEND (torch por defecto)"""
+    backend = (backend or os.environ.get('YOLO_BACKEND') or 'torch').strip().lower()
+    if backend not in BACKENDS:
+        raise Exception(f"Backend de inferencia desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    return backend
+
+@contextlib.contextmanager
+def export_lock(model_path):
+    """Evita que varios workers exporten el mismo modelo a la vez"""
+    import fcntl
+    with open(model_path + '.export.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def is_fresh(export_path, model_path):
+    """Un export es válido si existe y es posterior al .pt del que sale"""
+    return os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(model_path)
+
+def export_model(model_path, backend):
+    """Exporta best.pt al formato del backend una sola vez y cachea el resultado junto al modelo"""
+    base = os.path.splitext(model_path)[0]
+    onnx_path = base + '.onnx'
+    targets = {
+        'onnx': onnx_path,
+        'onnx-int8': base + '.int8.onnx',
+        'openvino': base + '_openvino_model',
+    }
+    target = targets[backend]
+
+    if is_fresh(target, model_path):
+        return target
+
+    with export_lock(model_path):
+        # Otro worker pudo terminar el export mientras esperábamos el lock
+        if is_fresh(target, model_path):
+            return target
+
+        print(f"📦 Exportando modelo a {backend}: {target}", file=sys.stderr)
+        YOLO = importar_yolo()
+
+        if backend == 'openvino':
+            with suppress_stdout():
+                YOLO(model_path, verbose=False).export(format='openvino', dynamic=True)
+            return target
+
+        if not is_fresh(onnx_path, model_path):
+            with suppress_stdout():
+                YOLO(model_path, verbose=False).export(format='onnx', dynamic=True, simplify=True)
+
+        if backend == 'onnx-int8':
+            # Cuantización dinámica de pesos: no requiere dataset de calibración
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            with suppress_stdout():
+                quantize_dynamic(onnx_path, target, weight_type=QuantType.QUInt8)
+
+    return target
+
+def load_yolo_model(model_path, backend=None):
+    """Carga el modelo YOLO con supresión total en el backend indicado"""
     try:
         if not os.path.exists(model_path):
             raise Exception(f"Modelo no encontrado: {model_path}")
 
+        backend = resolve_backend(backend)
+        runtime_path = model_path if backend == 'torch' else export_model(model_path, backend)
+
         # ✅ Cargar modelo con supresión total
+        YOLO = importar_yolo()
         with suppress_stdout():
-            model = YOLO(model_path, verbose=False)
+            if backend == 'torch':
+                model = YOLO(runtime_path, verbose=False)
+            else:
+                model = YOLO(runtime_path, task='segment', verbose=False)
 
-        print(f"✅ Modelo YOLO cargado: {model_path}", file=sys.stderr)
+        model.inference_backend = backend
+        print(f"✅ Modelo YOLO cargado: {runtime_path} (backend: {backend})", file=sys.stderr)
         return model
     except Exception as e:
         print(f"❌ Error cargando modelo: {e}", file=sys.stderr)
         return None
 
+def polygon_from_mask(mask, img_shape):
+    """Contorno a resolución de máscara con los puntos reescalados a la imagen (sin raster a resolución completa)"""
+    mask = (mask > 0.5).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    img_h, img_w = img_shape[:2]
+    mask_h, mask_w = mask.shape[:2]
+    polygon = max(contours, key=cv2.contourArea)[:, 0].astype(np.float32)
+    polygon[:, 0] *= img_w / mask_w
+    polygon[:, 1] *= img_h / mask_h
+    return polygon
+
+def polygon_from_result(result):
+    """Extrae el polígono del panel más confiable y su confianza de un resultado de YOLO"""
+    masks = result.masks
+
+    if masks is None or masks.data.shape[0] == 0:
+        print("❌ No se detectó ninguna máscara", file=sys.stderr)
+        return None, None
+
+    print(f"✅ Panel detectado con {len(masks.data)} máscara(s)", file=sys.stderr)
+
+    # Seleccionar explícitamente la detección con mayor confianza
+    best = 0
+    confidence_score = 0.0
+    if hasattr(result, 'boxes') and result.boxes is not None:
+        if len(result.boxes.conf) > 0:
+            confs = result.boxes.conf.cpu().numpy()
+            best = int(np.argmax(confs))
+            confidence_score = float(confs[best])
+
+    print(f"📊 Confianza de detección: {confidence_score:.3f} (máscara {best})", file=sys.stderr)
+
+    # Polígono de segmentación ya en coordenadas de la imagen original
+    polygon = None
+    if getattr(masks, 'xy', None) is not None and len(masks.xy) > best:
+        polygon = np.asarray(masks.xy[best], dtype=np.float32)
+
+    # Fallback: contorno a resolución de máscara y puntos reescalados
+    if polygon is None or len(polygon) < 3:
+        print("⚠️ Polígono vacío, usando contorno a resolución de máscara", file=sys.stderr)
+        polygon = polygon_from_mask(masks.data[best].cpu().numpy(), result.orig_shape)
+
+    return polygon, confidence_score
+
 def detect_panel_with_yolo(model, img, confidence=0.5):
     """Detecta panel usando YOLO"""
     try:
         print("🔍 Ejecutando detección YOLO...", file=sys.stderr)
 
         # ✅ Hacer predicción con supresión completa
-        with suppress_stdout():
+        with medir("inference"), suppress_stdout():
             results = model.predict(
                 source=img,
                 conf=confidence,
@@ -92,50 +265,54 @@ def detect_panel_with_yolo(model, img, confidence=0.5):
             print("❌ No se obtuvieron resultados de YOLO", file=sys.stderr)
             return None, None
 
-        masks = results[0].masks
-
-        if masks is None or masks.data.shape[0] == 0:
-            print("❌ No se detectó ninguna máscara", file=sys.stderr)
-            return None, None
+        return polygon_from_result(results[0])
 
-        print(f"✅ Panel detectado con {len(masks.data)} máscara(s)", file=sys.stderr)
+    except Exception as e:
+        print(f"❌ Error en detección YOLO: {e}", file=sys.stderr)
+        return None, None
 
-        # Tomar la máscara con mayor confianza (primera)
-        mask = masks.data[0].cpu().numpy()
-        mask = (mask * 255).astype(np.uint8)
+def detect_panels_batch(model, imgs, confidence=0.5):
+    """Detecta paneles en un mini-lote de imágenes con una sola llamada a predict"""
+    try:
+        print(f"🔍 Ejecutando detección YOLO en lote de {len(imgs)} imagen(es)...", file=sys.stderr)
 
-        # Obtener información de confianza
-        confidence_score = 0.0
-        if hasattr(results[0], 'boxes') and results[0].boxes is not None:
-            if len(results[0].boxes.conf) > 0:
-                confidence_score = float(results[0].boxes.conf[0])
+        with suppress_stdout():
+            results = model.predict(
+                source=list(imgs),
+                conf=confidence,
+                save=False,
+                verbose=False,
+                show=False
+            )
 
-        print(f"📊 Confianza de detección: {confidence_score:.3f}", file=sys.stderr)
+        if not results or len(results) != len(imgs):
+            print("❌ YOLO devolvió un número de resultados inesperado", file=sys.stderr)
+            return [(None, None)] * len(imgs)
 
-        return mask, confidence_score
+        detections = []
+        for result in results:
+            try:
+                detections.append(polygon_from_result(result))
+            except Exception as e:
+                print(f"❌ Error leyendo resultado YOLO: {e}", file=sys.stderr)
+                detections.append((None, None))
+        return detections
 
     except Exception as e:
-        print(f"❌ Error en detección YOLO: {e}", file=sys.stderr)
-        return None, None
+        print(f"❌ Error en detección YOLO por lotes: {e}", file=sys.stderr)
+        return [(None, None)] * len(imgs)
 
-def extract_panel_contour(mask, img_shape):
-    """Extrae contorno del panel desde la máscara YOLO"""
+def extract_panel_contour(polygon, img_shape):
+    """Extrae los 4 puntos del panel desde el polígono de segmentación YOLO"""
     try:
         print("📐 Extrayendo contorno del panel...", file=sys.stderr)
 
-        # Redimensionar máscara al tamaño de imagen
-        img_h, img_w = img_shape[:2]
-        mask_resized = cv2.resize(mask, (img_w, img_h))
-
-        # Encontrar contornos
-        contours, _ = cv2.findContours(mask_resized, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        if not contours:
+        if polygon is None or len(polygon) < 3:
             print("❌ No se encontraron contornos en la máscara", file=sys.stderr)
             return None
 
-        # Seleccionar contorno más grande
-        largest_contour = max(contours, key=cv2.contourArea)
+        # El polígono ya está en coordenadas de imagen: no hace falta raster ni resize
+        largest_contour = np.asarray(polygon, dtype=np.float32).reshape(-1, 1, 2)
         area = cv2.contourArea(largest_contour)
 
         print(f"📏 Área del contorno: {area:.0f} píxeles", file=sys.stderr)
@@ -253,130 +430,823 @@ def enhance_image(img):
         print(f"⚠️ Error en mejoras: {e}, usando original", file=sys.stderr)
         return img
 
-def process_image_with_yolo(input_path, output_path, model_path, filas=24, columnas=6, confidence=0.5):
+def load_input_image(input_path):
+    """Carga la imagen de entrada (ruta o bytes codificados) y la rota a vertical si es horizontal"""
+    # Verificar archivo de entrada
+    if isinstance(input_path, str) and not os.path.exists(input_path):
+        raise Exception(f"Archivo de entrada no existe: {input_path}")
+
+    # Cargar imagen (cv2.imread o cv2.imdecode según el origen)
+    with medir("decode"):
+        img = leer_imagen(input_path)
+    if img is None:
+        raise Exception(f"No se pudo cargar la imagen: {describir(input_path)}")
+
+    original_shape = img.shape
+    print(f"📐 Imagen original: {original_shape[1]}x{original_shape[0]}", file=sys.stderr)
+
+    # Rotación automática si es horizontal
+    h, w = img.shape[:2]
+    rotated = False
+    if w > h:
+        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+        rotated = True
+        print("🔄 Imagen rotada a vertical", file=sys.stderr)
+
+    return img, original_shape, rotated
+
+def load_detection_image(input_path, detect_size):
+    """
+    Solo la copia de detección, decodificada con IMREAD_REDUCED_* sin pasar por
+    la resolución completa (dimensiones y orientación desde la cabecera).
+    Devuelve (copia, original_shape, rotated) o None si no se puede.
+    """
+    if isinstance(input_path, str):
+        if not os.path.exists(input_path):
+            return None  # load_input_image da el error habitual
+        with open(input_path, 'rb') as f:
+            info = leer_cabecera(f)
+    else:
+        info = leer_cabecera(io.BytesIO(input_path))
+    ancho, alto = dimensiones_efectivas(info)
+    if ancho is None:
+        return None
+
+    original_shape = (alto, ancho, 3)
+    with medir("decode"):
+        small = leer_reducida(input_path, original_shape, detect_size)
+    if small is None:
+        return None
+
+    rotated = ancho > alto
+    if rotated:
+        small = cv2.rotate(small, cv2.ROTATE_90_CLOCKWISE)
+    small, _ = reducir_para_deteccion(small, detect_size)
+    return small, original_shape, rotated
+
+def finish_processing(img, polygon, confidence_score, original_shape, rotated, output_path, model_path,
+                      filas=24, columnas=6, backend='torch', inference_ms=None,
+                      detect_scale=1.0, reference_polygon=None, derivados=None):
+    """Contorno, warp, mejoras, guardado, derivados y métricas a partir de una detección YOLO"""
+    if polygon is None:
+        raise Exception("YOLO no pudo detectar el panel")
+
+    # Extraer contorno del panel
+    with medir("contour"):
+        panel_points = extract_panel_contour(polygon, img.shape)
+        if panel_points is None:
+            raise Exception("No se pudo extraer contorno válido")
+
+        # Detección multi-escala: refinar las esquinas reescaladas sobre los píxeles originales
+        if detect_scale > 1.0:
+            panel_points = refinar_esquinas(img, panel_points, detect_scale)
+            print(f"🔎 Esquinas refinadas (escala de detección {detect_scale:.2f})", file=sys.stderr)
+
+    corner_drift = None
+    if reference_polygon is not None:
+        corner_drift = deriva_esquinas(panel_points, extract_panel_contour(reference_polygon, img.shape))
+        print(f"📏 Deriva de esquinas vs resolución completa: {corner_drift}", file=sys.stderr)
+
+    # Aplicar transformación de perspectiva
+    with medir("warp"):
+        warped = apply_perspective_transform(img, panel_points)
+    if warped is None:
+        raise Exception("Fallo en transformación de perspectiva")
+
+    # Aplicar mejoras
+    with medir("enhance"):
+        enhanced = enhance_image(warped)
+
+    # Guardar resultado (en disco o codificado en memoria)
+    with medir("encode_write"):
+        output_size = guardar_imagen(enhanced, output_path)
+
+    print(f"💾 Imagen guardada: {describir(output_path)} ({output_size} bytes)", file=sys.stderr)
+
+    # Miniatura / tamaño informe / WebP desde el mismo array en memoria
+    with medir("derivatives"):
+        derivative_files = generar_derivados(enhanced, output_path, derivados)
+
+    # Calcular métricas (una conversión a gris y una a V, todo desde histogramas)
+    with medir("metrics"):
+        metricas = calcular_metricas(enhanced, umbral_integridad=10, decimales_luminosidad=2,
+                                     decimales_uniformidad=2)
+        # Rejilla filas x columnas sobre el recorte sin mejoras (integrales: O(1) por celda)
+        celdas = estadisticas_celdas(warped, filas, columnas)
+
+    # Triaje local sobre la misma imagen que recibirá el análisis de la IA
+    with medir("triage"):
+        triage = triaje(enhanced, filas, columnas)
+
+    # Calcular reducción de tamaño
+    original_pixels = original_shape[0] * original_shape[1]
+    final_pixels = enhanced.shape[0] * enhanced.shape[1]
+    reduction = ((original_pixels - final_pixels) / original_pixels) * 100
+
+    result = {
+        "success": True,
+        "method": "yolo_segmentation",
+        "model_path": model_path,
+        "backend": backend,
+        "inference_ms": round(inference_ms, 2) if inference_ms is not None else None,
+        "confidence": float(confidence_score),
+        "integridad": float(metricas["integridad"]),
+        "luminosidad": float(metricas["luminosidad"]),
+        "uniformidad": float(metricas["uniformidad"]),
+        "filas": int(filas),
+        "columnas": int(columnas),
+        "celdas": celdas,
+        "triage": triage,
+        "imagen_rotada": rotated,
+        "reduccion_tamaño": f"{reduction:.1f}%",
+        "dimensiones_finales": f"{enhanced.shape[1]}x{enhanced.shape[0]}",
+        "algorithm_version": ALGORITHM_VERSION,
+        "procesamiento_exitoso": True,
+        "tipo_imagen": "YOLO_Enhanced",
+        "estrategia": "yolo",
+        "detect_scale": round(float(detect_scale), 3)
+    }
+    if corner_drift is not None:
+        result["corner_drift"] = corner_drift
+    if derivados:
+        result["derivados"] = derivative_files
+
+    return result
+
+def classical_fallback(img, output_path, filas, columnas, yolo_error, derivados=None):
+    """Estrategias clásicas (contorno EL -> recorte directo) sobre la imagen ya decodificada"""
+    import process_image_improved as clasico
+
+    print(f"⚠️ YOLO falló ({yolo_error}), aplicando estrategias clásicas en el mismo proceso", file=sys.stderr)
+    result = clasico.procesar_imagen_cargada(img, output_path, filas, columnas, derivados=derivados)
+    print(f"✅ Estrategia clásica exitosa: {result['estrategia']}", file=sys.stderr)
+
+    result.update({
+        "success": True,
+        "method": "improved_fallback",
+        "algorithm_version": "opencv_improved_v2",
+        "procesamiento_exitoso": True,
+        "yolo_error": str(yolo_error),
+    })
+    return result
+
+def cascade_or_error(img, output_path, filas, columnas, error, cascade=False, derivados=None):
+    """Aplica la cascada clásica si está activa; si no (o si también falla) devuelve el dict de error"""
+    if cascade:
+        try:
+            return classical_fallback(img, output_path, filas, columnas, error, derivados)
+        except Exception as e:
+            print(f"💀 Estrategias clásicas también fallaron: {e}", file=sys.stderr)
+            e.cascade_ran = True
+            error = e
+    return error_result(error)
+
+def process_loaded_image(model, input_path, output_path, model_path, filas=24, columnas=6, confidence=0.5,
+                         detect_size=0, reduced_decode=False, report_drift=False, cascade=False, derivados=None):
+    """Ejecuta el pipeline completo con un modelo ya cargado y devuelve el dict de resultado"""
+    # Con --reduced-decode la decodificación completa se difiere hasta el warp
+    deteccion = load_detection_image(input_path, detect_size) if detect_size and reduced_decode else None
+    img = original_shape = rotated = None
+    if deteccion is None:
+        img, original_shape, rotated = load_input_image(input_path)
+
+    try:
+        if model is None:
+            raise Exception("Modelo YOLO no disponible")
+        return run_yolo_pipeline(model, img, input_path, original_shape, rotated, output_path, model_path,
+                                 filas, columnas, confidence, detect_size, report_drift, derivados, deteccion)
+    except Exception as e:
+        if not cascade:
+            raise
+        if img is None:
+            img, _, _ = load_input_image(input_path)
+        try:
+            return classical_fallback(img, output_path, filas, columnas, e, derivados)
+        except Exception as cascade_error:
+            cascade_error.cascade_ran = True
+            raise
+
+def run_yolo_pipeline(model, img, input_path, original_shape, rotated, output_path, model_path,
+                      filas=24, columnas=6, confidence=0.5, detect_size=0, report_drift=False,
+                      derivados=None, deteccion=None):
+    """
+    Detección YOLO (opcionalmente multi-escala) y procesamiento final. Con
+    `deteccion` (load_detection_image) img es None y la imagen completa solo
+    se decodifica si hay un panel que recortar.
+    """
+    if deteccion is not None:
+        det_img, original_shape, rotated = deteccion
+    else:
+        det_img, _ = reducir_para_deteccion(img, detect_size)
+    if max(det_img.shape[:2]) < max(original_shape[:2]):
+        print(f"📉 Detección sobre copia reducida: {det_img.shape[1]}x{det_img.shape[0]}", file=sys.stderr)
+
+    # Detectar panel con YOLO (midiendo la latencia del backend)
+    start = time.perf_counter()
+    polygon, confidence_score = detect_panel_with_yolo(model, det_img, confidence)
+    inference_ms = (time.perf_counter() - start) * 1000
+
+    if img is None:
+        if polygon is None:
+            raise Exception("YOLO no pudo detectar el panel")
+        img, original_shape, rotated = load_input_image(input_path)
+    scale = img.shape[1] / float(det_img.shape[1])
+
+    # Referencia a resolución completa solo para medir la deriva de esquinas
+    reference_polygon = None
+    if report_drift and scale > 1.0:
+        reference_polygon, _ = detect_panel_with_yolo(model, img, confidence)
+
+    return finish_processing(img, escalar_puntos(polygon, scale), confidence_score, original_shape, rotated,
+                             output_path, model_path, filas, columnas,
+                             getattr(model, 'inference_backend', 'torch'), inference_ms,
+                             scale, reference_polygon, derivados)
+
+def error_result(error):
+    """Construye el dict de error que se devuelve en stdout"""
+    result = {
+        "success": False,
+        "error": str(error),
+        "method": "yolo_segmentation_failed",
+        "traceback": traceback.format_exc()
+    }
+    # PHP no repite el fallback clásico fuera de proceso si la cascada ya se ejecutó
+    if getattr(error, "cascade_ran", False):
+        result["cascade_ran"] = True
+    return result
+
+def cached_result(cache, source, output, model_path, procesar, filas=24, columnas=6, confidence=0.5, detect_size=0,
+                  reduced_decode=False, report_drift=False, cascade=False, derivados=None):
+    """Devuelve el resultado de la caché o ejecuta procesar() y guarda el resultado correcto"""
+    if cache is None:
+        return procesar()
+
+    clave = cache.clave(source, output, model_path, ALGORITHM_VERSION, filas=int(filas), columnas=int(columnas),
+                        confidence=float(confidence), detect_size=int(detect_size),
+                        reduced_decode=bool(reduced_decode), report_drift=bool(report_drift),
+                        cascade=bool(cascade), derivados=list(derivados or []), celdas=VERSION_CELDAS,
+                        triage=VERSION_TRIAJE)
+    result = cache.obtener(clave, output)
+    if result is None:
+        result = procesar()
+        cache.guardar(clave, result, output)
+    return result
+
+def process_image_with_yolo(input_path, output_path, model_path, filas=24, columnas=6, confidence=0.5, backend=None,
+                            detect_size=0, reduced_decode=False, report_drift=False, cascade=False, derivados=None,
+                            cache=None):
     """Función principal para procesar imagen con YOLO"""
+    crono = nuevo()
     try:
         print(f"🚀 INICIANDO PROCESAMIENTO YOLO", file=sys.stderr)
         print(f"📂 Input: {input_path}", file=sys.stderr)
         print(f"📂 Output: {output_path}", file=sys.stderr)
         print(f"🤖 Modelo: {model_path}", file=sys.stderr)
 
+        # "-" = bytes codificados por stdin / imagen codificada tras la línea JSON en stdout
+        # s3://bucket/clave = lectura directa del bucket / escritura local y subida al terminar
+        source = leer_stdin() if es_stdio(input_path) else descargar(input_path)
+        sink = io.BytesIO() if es_stdio(output_path) else salida_local(output_path, tempfile.gettempdir())
+
         # Verificar archivo de entrada
-        if not os.path.exists(input_path):
-            raise Exception(f"Archivo de entrada no existe: {input_path}")
+        if isinstance(source, str) and not os.path.exists(source):
+            raise Exception(f"Archivo de entrada no existe: {source}")
+
+        def procesar():
+            # Imágenes inutilizables: rechazo en milisegundos, sin cargar el modelo
+            rechazo = comprobar(source)
+            if rechazo is not None:
+                return rechazo
+
+            # Cargar modelo YOLO (solo si la caché no tiene el resultado)
+            with medir("model_load"):
+                model = load_yolo_model(model_path, backend)
+            if model is None and not cascade:
+                raise Exception("No se pudo cargar el modelo YOLO")
+
+            return process_loaded_image(model, source, sink, model_path, filas, columnas, confidence,
+                                        detect_size, reduced_decode, report_drift, cascade, derivados)
+
+        with usar(crono):
+            result = cached_result(cache, source, sink, model_path, procesar, filas, columnas, confidence,
+                                   detect_size, reduced_decode, report_drift, cascade, derivados)
+
+        # Rechazo temprano: JSON con reject_code y código de salida de error, como el resto de fallos
+        if result.get("reject_code"):
+            print(f"🚫 IMAGEN RECHAZADA SIN PROCESAR: {result['reject_code']}", file=sys.stderr)
+            result = registrar(result, crono, "process_image_wrapped", input_path)
+            print(json.dumps(anotar(result), ensure_ascii=True))
+            sys.exit(1)
+
+        result = publicar(result, output_path, sink)
+        registrar(result, crono, "process_image_wrapped", input_path)
+        anotar(result)
 
-        # Cargar modelo YOLO
-        model = load_yolo_model(model_path)
-        if model is None:
-            raise Exception("No se pudo cargar el modelo YOLO")
+        print("🎉 PROCESAMIENTO YOLO COMPLETADO EXITOSAMENTE", file=sys.stderr)
 
-        # Cargar imagen
-        img = cv2.imread(input_path)
-        if img is None:
-            raise Exception(f"No se pudo cargar la imagen: {input_path}")
-
-        original_shape = img.shape
-        print(f"📐 Imagen original: {original_shape[1]}x{original_shape[0]}", file=sys.stderr)
-
-        # Rotación automática si es horizontal
-        h, w = img.shape[:2]
-        rotated = False
-        if w > h:
-            img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
-            rotated = True
-            print("🔄 Imagen rotada a vertical", file=sys.stderr)
-
-        # Detectar panel con YOLO
-        mask, confidence_score = detect_panel_with_yolo(model, img, confidence)
-        if mask is None:
-            raise Exception("YOLO no pudo detectar el panel")
+        # ✅ CRÍTICO: Solo JSON en stdout, sin texto extra (más los bytes de la imagen si output es "-")
+        if es_stdio(output_path):
+            sys.stdout.flush()
+            escribir_resultado(result, sink.getvalue())
+        else:
+            print(json.dumps(result, ensure_ascii=True))
 
-        # Extraer contorno del panel
-        panel_points = extract_panel_contour(mask, img.shape)
-        if panel_points is None:
-            raise Exception("No se pudo extraer contorno válido")
+    except Exception as e:
+        print(f"💀 ERROR EN PROCESAMIENTO YOLO: {e}", file=sys.stderr)
 
-        # Aplicar transformación de perspectiva
-        warped = apply_perspective_transform(img, panel_points)
-        if warped is None:
-            raise Exception("Fallo en transformación de perspectiva")
+        # ✅ CRÍTICO: Solo JSON en stdout, incluso en errores (con los tiempos hasta el fallo)
+        result = registrar(error_result(e), crono, "process_image_wrapped", input_path)
+        print(json.dumps(anotar(result), ensure_ascii=True))
+        sys.exit(1)
 
-        # Aplicar mejoras
-        enhanced = enhance_image(warped)
+# ============================================================
+# ✅ MODO SERVIDOR: modelo cargado una sola vez
+# ============================================================
+
+def handle_request(model, model_path, request, detect_size=0, cascade=False, input_data=None, sink=None, cache=None):
+    """Procesa una petición JSON del servidor y devuelve el mismo dict que el modo CLI"""
+    try:
+        if not isinstance(request, dict):
+            raise Exception("La petición debe ser un objeto JSON")
+        if not input_data and not request.get("input_path"):
+            raise Exception("Falta el campo obligatorio: input_path")
+        if sink is None and not request.get("output_path"):
+            raise Exception("Falta el campo obligatorio: output_path")
+
+        source = input_data if input_data else request["input_path"]
+        output = sink if sink is not None else request["output_path"]
+        filas = int(request.get("filas", 24))
+        columnas = int(request.get("columnas", 6))
+        confidence = float(request.get("confidence", 0.5))
+        detect_size = int(request.get("detect_size", detect_size))
+        cascade = bool(request.get("cascade", cascade))
+        derivados = parse_derivados(request.get("derivados"))
+        print(f"📥 Petición: {describir(source)}", file=sys.stderr)
+
+        if isinstance(source, str) and not os.path.exists(source):
+            raise Exception(f"Archivo de entrada no existe: {source}")
+
+        crono = nuevo()
+        with usar(crono):
+            result = cached_result(
+                cache, source, output, model_path,
+                lambda: comprobar(source) or process_loaded_image(model, source, output, model_path, filas, columnas,
+                                                                  confidence, detect_size, cascade=cascade,
+                                                                  derivados=derivados),
+                filas, columnas, confidence, detect_size, cascade=cascade, derivados=derivados
+            )
+        return registrar(result, crono, "process_image_wrapped", source)
+    except Exception as e:
+        print(f"💀 ERROR EN PETICIÓN: {e}", file=sys.stderr)
+        return error_result(e)
 
-        # Guardar resultado
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        success = cv2.imwrite(output_path, enhanced)
-
-        if not success:
-            raise Exception(f"Error guardando imagen: {output_path}")
-
-        print(f"💾 Imagen guardada: {output_path}", file=sys.stderr)
-
-        # Calcular métricas
-        gray_final = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
-        non_black = np.count_nonzero(gray_final > 10)
-        integridad = round((non_black / gray_final.size) * 100, 2)
-
-        hsv_final = cv2.cvtColor(enhanced, cv2.COLOR_BGR2HSV)
-        luminosidad = round(np.mean(hsv_final[:, :, 2]), 2)
-        uniformidad = round(np.std(gray_final), 2)
-
-        # Calcular reducción de tamaño
-        original_pixels = original_shape[0] * original_shape[1]
-        final_pixels = enhanced.shape[0] * enhanced.shape[1]
-        reduction = ((original_pixels - final_pixels) / original_pixels) * 100
-
-        # ✅ Resultado exitoso - SOLO JSON EN STDOUT
-        result = {
-            "success": True,
-            "method": "yolo_segmentation",
-            "model_path": model_path,
-            "confidence": float(confidence_score),
-            "integridad": float(integridad),
-            "luminosidad": float(luminosidad),
-            "uniformidad": float(uniformidad),
-            "filas": int(filas),
-            "columnas": int(columnas),
-            "imagen_rotada": rotated,
-            "reduccion_tamaño": f"{reduction:.1f}%",
-            "dimensiones_finales": f"{enhanced.shape[1]}x{enhanced.shape[0]}",
-            "algorithm_version": "yolo_v8_segmentation",
-            "procesamiento_exitoso": True,
-            "tipo_imagen": "YOLO_Enhanced"
-        }
+def handle_line(model, model_path, line, detect_size=0, cascade=False, cache=None):
+    """Decodifica una línea JSON y devuelve la respuesta serializada (o None si está vacía)"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        response = error_result(f"JSON inválido: {e}")
+    else:
+        response = handle_request(model, model_path, request, detect_size, cascade, cache=cache)
+    return json.dumps(response, ensure_ascii=True) + "\n"
+
+def serve_lines(model, model_path, rfile, wfile, detect_size=0, cascade=False, cache=None):
+    """Peticiones JSON-lines con rutas en disco: una línea JSON de respuesta por petición"""
+    for raw in rfile:
+        response = handle_line(model, model_path, raw.decode("utf-8", errors="replace"), detect_size, cascade, cache)
+        if response is not None:
+            wfile.write(response.encode("utf-8"))
+            wfile.flush()
+
+def serve_frames(model, model_path, rfile, wfile, detect_size=0, cascade=False, cache=None):
+    """Peticiones enmarcadas (frame JSON + frame imagen) sin archivos temporales"""
+    while True:
+        header = leer_frame(rfile)
+        if header is None:
+            return
+        input_data = leer_frame(rfile)
+        if input_data is None:
+            raise Exception("Petición incompleta: falta el frame de imagen")
+
+        sink = io.BytesIO()
+        try:
+            request = json.loads(header.decode("utf-8"))
+        except ValueError as e:
+            response = error_result(f"JSON inválido: {e}")
+        else:
+            response = handle_request(model, model_path, request, detect_size, cascade, input_data, sink, cache)
 
-        print("🎉 PROCESAMIENTO YOLO COMPLETADO EXITOSAMENTE", file=sys.stderr)
+        payload = sink.getvalue() if response.get("success") else b''
+        response["output_bytes"] = len(payload)
+        escribir_frame(wfile, json.dumps(response, ensure_ascii=True).encode("ascii"))
+        escribir_frame(wfile, payload)
+        wfile.flush()
 
-        # ✅ CRÍTICO: Solo JSON en stdout, sin texto extra
-        print(json.dumps(result, ensure_ascii=True))
+def serve_stdio(model, model_path, detect_size=0, cascade=False, framed=False, cache=None):
+    """Atiende peticiones por stdin y responde por stdout (JSON-lines o frames binarios)"""
+    out = sys.stdout.buffer
+    # Cualquier print accidental de librerías va a stderr, nunca al canal de respuestas
+    sys.stdout = sys.stderr
+    print("🟢 Servidor YOLO escuchando en stdin", file=sys.stderr)
 
+    serve = serve_frames if framed else serve_lines
+    serve(model, model_path, sys.stdin.buffer, out, detect_size, cascade, cache)
+
+def serve_socket(model, model_path, socket_path, detect_size=0, cascade=False, framed=False, cache=None):
+    """Atiende peticiones sobre un socket Unix (una conexión a la vez)"""
+    import socketserver
+
+    serve = serve_frames if framed else serve_lines
+
+    class YoloRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve(model, model_path, self.rfile, self.wfile, detect_size, cascade, cache)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    sys.stdout = sys.stderr
+    with socketserver.UnixStreamServer(socket_path, YoloRequestHandler) as server:
+        print(f"🟢 Servidor YOLO escuchando en {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def run_server(model_path, socket_path=None, backend=None, detect_size=0, cascade=False, framed=False, cache=None):
+    """Carga el modelo una vez y arranca el servidor en stdin/stdout o socket Unix"""
+    model = load_yolo_model(model_path, backend)
+    if model is None:
+        print(json.dumps(error_result("No se pudo cargar el modelo YOLO"), ensure_ascii=True))
+        sys.exit(1)
+
+    if socket_path:
+        serve_socket(model, model_path, socket_path, detect_size, cascade, framed, cache)
+    else:
+        serve_stdio(model, model_path, detect_size, cascade, framed, cache)
+
+# ============================================================
+# ✅ MODO LOTE: inferencia por mini-lotes desde un manifiesto
+# ============================================================
+
+def load_manifest(manifest_path):
+    """Lee un manifiesto JSON (lista) o JSON-lines con entradas {input_path, output_path}"""
+    if manifest_path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    content = content.strip()
+    if not content:
+        return []
+
+    if content.startswith('['):
+        entries = json.loads(content)
+    else:
+        entries = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("input_path") or not entry.get("output_path"):
+            raise Exception(f"Entrada {i} del manifiesto inválida: se requieren input_path y output_path")
+    return entries
+
+def emit_line(out, result, entry):
+    """Escribe una línea JSON por imagen, incluyendo la ruta de entrada para correlacionar"""
+    result = dict(result)
+    result["input_path"] = entry.get("input_path")
+    out.write(json.dumps(result, ensure_ascii=True) + "\n")
+    out.flush()
+
+def process_batch(model, model_path, entries, batch_size=8, filas=24, columnas=6, confidence=0.5, out=None,
+                  detect_size=0, cascade=False, derivados=None, cache=None):
+    """Procesa el manifiesto en mini-lotes: decodifica, predice en lote y termina imagen por imagen"""
+    out = out or sys.stdout
+    batch_size = max(1, int(batch_size))
+    total_ok = 0
+
+    # Las entradas s3:// se descargan por adelantado mientras se procesa el mini-lote actual
+    pendientes = origenes(entries)
+    for numero in itertools.count(1):
+        chunk = list(itertools.islice(pendientes, batch_size))
+        if not chunk:
+            break
+        print(f"📦 Lote {numero}: {len(chunk)} imagen(es)", file=sys.stderr)
+
+        # 1. Decodificar todo el mini-lote (los fallos se reportan y no entran a predict;
+        #    los aciertos de caché se emiten sin decodificar)
+        loaded = []
+        for entry, source, download_error in chunk:
+            crono = nuevo()
+            try:
+                if download_error is not None:
+                    raise download_error
+                output = salida_local(entry["output_path"], tempfile.gettempdir())
+                entry_derivados = parse_derivados(entry.get("derivados", derivados))
+                clave = None
+                if cache is not None:
+                    clave = cache.clave(source, output, model_path, ALGORITHM_VERSION,
+                                        filas=int(entry.get("filas", filas)),
+                                        columnas=int(entry.get("columnas", columnas)),
+                                        confidence=float(confidence), detect_size=int(detect_size),
+                                        reduced_decode=False, report_drift=False, cascade=bool(cascade),
+                                        derivados=entry_derivados, celdas=VERSION_CELDAS,
+                                        triage=VERSION_TRIAJE)
+                    cached = cache.obtener(clave, output)
+                    if cached is not None:
+                        total_ok += 1
+                        emit_line(out, registrar(publicar(cached, entry["output_path"], output), crono,
+                                                 "process_image_wrapped", entry["input_path"]), entry)
+                        continue
+                with usar(crono):
+                    rechazo = comprobar(source)
+                    if rechazo is not None:
+                        emit_line(out, registrar(rechazo, crono, "process_image_wrapped", entry["input_path"]), entry)
+                        continue
+                    decoded = load_input_image(source)
+                loaded.append((entry, output, entry_derivados, clave, crono) + decoded)
+            except Exception as e:
+                emit_line(out, registrar(error_result(e), crono, "process_image_wrapped", entry["input_path"]), entry)
+
+        if not loaded:
+            continue
+
+        # 2. Una sola llamada a predict para todo el mini-lote (sobre copias reducidas si aplica)
+        copies = [reducir_para_deteccion(item[5], detect_size) for item in loaded]
+        start = time.perf_counter()
+        detections = detect_panels_batch(model, [copy for copy, _ in copies], confidence)
+        inference_ms = (time.perf_counter() - start) * 1000 / len(loaded)
+        print(f"⏱️ Inferencia: {inference_ms:.1f} ms/imagen", file=sys.stderr)
+
+        # 3. Contorno, warp, mejoras y métricas por imagen
+        for (entry, output, entry_derivados, clave, crono, img, original_shape, rotated), (_, scale), \
+                (polygon, confidence_score) in zip(loaded, copies, detections):
+            entry_filas = int(entry.get("filas", filas))
+            entry_columnas = int(entry.get("columnas", columnas))
+            if crono is not None:
+                crono.sumar("inference", inference_ms)  # parte proporcional del predict del mini-lote
+            try:
+                with usar(crono):
+                    result = finish_processing(
+                        img, escalar_puntos(polygon, scale), confidence_score, original_shape, rotated,
+                        output, model_path, entry_filas, entry_columnas,
+                        getattr(model, 'inference_backend', 'torch'), inference_ms,
+                        scale, derivados=entry_derivados
+                    )
+            except Exception as e:
+                print(f"💀 ERROR EN {entry['input_path']}: {e}", file=sys.stderr)
+                with usar(crono):
+                    result = cascade_or_error(img, output, entry_filas, entry_columnas, e, cascade, entry_derivados)
+            if clave is not None:
+                cache.guardar(clave, result, output)
+            try:
+                result = publicar(result, entry["output_path"], output)
+            except Exception as e:
+                result = error_result(e)
+            registrar(result, crono, "process_image_wrapped", entry["input_path"])
+            if result.get("success"):
+                total_ok += 1
+            emit_line(out, result, entry)
+
+    print(f"🎉 Lote completado: {total_ok}/{len(entries)} imágenes correctas", file=sys.stderr)
+    return total_ok
+
+# ============================================================
+# ✅ MODO LOTE EN ETAPAS: lectura -> inferencia -> postproceso con colas acotadas
+# ============================================================
+
+def process_pipeline(model, model_path, entries, batch_size=8, filas=24, columnas=6, confidence=0.5, out=None,
+                     detect_size=0, cascade=False, derivados=None, cache=None, readers=4, writers=None,
+                     queue_depth=None):
+    """
+    Mismo resultado que process_batch, pero solapando etapas:
+      * lectura (readers hilos): caché, decodificación, rotación y copia de detección
+      * inferencia (1 hilo): predict sobre lo que haya en cola, hasta batch_size
+      * postproceso (writers hilos): contorno, warp, mejoras, codificación, escritura y derivados
+    """
+    out = out or sys.stdout
+    writers = max(1, writers or os.cpu_count() or 1)
+    queue_depth = queue_depth or batch_size * 2
+    backend = getattr(model, 'inference_backend', 'torch')
+
+    def leer(entry):
+        crono = nuevo()
+        try:
+            # Con entradas s3:// los lectores hacen GETs concurrentes por delante de la inferencia
+            source = descargar(entry["input_path"])
+            output = salida_local(entry["output_path"], tempfile.gettempdir())
+            entry_derivados = parse_derivados(entry.get("derivados", derivados))
+            entry_filas = int(entry.get("filas", filas))
+            entry_columnas = int(entry.get("columnas", columnas))
+            clave = None
+            if cache is not None:
+                clave = cache.clave(source, output, model_path, ALGORITHM_VERSION,
+                                    filas=entry_filas, columnas=entry_columnas, confidence=float(confidence),
+                                    detect_size=int(detect_size), reduced_decode=False, report_drift=False,
+                                    cascade=bool(cascade), derivados=entry_derivados, celdas=VERSION_CELDAS,
+                                    triage=VERSION_TRIAJE)
+                cached = cache.obtener(clave, output)
+                if cached is not None:
+                    return {"entry": entry, "crono": crono, "result": publicar(cached, entry["output_path"], output)}
+
+            with usar(crono):
+                rechazo = comprobar(source)
+                if rechazo is not None:
+                    return {"entry": entry, "crono": crono, "result": rechazo}
+                img, original_shape, rotated = load_input_image(source)
+            det_img, scale = reducir_para_deteccion(img, detect_size)
+            return {"entry": entry, "crono": crono, "output": output, "derivados": entry_derivados,
+                    "filas": entry_filas, "columnas": entry_columnas, "clave": clave, "img": img,
+                    "original_shape": original_shape, "rotated": rotated, "det_img": det_img, "scale": scale}
+        except Exception as e:
+            return {"entry": entry, "crono": crono, "result": error_result(e)}
+
+    def inferir(lote):
+        pendientes = [item for item in lote if "result" not in item]
+        if pendientes:
+            start = time.perf_counter()
+            detections = detect_panels_batch(model, [item["det_img"] for item in pendientes], confidence)
+            inference_ms = (time.perf_counter() - start) * 1000 / len(pendientes)
+            for item, (polygon, confidence_score) in zip(pendientes, detections):
+                item.update(polygon=polygon, confidence_score=confidence_score, inference_ms=inference_ms)
+                item.pop("det_img")
+                if item["crono"] is not None:
+                    item["crono"].sumar("inference", inference_ms)
+        return lote
+
+    def postprocesar(item):
+        if "result" in item:
+            return item
+        entry = item["entry"]
+        try:
+            with usar(item["crono"]):
+                result = finish_processing(
+                    item["img"], escalar_puntos(item["polygon"], item["scale"]), item["confidence_score"],
+                    item["original_shape"], item["rotated"], item["output"], model_path, item["filas"],
+                    item["columnas"], backend, item["inference_ms"], item["scale"], derivados=item["derivados"]
+                )
+        except Exception as e:
+            print(f"💀 ERROR EN {entry['input_path']}: {e}", file=sys.stderr)
+            with usar(item["crono"]):
+                result = cascade_or_error(item["img"], item["output"], item["filas"], item["columnas"], e, cascade,
+                                          item["derivados"])
+        if item["clave"] is not None:
+            cache.guardar(item["clave"], result, item["output"])
+        try:
+            # Subidas s3:// desde los hilos de postproceso (multipart si la salida es grande)
+            result = publicar(result, entry["output_path"], item["output"])
+        except Exception as e:
+            result = error_result(e)
+        return {"entry": entry, "crono": item["crono"], "result": result}
+
+    def fallo_etapa(elemento, error):
+        # Red de seguridad de panel_pipeline: la entrada se emite como error en lugar de perderse
+        entry = elemento.get("entry", elemento)
+        return {"entry": entry, "crono": elemento.get("crono"),
+                "result": {"success": False, "error": str(error), "input_path": entry.get("input_path")}}
+
+    print(f"🏭 Lote en etapas: {len(entries)} imagen(es), {readers} lector(es), {writers} escritor(es), "
+          f"colas de {queue_depth}", file=sys.stderr)
+    start = time.perf_counter()
+    q_origen, q_leidas, q_detectadas, q_hechas = (cola(queue_depth) for _ in range(4))
+
+    alimentar(entries, q_origen)
+    _, stats_lectura = lanzar_etapa("lectura", leer, q_origen, q_leidas, readers, fallo_etapa)
+    _, stats_inferencia = lanzar_lotes("inferencia", inferir, q_leidas, q_detectadas, batch_size, fallo_etapa)
+    _, stats_post = lanzar_etapa("postproceso", postprocesar, q_detectadas, q_hechas, writers, fallo_etapa)
+
+    total_ok = 0
+    for item in consumir(q_hechas):
+        if item["result"].get("success"):
+            total_ok += 1
+        registrar(item["result"], item["crono"], "process_image_wrapped", item["entry"]["input_path"])
+        emit_line(out, item["result"], item["entry"])
+
+    elapsed = time.perf_counter() - start
+    etapas = [stats.resumen(elapsed) for stats in (stats_lectura, stats_inferencia, stats_post)]
+    cuello = max(etapas, key=lambda e: e["utilizacion"] or 0.0)
+    print(f"📊 Etapas: {json.dumps(etapas, ensure_ascii=True)}", file=sys.stderr)
+    print(f"🎉 Lote completado: {total_ok}/{len(entries)} en {elapsed:.1f}s "
+          f"({len(entries) / elapsed if elapsed > 0 else 0.0:.1f} imágenes/s), cuello de botella: {cuello['etapa']}",
+          file=sys.stderr)
+    return total_ok
+
+def run_batch(manifest_path, model_path, batch_size=8, filas=24, columnas=6, confidence=0.5, backend=None,
+              detect_size=0, cascade=False, derivados=None, cache=None, pipeline=False, readers=4, writers=None,
+              queue_depth=None):
+    """Carga el modelo una vez y procesa todas las entradas del manifiesto"""
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        entries = load_manifest(manifest_path)
+        model = load_yolo_model(model_path, backend)
+        if model is None and not cascade:
+            raise Exception("No se pudo cargar el modelo YOLO")
     except Exception as e:
-        error_msg = str(e)
-        print(f"💀 ERROR EN PROCESAMIENTO YOLO: {error_msg}", file=sys.stderr)
-
-        # Resultado de error
-        result = {
-            "success": False,
-            "error": error_msg,
-            "method": "yolo_segmentation_failed",
-            "traceback": traceback.format_exc()
-        }
-
-        # ✅ CRÍTICO: Solo JSON en stdout, incluso en errores
-        print(json.dumps(result, ensure_ascii=True))
+        print(f"💀 ERROR EN MODO LOTE: {e}", file=sys.stderr)
+        out.write(json.dumps(error_result(e), ensure_ascii=True) + "\n")
         sys.exit(1)
 
+    if pipeline:
+        process_pipeline(model, model_path, entries, batch_size, filas, columnas, confidence, out, detect_size,
+                         cascade, derivados, cache, readers, writers, queue_depth)
+        return
+
+    process_batch(model, model_path, entries, batch_size, filas, columnas, confidence, out, detect_size, cascade,
+                  derivados, cache)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Procesamiento de paneles con YOLO segmentation')
-    parser.add_argument('input_path', help='Ruta de la imagen de entrada')
-    parser.add_argument('output_path', help='Ruta donde guardar la imagen procesada')
-    parser.add_argument('model_path', help='Ruta del modelo YOLO (.pt)')
+    parser.add_argument('input_path', nargs='?',
+                        help='Ruta de la imagen de entrada ("-" = bytes por stdin, s3://bucket/clave = lectura directa)')
+    parser.add_argument('output_path', nargs='?',
+                        help='Ruta donde guardar la imagen procesada ("-" = línea JSON + bytes por stdout, '
+                             's3://bucket/clave = subida directa junto con los derivados)')
+    parser.add_argument('model_path', nargs='?', help='Ruta del modelo YOLO (.pt)')
     parser.add_argument('--filas', type=int, default=24, help='Número de filas del panel')
     parser.add_argument('--columnas', type=int, default=6, help='Número de columnas del panel')
     parser.add_argument('--confidence', type=float, default=0.5, help='Umbral de confianza YOLO')
+    parser.add_argument('--serve', action='store_true',
+                        help='Modo servidor: carga el modelo una vez y atiende peticiones JSON-lines')
+    parser.add_argument('--socket', default=None,
+                        help='Socket Unix para el modo servidor (por defecto stdin/stdout)')
+    parser.add_argument('--framed', action='store_true',
+                        help='Modo servidor con frames binarios [uint32 BE longitud][datos]: JSON + imagen, sin archivos temporales')
+    parser.add_argument('--model', default=os.environ.get('YOLO_MODEL_PATH'),
+                        help='Ruta del modelo en modo servidor/lote (por defecto YOLO_MODEL_PATH o best.pt junto al script)')
+    parser.add_argument('--batch', default=None, metavar='MANIFEST',
+                        help='Modo lote: manifiesto JSON o JSON-lines con {input_path, output_path} ("-" para stdin)')
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('YOLO_BATCH_SIZE', 8)),
+                        help='Tamaño del mini-lote de inferencia en modo lote')
+    parser.add_argument('--backend', default=None, choices=BACKENDS,
+                        help='Backend de inferencia (por defecto YOLO_BACKEND o torch); onnx/openvino se exportan y cachean junto al modelo')
+    parser.add_argument('--detect-size', type=int, default=int(os.environ.get('YOLO_DETECT_SIZE', 0)),
+                        help='Lado mayor (px) de la copia usada para detectar el panel; 0 = resolución completa')
+    parser.add_argument('--reduced-decode', action='store_true',
+                        help='Detectar sobre una decodificación cv2.IMREAD_REDUCED_* y decodificar a resolución '
+                             'completa solo para el warp (no se decodifica si YOLO no encuentra panel)')
+    parser.add_argument('--report-drift', action='store_true',
+                        help='Detectar también a resolución completa y reportar la deriva de esquinas')
+    parser.add_argument('--cascade', action='store_true',
+                        default=os.environ.get('YOLO_CASCADE', '').lower() in ('1', 'true', 'yes'),
+                        help='Si YOLO falla, aplicar contorno EL y recorte directo en el mismo proceso sin re-decodificar')
+    parser.add_argument('--derivatives', default=os.environ.get('PANEL_DERIVATIVES', ''),
+                        help='Derivados a generar junto a la salida, separados por comas: thumb,report,webp')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directorio de la caché de resultados por contenido (por defecto PANEL_CACHE_DIR; sin él, desactivada)')
+    parser.add_argument('--cache-max-mb', type=float, default=None,
+                        help='Tamaño máximo de la caché en MB antes de expulsar (por defecto PANEL_CACHE_MAX_MB o 2048)')
+    parser.add_argument('--pipeline', action='store_true',
+                        default=os.environ.get('YOLO_PIPELINE', '').lower() in ('1', 'true', 'yes'),
+                        help='Modo lote en etapas solapadas (lectura / inferencia / postproceso) con colas acotadas')
+    parser.add_argument('--readers', type=int, default=int(os.environ.get('YOLO_PIPELINE_READERS', 4)),
+                        help='Hilos de lectura y decodificación en modo --pipeline')
+    parser.add_argument('--writers', type=int, default=int(os.environ.get('YOLO_PIPELINE_WRITERS', 0)) or None,
+                        help='Hilos de postproceso y escritura en modo --pipeline (por defecto, núcleos disponibles)')
+    parser.add_argument('--timings', action='store_true',
+                        help='Añadir "timings" (ms y pico de RSS por etapa) al JSON de cada imagen (o PANEL_TIMINGS)')
+    parser.add_argument('--metrics-out', default=None,
+                        help='Volcar los tiempos a un textfile de Prometheus (*.prom) o a JSON-lines (o PANEL_METRICS_OUT)')
+    parser.add_argument('--log-level', default=None, choices=['debug', 'info', 'warning', 'error'],
+                        help='Modo diagnóstico: nivel del log (o PANEL_LOG_LEVEL); a stderr solo llegan warning/error, acotados')
+    parser.add_argument('--log-file', default=None,
+                        help='Modo diagnóstico: archivo de log completo (o PANEL_LOG_FILE); sin él, buffer circular en memoria')
+    parser.add_argument('--queue-depth', type=int, default=int(os.environ.get('YOLO_PIPELINE_QUEUE_DEPTH', 0)) or None,
+                        help='Profundidad de cada cola entre etapas (por defecto 2 x --batch-size)')
 
     args = parser.parse_args()
+    # Antes de cualquier salida: con el modo diagnóstico stderr queda acotado (sin bloqueos por tubería llena)
+    instalar(args.log_level, args.log_file)
+    try:
+        derivados = parse_derivados(args.derivatives)
+    except Exception as e:
+        parser.error(str(e))
+    default_model = args.model or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'best.pt')
+    # La instrumentación se lee del entorno en cada imagen (también en los hilos del modo servidor/lote)
+    if args.timings:
+        os.environ['PANEL_TIMINGS'] = '1'
+    if args.metrics_out:
+        os.environ['PANEL_METRICS_OUT'] = args.metrics_out
+    cache = ResultCache.desde_argumentos(args.cache_dir, args.cache_max_mb)
+
+    if args.serve:
+        run_server(default_model, args.socket, args.backend, args.detect_size, args.cascade, args.framed, cache)
+        sys.exit(0)
+
+    if args.batch:
+        run_batch(args.batch, default_model, args.batch_size, args.filas, args.columnas, args.confidence,
+                  args.backend, args.detect_size, args.cascade, derivados, cache, args.pipeline, args.readers,
+                  args.writers, args.queue_depth)
+        sys.exit(0)
+
+    if not (args.input_path and args.output_path and args.model_path):
+        parser.error('input_path, output_path y model_path son obligatorios fuera de los modos --serve/--batch')
 
     process_image_with_yolo(
         args.input_path,
@@ -384,5 +1254,12 @@ if __name__ == "__main__":
         args.model_path,
         args.filas,
         args.columnas,
-        args.confidence
+        args.confidence,
+        args.backend,
+        args.detect_size,
+        args.reduced_decode,
+        args.report_drift,
+        args.cascade,
+        derivados,
+        cache
     )
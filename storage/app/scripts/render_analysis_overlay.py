@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Renderizado de las detecciones de ai_response_json sobre la imagen procesada.
+
+Dibuja todas las cajas y etiquetas con OpenCV en una sola pasada por imagen
+(un único blend para los rellenos semitransparentes) y reemplaza el dibujo
+caja a caja con Intervention/Imagick de los jobs de ZIP e informe.
+
+Uso:
+  render_analysis_overlay.py processed.jpg predictions.json analyzed.jpg [--style zip|report]
+  render_analysis_overlay.py --batch manifest.json [--workers N] [--style zip|report]
+
+Estilos (mismos colores y filtros que los jobs PHP):
+  * zip    -> GenerateDownloadZipJob: claves 'final' / 'predictions', umbral
+              minProbability del JSON (0.5 por defecto), borde de 2 px.
+  * report -> GenerateReportJob: clave 'predictions', umbral 0.3, borde de 3 px,
+              relleno negro al 10% y fondo de color en la etiqueta.
+
+Manifiesto (JSON o JSON-lines): {"input_path", "output_path", "predictions"
+(objeto o texto JSON) | "predictions_path", "style", "id"}. Se emite una línea
+JSON por entrada en orden de finalización.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from panel_io import describir, guardar_imagen, leer_imagen
+
+ESTILOS = {
+    "zip": {
+        "colores": {
+            'Intensidad': '#FFA500',
+            'Fingers': '#00BFFF',
+            'Black Edges': '#333333',
+            'Microgrietas': '#FF0000',
+        },
+        "claves": ("final", "predictions"),
+        "min_probabilidad": None,  # minProbability del JSON
+        "grosor": 2,
+        "relleno": 0.0,
+        "fondo_etiqueta": False,
+    },
+    "report": {
+        "colores": {
+            'cell_crack': '#FF0000',
+            'cell_cracking': '#FF4500',
+            'cell_burning': '#8B0000',
+            'corrosion': '#FFA500',
+            'bad_soldering': '#FFFF00',
+            'soldering_issue': '#FFFF00',
+            'soldering_failure': '#FFFF00',
+            'diode_failure': '#800080',
+            'diode_issue': '#800080',
+            'inactive_cell': '#0000FF',
+            'short_circuit': '#FF1493',
+            'pid': '#32CD32',
+            'potential_induced_degradation': '#32CD32',
+            'glass_breakage': '#00FFFF',
+            'broken_glass': '#00FFFF',
+        },
+        "claves": ("predictions",),
+        "min_probabilidad": 0.3,
+        "grosor": 3,
+        "relleno": 0.1,
+        "fondo_etiqueta": True,
+    },
+}
+
+COLOR_DEFECTO = '#FFFFFF'
+MIN_PROBABILIDAD_DEFECTO = 0.5
+FUENTE = cv2.FONT_HERSHEY_SIMPLEX
+ESCALA_FUENTE = 0.5
+
+def hex_a_bgr(color):
+    color = color.lstrip('#')
+    r, g, b = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+    return (b, g, r)
+
+def cargar_predicciones(origen):
+    """Acepta dict, texto JSON o ruta a un archivo JSON"""
+    if isinstance(origen, dict):
+        return origen
+    if isinstance(origen, str):
+        texto = origen.strip()
+        if not texto.startswith('{'):
+            with open(origen, 'r', encoding='utf-8') as f:
+                texto = f.read()
+        parsed = json.loads(texto)
+        if isinstance(parsed, dict):
+            return parsed
+    raise Exception("Predicciones inválidas: se esperaba un objeto JSON")
+
+def predicciones_visibles(parsed, estilo):
+    """Filtra por umbral y devuelve (cajas normalizadas N x 4, etiquetas, probabilidades)"""
+    predicciones = []
+    for clave in estilo["claves"]:
+        if parsed.get(clave) is not None:
+            predicciones = parsed[clave]
+            break
+
+    umbral = estilo["min_probabilidad"]
+    if umbral is None:
+        umbral = parsed.get("minProbability", MIN_PROBABILIDAD_DEFECTO)
+
+    cajas, etiquetas, probabilidades = [], [], []
+    for prediccion in predicciones:
+        box = prediccion.get("boundingBox")
+        if not box:
+            continue
+        probabilidad = prediccion.get("probability")
+        # Igual que en PHP: sin probabilidad solo se descarta con umbral fijo (estilo report)
+        if probabilidad is None and estilo["min_probabilidad"] is not None:
+            probabilidad = 0.0
+        if probabilidad is not None and probabilidad < umbral:
+            continue
+
+        cajas.append((box.get("left", 0), box.get("top", 0), box.get("width", 0), box.get("height", 0)))
+        etiquetas.append(prediccion.get("tagName", ""))
+        probabilidades.append(probabilidad or 0.0)
+
+    return np.asarray(cajas, dtype=np.float64).reshape(-1, 4), etiquetas, probabilidades
+
+def dibujar_overlay(img, parsed, estilo):
+    """Dibuja todas las cajas y etiquetas sobre img (in-place) y devuelve el número de cajas"""
+    cajas, etiquetas, probabilidades = predicciones_visibles(parsed, estilo)
+    if not len(cajas):
+        return 0
+
+    h, w = img.shape[:2]
+    # Coordenadas en píxeles de todas las cajas a la vez (truncado como el (int) de PHP)
+    px = (cajas * np.array([w, h, w, h], dtype=np.float64)).astype(np.int64)
+    x0, y0 = px[:, 0], px[:, 1]
+    x1, y1 = x0 + px[:, 2], y0 + px[:, 3]
+    colores = [hex_a_bgr(estilo["colores"].get(tag, COLOR_DEFECTO)) for tag in etiquetas]
+
+    # Rellenos semitransparentes: se pintan todos en una capa y se mezclan una sola vez
+    if estilo["relleno"] > 0:
+        capa = img.copy()
+        for i in range(len(px)):
+            cv2.rectangle(capa, (int(x0[i]), int(y0[i])), (int(x1[i]), int(y1[i])), (0, 0, 0), -1)
+        cv2.addWeighted(capa, estilo["relleno"], img, 1.0 - estilo["relleno"], 0, dst=img)
+
+    for i, tag in enumerate(etiquetas):
+        color = colores[i]
+        left, top = int(x0[i]), int(y0[i])
+        cv2.rectangle(img, (left, top), (int(x1[i]), int(y1[i])), color, estilo["grosor"])
+
+        label = f"{tag} ({probabilidades[i] * 100:.1f}%)"
+        if estilo["fondo_etiqueta"]:
+            fondo_top = max(0, top - 25)
+            cv2.rectangle(img, (left, fondo_top), (left + len(label) * 8, fondo_top + 20), color, -1)
+            origen = (left + 2, max(10, top - 8))
+        else:
+            origen = (left, top - 12)
+        cv2.putText(img, label, origen, FUENTE, ESCALA_FUENTE, (255, 255, 255), 1, cv2.LINE_AA)
+
+    return len(px)
+
+def render(input_path, predicciones, output_path, style="zip", quality=90):
+    """Carga, dibuja y guarda una imagen; devuelve el dict de resultado"""
+    if style not in ESTILOS:
+        raise Exception(f"Estilo desconocido: {style} (válidos: {', '.join(ESTILOS)})")
+
+    start = time.perf_counter()
+    img = leer_imagen(input_path)
+    if img is None:
+        raise Exception(f"No se pudo cargar la imagen: {describir(input_path)}")
+
+    cajas = dibujar_overlay(img, cargar_predicciones(predicciones), ESTILOS[style])
+    size = guardar_imagen(img, output_path, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+
+    return {
+        "success": True,
+        "output_path": output_path if isinstance(output_path, str) else None,
+        "style": style,
+        "cajas": cajas,
+        "bytes": int(size),
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+# ============================================================
+# ✅ MODO LOTE: pool de procesos
+# ============================================================
+
+def _iniciar_worker():
+    # Cada proceso dibuja una imagen a la vez: sin hilos internos de OpenCV compitiendo
+    cv2.setNumThreads(1)
+
+def render_entrada(entry, style="zip", quality=90):
+    """Worker del pool: nunca lanza, devuelve el dict de resultado o de error"""
+    try:
+        if not entry.get("input_path") or not entry.get("output_path"):
+            raise Exception("Se requieren input_path y output_path")
+        predicciones = entry.get("predictions", entry.get("predictions_path"))
+        if predicciones is None:
+            raise Exception("Se requiere predictions o predictions_path")
+        result = render(entry["input_path"], predicciones, entry["output_path"],
+                        entry.get("style", style), entry.get("quality", quality))
+    except Exception as e:
+        result = {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+
+    result["id"] = entry.get("id")
+    result["input_path"] = entry.get("input_path")
+    return result
+
+def load_manifest(manifest_path):
+    """Manifiesto JSON (lista) o JSON-lines ("-" para stdin)"""
+    if manifest_path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    content = content.strip()
+    if not content:
+        return []
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+def run_batch(manifest_path, workers=None, style="zip", quality=90, out=None):
+    """Reparte el manifiesto en un pool de procesos y emite una línea JSON por imagen"""
+    out = out or sys.stdout
+    entries = load_manifest(manifest_path)
+    workers = max(1, workers or os.cpu_count() or 1)
+    start = time.perf_counter()
+    total_ok = 0
+
+    print(f"🎨 Renderizando {len(entries)} imagen(es) con {workers} proceso(s)", file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker) as pool:
+        futures = [pool.submit(render_entrada, entry, style, quality) for entry in entries]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.get("success"):
+                total_ok += 1
+            out.write(json.dumps(result, ensure_ascii=True) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"🎉 Renderizadas {total_ok}/{len(entries)} en {elapsed:.1f}s", file=sys.stderr)
+    return total_ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Dibuja las detecciones de IA sobre imágenes procesadas')
+    parser.add_argument('input_path', nargs='?', help='Imagen procesada')
+    parser.add_argument('predictions', nargs='?', help='JSON de predicciones (ruta o texto)')
+    parser.add_argument('output_path', nargs='?', help='Ruta de la imagen analizada')
+    parser.add_argument('--style', default='zip', choices=list(ESTILOS), help='Colores y filtros a aplicar')
+    parser.add_argument('--quality', type=int, default=90, help='Calidad JPEG de salida')
+    parser.add_argument('--batch', default=None, metavar='MANIFEST',
+                        help='Modo lote: manifiesto JSON o JSON-lines ("-" para stdin)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('OVERLAY_WORKERS', 0)) or None,
+                        help='Procesos del pool en modo lote (por defecto, núcleos disponibles)')
+    args = parser.parse_args()
+
+    try:
+        if args.batch:
+            run_batch(args.batch, args.workers, args.style, args.quality)
+            sys.exit(0)
+
+        if not (args.input_path and args.predictions and args.output_path):
+            parser.error('input_path, predictions y output_path son obligatorios fuera del modo --batch')
+
+        print(json.dumps(render(args.input_path, args.predictions, args.output_path, args.style, args.quality),
+                         ensure_ascii=True))
+    except Exception as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=True))
+        traceback.print_exc()
+        sys.exit(1)
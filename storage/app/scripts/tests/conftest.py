@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los scripts importan sus módulos hermanos (panel_io, panel_s3...) sin paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+"""
+leer_cabecera sobre imágenes codificadas con OpenCV (JPEG con EXIF, PNG, WebP
+con pérdida y sin pérdida), un WebP VP8X construido a mano y entradas truncadas.
+"""
+
+import io
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from image_headers import dimensiones_efectivas, leer_cabecera
+
+ANCHO, ALTO = 120, 80
+
+def codificar(ext, params=None):
+    img = np.zeros((ALTO, ANCHO, 3), np.uint8)
+    cv2.rectangle(img, (10, 10), (60, 40), (200, 150, 100), -1)
+    ok, datos = cv2.imencode(ext, img, params or [])
+    assert ok
+    return datos.tobytes()
+
+def app1_orientacion(orientacion, orden='<'):
+    """Segmento APP1 Exif con un IFD0 de una única entrada: Orientation (0x0112, SHORT)"""
+    marca = b'II' if orden == '<' else b'MM'
+    tiff = marca + struct.pack(orden + 'HI', 42, 8)
+    tiff += struct.pack(orden + 'H', 1)
+    tiff += struct.pack(orden + 'HHIH', 0x0112, 3, 1, orientacion) + b'\x00\x00'
+    tiff += struct.pack(orden + 'I', 0)
+    cuerpo = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(cuerpo) + 2) + cuerpo
+
+def jpeg_con_orientacion(orientacion, orden='<'):
+    datos = codificar('.jpg')
+    return datos[:2] + app1_orientacion(orientacion, orden) + datos[2:]
+
+def leer(datos):
+    return leer_cabecera(io.BytesIO(datos))
+
+@pytest.mark.parametrize("orden", ['<', '>'])
+def test_jpeg_con_orientacion_6(orden):
+    datos = jpeg_con_orientacion(6, orden)
+    info = leer(datos)
+
+    assert info["formato"] == "jpeg"
+    assert (info["ancho"], info["alto"]) == (ANCHO, ALTO)
+    assert info["orientacion_exif"] == 6
+    assert info["corrupto"] is False
+    # Con orientación 6 cv2 rota la imagen al decodificarla: ancho y alto se intercambian
+    assert dimensiones_efectivas(info) == (ALTO, ANCHO)
+    img = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+    assert img.shape[1::-1] == dimensiones_efectivas(info)
+
+def test_jpeg_sin_exif():
+    info = leer(codificar('.jpg'))
+    assert (info["formato"], info["ancho"], info["alto"], info["orientacion_exif"]) == ("jpeg", ANCHO, ALTO, None)
+    assert dimensiones_efectivas(info) == (ANCHO, ALTO)
+
+def test_png():
+    info = leer(codificar('.png'))
+    assert (info["formato"], info["ancho"], info["alto"], info["corrupto"]) == ("png", ANCHO, ALTO, False)
+
+@pytest.mark.parametrize("params, chunk", [
+    ([cv2.IMWRITE_WEBP_QUALITY, 80], b'VP8 '),
+    ([cv2.IMWRITE_WEBP_QUALITY, 101], b'VP8L'),  # calidad > 100 = sin pérdida
+])
+def test_webp_codificado(params, chunk):
+    datos = codificar('.webp', params)
+    assert datos[12:16] == chunk
+
+    info = leer(datos)
+    assert (info["formato"], info["ancho"], info["alto"], info["corrupto"]) == ("webp", ANCHO, ALTO, False)
+
+def test_webp_vp8x():
+    # Cabecera extendida: flags (4 bytes) y ancho-1 / alto-1 en 24 bits little-endian
+    cuerpo = b'VP8X' + struct.pack('<I', 10) + b'\x00' * 4
+    cuerpo += (4000 - 1).to_bytes(3, 'little') + (3000 - 1).to_bytes(3, 'little')
+    datos = b'RIFF' + struct.pack('<I', 4 + len(cuerpo)) + b'WEBP' + cuerpo
+
+    info = leer(datos)
+    assert (info["formato"], info["ancho"], info["alto"], info["corrupto"]) == ("webp", 4000, 3000, False)
+
+@pytest.mark.parametrize("ext", ['.jpg', '.png', '.webp'])
+@pytest.mark.parametrize("corte", [0, 1, 3, 12, 20])
+def test_entrada_truncada(ext, corte):
+    info = leer(codificar(ext)[:corte])
+    assert info["corrupto"] is True
+    assert info["motivo"]
+    assert info["ancho"] is None and info["alto"] is None
+    assert dimensiones_efectivas(info) == (None, None)
+
+def test_jpeg_truncado_antes_del_sof():
+    # El APP1 anuncia más bytes de los que hay: la lectura se corta dentro del segmento
+    datos = jpeg_con_orientacion(6)
+    info = leer(datos[:30])
+    assert info["corrupto"] is True
+    assert "truncada" in info["motivo"]
+
+def test_formato_desconocido():
+    info = leer(b'no es una imagen' * 4)
+    assert info["corrupto"] is True
+    assert info["formato"] is None
@@ -0,0 +1,53 @@
+"""
+pares_cercanos (multi-index hashing) frente a la distancia de Hamming por fuerza
+bruta: mismas parejas y mismas distancias para varios radios.
+"""
+
+import numpy as np
+import pytest
+
+from near_duplicates import agrupar, pares_cercanos
+
+def hashes_con_vecinos(n=300, semilla=7):
+    """Hashes aleatorios más copias con 1..12 bits volteados, para que haya parejas en todos los radios"""
+    rng = np.random.default_rng(semilla)
+    base = rng.integers(0, 2 ** 63, size=n, dtype=np.uint64) | (rng.integers(0, 2, size=n, dtype=np.uint64) << np.uint64(63))
+    vecinos = []
+    for k, h in enumerate(base[:60]):
+        bits = rng.choice(64, size=1 + k % 12, replace=False)
+        mascara = np.uint64(0)
+        for b in bits:
+            mascara |= np.uint64(1) << np.uint64(int(b))
+        vecinos.append(h ^ mascara)
+    hashes = np.concatenate([base, np.array(vecinos, dtype=np.uint64), base[:5]])  # incluye duplicados exactos
+    return hashes[rng.permutation(len(hashes))]
+
+def fuerza_bruta(hashes, radio):
+    enteros = [int(h) for h in hashes]
+    return {
+        (i, j, bin(enteros[i] ^ enteros[j]).count('1'))
+        for i in range(len(enteros))
+        for j in range(i + 1, len(enteros))
+        if bin(enteros[i] ^ enteros[j]).count('1') <= radio
+    }
+
+@pytest.mark.parametrize("radio", [0, 3, 4, 6, 8, 10, 12])
+def test_pares_cercanos_igual_que_fuerza_bruta(radio):
+    hashes = hashes_con_vecinos()
+    i, j, d = pares_cercanos(hashes, radio)
+
+    assert np.all(i < j)
+    assert np.all(d <= radio)
+    # Una pareja puede aparecer en varios tramos: se compara como conjunto
+    assert set(zip(i.tolist(), j.tolist(), d.tolist())) == fuerza_bruta(hashes, radio)
+
+def test_pares_cercanos_sin_parejas():
+    hashes = np.array([0, 0xFFFFFFFFFFFFFFFF], dtype=np.uint64)
+    i, j, d = pares_cercanos(hashes, 10)
+    assert len(i) == len(j) == len(d) == 0
+
+def test_agrupar_une_parejas_transitivas():
+    # 0-1 y 1-2 a distancia 2, 0-2 a distancia 4: con radio 2 forman un único grupo
+    hashes = np.array([0b0000, 0b0011, 0b1111, 0xFFFFFFFF00000000], dtype=np.uint64)
+    grupos = sorted((sorted(miembros), distancia) for miembros, distancia in agrupar(hashes, 2))
+    assert grupos == [([0, 1, 2], 2), ([3], 0)]
@@ -0,0 +1,101 @@
+"""
+ResultCache: la clave cambia con el modelo, los parámetros y algorithm_version;
+un acierto devuelve el resultado guardado y la expulsión borra primero las
+entradas menos usadas.
+"""
+
+import os
+
+import pytest
+
+from panel_cache import ResultCache
+
+TAMANO_SALIDA = 70000
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), max_mb=0.25)
+
+@pytest.fixture
+def entrada(tmp_path):
+    ruta = tmp_path / "panel.jpg"
+    ruta.write_bytes(b"\xff\xd8 panel \xff\xd9")
+    return str(ruta)
+
+@pytest.fixture
+def modelo(tmp_path):
+    ruta = tmp_path / "best.pt"
+    ruta.write_bytes(b"pesos v1")
+    return str(ruta)
+
+def guardar_entrada(cache, tmp_path, nombre, **params):
+    """Guarda un resultado con una salida de TAMANO_SALIDA bytes y devuelve su clave"""
+    salida = tmp_path / f"{nombre}.jpg"
+    salida.write_bytes(os.urandom(TAMANO_SALIDA))
+    clave = cache.clave(nombre.encode(), str(salida), None, "1", **params)
+    cache.guardar(clave, {"success": True, "nombre": nombre}, str(salida))
+    return clave
+
+def test_clave_estable(cache, entrada, modelo, tmp_path):
+    salida = str(tmp_path / "out.jpg")
+    assert cache.clave(entrada, salida, modelo, "1", filas=6) == cache.clave(entrada, salida, modelo, "1", filas=6)
+    # Bytes en memoria y archivo con el mismo contenido dan la misma clave
+    with open(entrada, "rb") as f:
+        assert cache.clave(f.read(), salida, modelo, "1", filas=6) == cache.clave(entrada, salida, modelo, "1", filas=6)
+
+def test_clave_cambia_con_parametros_y_version(cache, entrada, modelo, tmp_path):
+    salida = str(tmp_path / "out.jpg")
+    base = cache.clave(entrada, salida, modelo, "1", filas=6, columnas=10)
+
+    assert cache.clave(entrada, salida, modelo, "1", filas=6, columnas=12) != base
+    assert cache.clave(entrada, salida, modelo, "1", filas=6, columnas=10, confidence=0.5) != base
+    assert cache.clave(entrada, salida, modelo, "2", filas=6, columnas=10) != base
+    assert cache.clave(entrada, str(tmp_path / "out.png"), modelo, "1", filas=6, columnas=10) != base
+
+def test_clave_cambia_con_el_modelo(cache, entrada, modelo, tmp_path):
+    salida = str(tmp_path / "out.jpg")
+    base = cache.clave(entrada, salida, modelo, "1")
+
+    with open(modelo, "wb") as f:
+        f.write(b"pesos v2")
+    # Fuerza un mtime distinto aunque el sistema de archivos tenga poca resolución
+    stat = os.stat(modelo)
+    os.utime(modelo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cache.clave(entrada, salida, modelo, "1") != base
+    # Un proceso nuevo (sin memoria del hash) obtiene la misma clave para el modelo nuevo
+    assert ResultCache(cache.directorio).clave(entrada, salida, modelo, "1") == cache.clave(entrada, salida, modelo, "1")
+
+def test_guardar_y_obtener(cache, tmp_path):
+    clave = guardar_entrada(cache, tmp_path, "a", filas=6)
+    destino = str(tmp_path / "copia" / "a.jpg")
+
+    result = cache.obtener(clave, destino)
+
+    assert result == {"success": True, "nombre": "a", "cache": "hit"}
+    assert open(destino, "rb").read() == (tmp_path / "a.jpg").read_bytes()
+    assert cache.obtener("0" * 64, destino) is None
+
+def test_no_guarda_fallos(cache, tmp_path):
+    salida = tmp_path / "fallo.jpg"
+    salida.write_bytes(b"x")
+    clave = cache.clave(b"fallo", str(salida), None, "1")
+
+    cache.guardar(clave, {"success": False, "error": "sin panel"}, str(salida))
+
+    assert cache.obtener(clave, str(tmp_path / "otra.jpg")) is None
+
+def test_expulsion_lru(cache, tmp_path):
+    claves = [guardar_entrada(cache, tmp_path, nombre) for nombre in ("a", "b", "c")]
+    # mtimes explícitos: a es la más antigua, pero un acierto la marca como recién usada
+    for antiguedad, clave in zip((3000, 2000, 1000), claves):
+        ruta = cache._ruta(clave)
+        os.utime(ruta, (os.stat(ruta).st_atime - antiguedad,) * 2)
+    assert cache.obtener(claves[0], str(tmp_path / "hit.jpg")) is not None
+
+    # La cuarta entrada supera el máximo (4 x 70 KB > 256 KB): se expulsa solo b
+    clave_d = guardar_entrada(cache, tmp_path, "d")
+
+    presentes = {clave for clave in claves + [clave_d] if os.path.isdir(cache._ruta(clave))}
+    assert presentes == {claves[0], claves[2], clave_d}
+    assert sum(tamano for _, tamano, _ in cache._entradas()) <= cache.max_bytes * 0.9
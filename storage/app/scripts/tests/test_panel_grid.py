@@ -0,0 +1,77 @@
+"""
+estadisticas_celdas (imágenes integrales) frente a la media, la desviación y la
+fracción oscura calculadas celda a celda con numpy, con y sin transposición.
+"""
+
+import numpy as np
+import pytest
+
+from panel_grid import estadisticas_celdas, limites
+
+def imagen(alto, ancho, semilla=3):
+    rng = np.random.default_rng(semilla)
+    gray = rng.integers(0, 256, size=(alto, ancho), dtype=np.uint8)
+    gray[: alto // 5, : ancho // 4] = 10  # zona oscura para que "oscuro" no sea trivial
+    return gray
+
+def esperado(gray, filas, columnas, umbral_oscuro=50):
+    """Estadísticas celda a celda recorriendo la rejilla (std poblacional, como la de la integral)"""
+    ys, xs = limites(gray.shape[0], filas), limites(gray.shape[1], columnas)
+    media = np.empty((filas, columnas))
+    std = np.empty((filas, columnas))
+    oscuro = np.empty((filas, columnas))
+    for f in range(filas):
+        for c in range(columnas):
+            celda = gray[ys[f]:ys[f + 1], xs[c]:xs[c + 1]].astype(np.float64)
+            media[f, c] = celda.mean()
+            std[f, c] = celda.std()
+            oscuro[f, c] = (celda < umbral_oscuro).mean()
+    return media, std, oscuro
+
+def comparar(resultado, media, std, oscuro):
+    # El JSON redondea a 1 decimal (3 para la fracción oscura)
+    np.testing.assert_allclose(resultado["media"], media, atol=0.05 + 1e-9)
+    np.testing.assert_allclose(resultado["std"], std, atol=0.05 + 1e-6)
+    np.testing.assert_allclose(resultado["oscuro"], oscuro, atol=0.0005 + 1e-9)
+
+@pytest.mark.parametrize("alto, ancho, filas, columnas", [
+    (241, 97, 24, 6),    # vertical, filas >= columnas: sin transponer
+    (97, 241, 6, 24),    # horizontal, filas < columnas: sin transponer
+    (101, 103, 3, 7),    # tramos de tamaño desigual
+])
+def test_igual_que_numpy_por_celda(alto, ancho, filas, columnas):
+    gray = imagen(alto, ancho)
+    resultado = estadisticas_celdas(gray, filas, columnas)
+
+    assert resultado["transpuesta"] is False
+    assert (resultado["filas"], resultado["columnas"]) == (filas, columnas)
+    comparar(resultado, *esperado(gray, filas, columnas))
+
+@pytest.mark.parametrize("alto, ancho, filas, columnas", [
+    (97, 241, 24, 6),    # recorte horizontal de un panel con más filas que columnas
+    (241, 97, 6, 24),
+])
+def test_transpuesta(alto, ancho, filas, columnas):
+    gray = imagen(alto, ancho)
+    resultado = estadisticas_celdas(gray, filas, columnas)
+
+    assert resultado["transpuesta"] is True
+    assert np.shape(resultado["media"]) == (filas, columnas)
+    # Las filas van a lo largo del lado mayor: equivale a la rejilla sobre gray.T
+    comparar(resultado, *esperado(np.ascontiguousarray(gray.T), filas, columnas))
+    # La matriz no depende de la orientación del recorte
+    directo = estadisticas_celdas(np.ascontiguousarray(gray.T), filas, columnas)
+    assert directo["transpuesta"] is False
+    assert directo["media"] == resultado["media"] and directo["std"] == resultado["std"]
+
+def test_imagen_color_usa_gris():
+    gray = imagen(60, 40)
+    color = np.repeat(gray[:, :, None], 3, axis=2)
+    assert estadisticas_celdas(color, 6, 4)["media"] == estadisticas_celdas(gray, 6, 4)["media"]
+
+def test_celda_atipica_oscura():
+    gray = np.full((240, 60), 150, np.uint8)
+    gray += np.random.default_rng(1).integers(0, 5, size=gray.shape, dtype=np.uint8)
+    gray[40:60, 20:40] = 20  # celda (fila 2, columna 1) de una rejilla 12 x 3
+    atipicas = estadisticas_celdas(gray, 12, 3)["atipicas"]
+    assert [(a["fila"], a["columna"], a["motivo"]) for a in atipicas] == [(2, 1, "oscura")]
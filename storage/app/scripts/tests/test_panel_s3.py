@@ -0,0 +1,109 @@
+"""
+Ida y vuelta contra un bucket simulado con moto: descarga s3:// ->
+procesamiento clásico -> publicación de la salida y sus derivados, y limpieza
+de los archivos locales cuando la publicación falla o no hay nada que subir.
+"""
+
+import json
+import os
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+import panel_s3
+
+BUCKET = "gudnus-test"
+CLAVE_ORIGINAL = "projects/1/images/original/panel.jpg"
+CLAVE_PROCESADA = "projects/1/images/processed/panel.jpg"
+
+def imagen_panel():
+    """Panel claro con separaciones entre celdas sobre fondo oscuro"""
+    img = np.full((1600, 1200, 3), 20, np.uint8)
+    cv2.rectangle(img, (200, 150), (1000, 1450), (180, 170, 160), -1)
+    for y in range(150, 1450, 108):
+        cv2.line(img, (200, y), (1000, y), (90, 90, 90), 3)
+    for x in range(200, 1000, 133):
+        cv2.line(img, (x, 150), (x, 1450), (90, 90, 90), 3)
+    ok, datos = cv2.imencode(".jpg", img)
+    assert ok
+    return datos.tobytes()
+
+@pytest.fixture
+def bucket(monkeypatch, tmp_path):
+    for variable in ("WASABI_ENDPOINT", "WASABI_BUCKET", "PANEL_CACHE_DIR"):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv("WASABI_KEY", "testing")
+    monkeypatch.setenv("WASABI_SECRET", "testing")
+    monkeypatch.setenv("WASABI_REGION", "us-east-1")
+    monkeypatch.setattr(panel_s3, "_cliente", None)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    with moto.mock_aws():
+        s3 = panel_s3.cliente()
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+def test_ida_y_vuelta_descarga_proceso_publicacion(bucket, tmp_path, capsys):
+    import process_image_improved
+
+    bucket.put_object(Bucket=BUCKET, Key=CLAVE_ORIGINAL, Body=imagen_panel())
+
+    process_image_improved.process_image(panel_s3.uri(BUCKET, CLAVE_ORIGINAL), panel_s3.uri(BUCKET, CLAVE_PROCESADA),
+                                         filas=12, columnas=6, derivados=["thumb", "report", "webp"])
+    result = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+
+    assert "error" not in result, result.get("error")
+    assert result["output_key"] == CLAVE_PROCESADA
+    procesada = panel_s3.descargar(panel_s3.uri(BUCKET, CLAVE_PROCESADA))
+    assert cv2.imdecode(np.frombuffer(procesada, np.uint8), cv2.IMREAD_COLOR) is not None
+
+    claves = panel_s3.claves_derivados(CLAVE_PROCESADA)
+    assert {d["tipo"]: d["key"] for d in result["derivados"]} == claves
+    for clave in claves.values():
+        assert bucket.head_object(Bucket=BUCKET, Key=clave)["ContentLength"] > 0
+    assert bucket.head_object(Bucket=BUCKET, Key=claves["webp"])["ContentType"] == "image/webp"
+
+    # Nada queda en el directorio temporal local
+    assert os.listdir(tmp_path) == []
+
+def archivos_locales(tmp_path):
+    local = tmp_path / "salida.jpg"
+    local.write_bytes(b"jpg")
+    derivados = []
+    for tipo in ("thumb", "report", "webp"):
+        path = tmp_path / f"salida_{tipo}.jpg"
+        path.write_bytes(b"derivado")
+        derivados.append({"tipo": tipo, "path": str(path)})
+    return str(local), derivados
+
+def test_publicar_limpia_si_una_subida_falla(bucket, tmp_path, monkeypatch):
+    local, derivados = archivos_locales(tmp_path)
+    subidas = []
+
+    def subir_y_fallar(datos, destino):
+        subidas.append(destino)
+        if len(subidas) == 2:
+            raise Exception("Conexión perdida")
+
+    monkeypatch.setattr(panel_s3, "subir", subir_y_fallar)
+    with pytest.raises(Exception, match="Conexión perdida"):
+        panel_s3.publicar({"success": True, "derivados": derivados}, panel_s3.uri(BUCKET, CLAVE_PROCESADA), local)
+
+    assert len(subidas) == 2
+    assert os.listdir(tmp_path) == []
+    assert all(d["path"] is None for d in derivados)
+
+def test_publicar_resultado_fallido_no_sube_y_limpia(bucket, tmp_path, monkeypatch):
+    local, derivados = archivos_locales(tmp_path)
+    monkeypatch.setattr(panel_s3, "subir", lambda datos, destino: pytest.fail("No debe subir un resultado fallido"))
+
+    result = panel_s3.publicar({"success": False, "error": "x", "derivados": derivados},
+                               panel_s3.uri(BUCKET, CLAVE_PROCESADA), local)
+
+    assert "output_key" not in result
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,157 @@
+"""
+Evalúa el triaje local (panel_triage) contra las etiquetas de la IA.
+
+Uso:
+  triage_eval.py corpus.jsonl [--workers 8] [--min-probabilidad 0.3] [--detalle detalle.jsonl]
+
+corpus.jsonl (lo genera `php artisan triage:export`) tiene una línea por
+imagen procesada: {"image_id", "input_path" (ruta local o s3://),
+"ai_response_json", "filas", "columnas"}. Una imagen es positiva para la IA si
+alguna predicción tiene probabilidad >= --min-probabilidad (0.3, el mismo
+umbral que los informes).
+
+Imprime un JSON con el acuerdo, la sensibilidad (positivas de la IA que el
+triaje manda a analizar), el volumen de análisis que se ahorraría, el barrido
+de umbrales con el umbral más alto que mantiene --recall-objetivo, y el
+throughput del triaje (imágenes/s y percentiles de ms).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from panel_io import leer_imagen
+from panel_s3 import descargar
+from panel_triage import triaje, umbral_triaje
+
+PROGRESO_CADA = 100
+
+def cargar_corpus(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not entry.get("input_path") or entry.get("ai_response_json") is None:
+                raise Exception(f"Línea {i + 1} del corpus inválida: se requieren input_path y ai_response_json")
+            entries.append(entry)
+    return entries
+
+def etiqueta_ia(ai_response, min_probabilidad):
+    """True si la IA encontró algún defecto por encima del umbral"""
+    if isinstance(ai_response, str):
+        ai_response = json.loads(ai_response) if ai_response.strip() else {}
+    predicciones = (ai_response or {}).get("predictions") or []
+    return any(p.get("tagName") and (p.get("probability") or 0.0) >= min_probabilidad for p in predicciones)
+
+def evaluar_entrada(entry, filas, columnas, min_probabilidad):
+    """Nunca lanza: devuelve el registro de detalle de la imagen"""
+    registro = {"image_id": entry.get("image_id"), "input_path": entry["input_path"]}
+    try:
+        registro["ia"] = etiqueta_ia(entry["ai_response_json"], min_probabilidad)
+        start = time.perf_counter()
+        img = leer_imagen(descargar(entry["input_path"]))
+        registro["decode_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        if img is None:
+            raise Exception(f"No se pudo cargar la imagen: {entry['input_path']}")
+
+        resultado = triaje(img, int(entry.get("filas") or filas), int(entry.get("columnas") or columnas))
+        registro.update({"confianza": resultado["confianza"], "motivos": resultado["motivos"],
+                         "senales": resultado["senales"], "triage_ms": resultado["ms"]})
+    except Exception as e:
+        registro["error"] = str(e)
+    return registro
+
+def metricas(ia, confianza, umbral):
+    analizar = confianza >= umbral
+    positivas = int(ia.sum())
+    verdaderos = int((analizar & ia).sum())
+    return {
+        "umbral": round(float(umbral), 3),
+        "acuerdo": round(float((analizar == ia).mean()), 4),
+        "sensibilidad": round(verdaderos / positivas, 4) if positivas else None,
+        "precision": round(verdaderos / int(analizar.sum()), 4) if analizar.any() else None,
+        "falsos_negativos": int((~analizar & ia).sum()),
+        "analisis_ahorrado": round(float((~analizar).mean()), 4),
+    }
+
+def resumen(registros, umbral, recall_objetivo, segundos, workers):
+    validos = [r for r in registros if "error" not in r]
+    resultado = {
+        "total": len(registros),
+        "evaluadas": len(validos),
+        "errores": len(registros) - len(validos),
+        "workers": workers,
+        "segundos": round(segundos, 2),
+        "imagenes_por_segundo": round(len(registros) / segundos, 2) if segundos > 0 else None,
+    }
+    if not validos:
+        return resultado
+
+    ia = np.array([r["ia"] for r in validos], dtype=bool)
+    confianza = np.array([r["confianza"] for r in validos], dtype=np.float64)
+    triage_ms = np.array([r["triage_ms"] for r in validos])
+    decode_ms = np.array([r["decode_ms"] for r in validos])
+
+    barrido = [metricas(ia, confianza, u) for u in np.arange(0.05, 1.0, 0.05)]
+    seguros = [m for m in barrido if m["sensibilidad"] is None or m["sensibilidad"] >= recall_objetivo]
+
+    resultado.update({
+        "positivas_ia": int(ia.sum()),
+        "en_umbral": metricas(ia, confianza, umbral),
+        "recall_objetivo": recall_objetivo,
+        "umbral_recomendado": seguros[-1]["umbral"] if seguros else None,
+        "barrido": barrido,
+        "triage_ms": {"p50": round(float(np.percentile(triage_ms, 50)), 2),
+                      "p95": round(float(np.percentile(triage_ms, 95)), 2)},
+        "decode_ms": {"p50": round(float(np.percentile(decode_ms, 50)), 2),
+                      "p95": round(float(np.percentile(decode_ms, 95)), 2)},
+    })
+    return resultado
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluar el triaje local frente a las etiquetas de la IA')
+    parser.add_argument('corpus', help='JSON-lines con input_path y ai_response_json por imagen')
+    parser.add_argument('--filas', type=int, default=24, help='Filas por defecto si la entrada no las trae')
+    parser.add_argument('--columnas', type=int, default=6, help='Columnas por defecto si la entrada no las trae')
+    parser.add_argument('--umbral', type=float, default=None, help='Umbral a evaluar (por defecto PANEL_TRIAGE_UMBRAL)')
+    parser.add_argument('--min-probabilidad', type=float, default=0.3,
+                        help='Probabilidad mínima de una predicción de la IA para contar como defecto')
+    parser.add_argument('--recall-objetivo', type=float, default=0.99,
+                        help='Sensibilidad mínima exigida al umbral recomendado')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--detalle', default=None, help='JSON-lines con el resultado de cada imagen')
+    args = parser.parse_args()
+
+    entries = cargar_corpus(args.corpus)
+    umbral = args.umbral if args.umbral is not None else umbral_triaje()
+    print(f"🚀 Evaluando triaje sobre {len(entries)} imagen(es) con {args.workers} hilo(s)", file=sys.stderr)
+
+    start = time.perf_counter()
+    registros = []
+    detalle = open(args.detalle, 'w', encoding='utf-8') if args.detalle else None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            for registro in pool.map(lambda e: evaluar_entrada(e, args.filas, args.columnas, args.min_probabilidad),
+                                     entries):
+                registros.append(registro)
+                if detalle:
+                    detalle.write(json.dumps(registro, ensure_ascii=True) + "\n")
+                if "error" in registro:
+                    print(f"⚠️ {registro['input_path']}: {registro['error']}", file=sys.stderr)
+                if len(registros) % PROGRESO_CADA == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"⏱️ {len(registros)}/{len(entries)} ({len(registros) / elapsed:.1f} imágenes/s)",
+                          file=sys.stderr)
+    finally:
+        if detalle:
+            detalle.close()
+
+    print(json.dumps(resumen(registros, umbral, args.recall_objetivo, time.perf_counter() - start,
+                             max(1, args.workers)), ensure_ascii=True))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Ingesta de ZIPs grandes sin extracción a disco.
+
+Las imágenes se leen directamente del directorio central del ZIP, con los
+mismos filtros que AnalyzeLargeZipJob (extensiones de imagen, sin __MACOSX ni
+archivos ocultos). Cada miembro se lee en memoria solo cuando el generador lo
+pide y se decodifica con cv2.imdecode, así el procesamiento empieza con el
+primer miembro y el uso de disco no crece con el tamaño del ZIP.
+
+Uso:
+  zip_ingest.py archivo.zip --list
+  zip_ingest.py archivo.zip --process salida/ [--model best.pt | --classical] [--members nombres.json]
+                [--filas N --columnas N --confidence C --cascade --derivatives thumb,report]
+
+--list emite el mismo JSON que AnalyzeLargeZipJob::analyzeImages
+({total_files, valid_images, images: [{name, path, size}]}).
+--process emite una línea JSON por imagen con el resultado del recorte.
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import sys
+import traceback
+import zipfile
+
+import cv2
+
+EXTENSIONES_IMAGEN = {'jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp'}
+
+def es_imagen_valida(nombre):
+    """Mismos filtros que AnalyzeLargeZipJob: extensión de imagen, sin ocultos ni __MACOSX"""
+    nombre = nombre.replace('\\', '/')
+    filename = nombre.rsplit('/', 1)[-1]
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return (
+        extension in EXTENSIONES_IMAGEN
+        and not filename.startswith('.')
+        and '__macosx' not in nombre.lower()
+        and filename.lower() != '.ds_store'
+    )
+
+def ruta_normalizada(miembro):
+    """Ruta del miembro comparable: separadores '/', sin './' ni '/' inicial, sin distinguir mayúsculas"""
+    return posixpath.normpath(miembro.replace('\\', '/')).lstrip('/').lower()
+
+def miembros_imagen(zf, nombres=None, rutas=None):
+    """
+    Generador de ZipInfo de imágenes válidas en el orden del directorio central.
+    `rutas` filtra por la ruta completa normalizada del miembro (dos archivos con
+    el mismo nombre en carpetas distintas son miembros distintos); `nombres`
+    filtra solo por nombre de archivo sin distinguir mayúsculas (como
+    findExtractedFile), para el mapping [{imagen, modulo}].
+    """
+    buscadas = {ruta_normalizada(r) for r in rutas} if rutas is not None else None
+    buscados = {n.replace('\\', '/').rsplit('/', 1)[-1].lower() for n in nombres} if nombres else None
+    for info in zf.infolist():
+        if info.is_dir() or not es_imagen_valida(info.filename):
+            continue
+        if buscadas is not None and ruta_normalizada(info.filename) not in buscadas:
+            continue
+        if buscados is not None and info.filename.replace('\\', '/').rsplit('/', 1)[-1].lower() not in buscados:
+            continue
+        yield info
+
+def leer_miembros(zf, nombres=None, rutas=None):
+    """Generador (ZipInfo, bytes): cada miembro se descomprime en memoria al consumirlo"""
+    for info in miembros_imagen(zf, nombres, rutas):
+        try:
+            yield info, zf.read(info), None
+        except Exception as e:
+            yield info, None, e
+
+def listar(zip_path):
+    """Resumen del ZIP sin extraer (formato de AnalyzeLargeZipJob)"""
+    with zipfile.ZipFile(zip_path) as zf:
+        archivos = [info for info in zf.infolist() if not info.is_dir()]
+        images = [{
+            "name": info.filename.replace('\\', '/').rsplit('/', 1)[-1],
+            "path": info.filename.replace('\\', '/'),
+            "size": info.file_size,
+        } for info in archivos if es_imagen_valida(info.filename)]
+
+    return {
+        "total_files": len(archivos),
+        "valid_images": len(images),
+        "images": images,
+    }
+
+def ruta_salida(output_dir, miembro):
+    """Ruta de salida dentro de output_dir conservando las carpetas del ZIP (sin salir de él)"""
+    relativa = os.path.normpath(miembro.replace('\\', '/')).lstrip(os.sep)
+    if relativa.startswith('..'):
+        relativa = os.path.basename(relativa)
+    return os.path.join(output_dir, os.path.splitext(relativa)[0] + '.jpg')
+
+def procesar_clasico(data, output_path, filas, columnas, derivados):
+    """Pipeline clásico sobre bytes en memoria (misma rotación que process_image_improved)"""
+    import process_image_improved as clasico
+    from panel_io import leer_imagen
+
+    img = leer_imagen(data)
+    if img is None:
+        raise Exception("No se pudo decodificar la imagen")
+    h, w = img.shape[:2]
+    if w > h:
+        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+
+    result = clasico.procesar_imagen_cargada(img, output_path, filas, columnas, derivados=derivados)
+    result.update({"success": True, "method": "improved_fallback", "algorithm_version": "opencv_improved_v2"})
+    return result
+
+def procesar_zip(zip_path, output_dir, model_path=None, classical=False, nombres=None, filas=24, columnas=6,
+                 confidence=0.5, cascade=False, derivados=None, out=None, rutas=None):
+    """Recorta cada imagen del ZIP a medida que se lee; una línea JSON por miembro"""
+    out = out or sys.stdout
+    model = None
+    if not classical:
+        import process_image_wrapped as yolo
+        model = yolo.load_yolo_model(model_path)
+        if model is None and not cascade:
+            raise Exception("No se pudo cargar el modelo YOLO")
+
+    total = ok = 0
+    with zipfile.ZipFile(zip_path) as zf:
+        for info, data, error in leer_miembros(zf, nombres, rutas):
+            total += 1
+            output_path = ruta_salida(output_dir, info.filename)
+            try:
+                if error is not None:
+                    raise error
+                if classical:
+                    result = procesar_clasico(data, output_path, filas, columnas, derivados)
+                else:
+                    result = yolo.process_loaded_image(model, data, output_path, model_path, filas, columnas,
+                                                       confidence, cascade=cascade, derivados=derivados)
+            except Exception as e:
+                print(f"💀 ERROR EN {info.filename}: {e}", file=sys.stderr)
+                result = {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+
+            if result.get("success"):
+                ok += 1
+            result["member"] = info.filename
+            result["output_path"] = output_path if result.get("success") else None
+            out.write(json.dumps(result, ensure_ascii=True) + "\n")
+            out.flush()
+
+    print(f"🎉 ZIP procesado sin extraer: {ok}/{total} imágenes correctas", file=sys.stderr)
+    return ok
+
+def cargar_miembros(members_path):
+    """
+    (rutas, nombres) a procesar. Una lista de rutas de miembros (near_duplicates.py
+    --members-out) se compara por ruta completa; el mapping de HandleZipMappingJob
+    ([{imagen, modulo}]) solo trae nombres de archivo y se compara por nombre.
+    """
+    if not members_path:
+        return None, None
+    with open(members_path, 'r', encoding='utf-8') as f:
+        miembros = json.load(f)
+    if any(isinstance(m, dict) for m in miembros):
+        return None, [m["imagen"] if isinstance(m, dict) else str(m) for m in miembros]
+    return [str(m) for m in miembros], None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ingesta de ZIPs de imágenes sin extracción')
+    parser.add_argument('zip_path', help='Archivo ZIP')
+    parser.add_argument('--list', action='store_true', help='Listar las imágenes válidas (JSON) sin extraer')
+    parser.add_argument('--process', default=None, metavar='OUTPUT_DIR',
+                        help='Recortar cada imagen directamente desde el ZIP y guardar en OUTPUT_DIR')
+    parser.add_argument('--model', default=os.environ.get('YOLO_MODEL_PATH'),
+                        help='Modelo YOLO (por defecto YOLO_MODEL_PATH o best.pt junto al script)')
+    parser.add_argument('--classical', action='store_true', help='Usar solo el pipeline clásico (sin YOLO)')
+    parser.add_argument('--members', default=None,
+                        help='JSON con las rutas de los miembros (near_duplicates.py --members-out) o el mapping a procesar')
+    parser.add_argument('--filas', type=int, default=24)
+    parser.add_argument('--columnas', type=int, default=6)
+    parser.add_argument('--confidence', type=float, default=0.5)
+    parser.add_argument('--cascade', action='store_true',
+                        default=os.environ.get('YOLO_CASCADE', '').lower() in ('1', 'true', 'yes'),
+                        help='Si YOLO falla, aplicar las estrategias clásicas en el mismo proceso')
+    parser.add_argument('--derivatives', default=os.environ.get('PANEL_DERIVATIVES', ''),
+                        help='Derivados a generar junto a cada salida: thumb,report,webp')
+    args = parser.parse_args()
+
+    try:
+        if args.list:
+            print(json.dumps(listar(args.zip_path), ensure_ascii=True))
+            sys.exit(0)
+
+        if not args.process:
+            parser.error('Se requiere --list o --process OUTPUT_DIR')
+
+        from panel_derivatives import parse_derivados
+
+        # Los prints de las librerías van a stderr; stdout queda para las líneas JSON
+        out = sys.stdout
+        sys.stdout = sys.stderr
+        model_path = args.model or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'best.pt')
+        rutas, nombres = cargar_miembros(args.members)
+        procesar_zip(args.zip_path, args.process, model_path, args.classical, nombres,
+                     args.filas, args.columnas, args.confidence, args.cascade,
+                     parse_derivados(args.derivatives), out, rutas)
+    except Exception as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=True), file=sys.__stdout__)
+        traceback.print_exc()
+        sys.exit(1)
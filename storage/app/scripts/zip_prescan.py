@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Pre-escaneo de ZIPs leyendo solo las cabeceras de imagen.
+
+Para cada imagen válida del ZIP (mismos filtros que zip_ingest / AnalyzeLargeZipJob)
+se descomprimen únicamente los bytes hasta el SOFn (JPEG) o el IHDR (PNG), sin
+decodificar píxeles. Así se obtienen dimensiones, megapíxeles, la rotación que
+aplicará el pipeline (w > h tras la orientación EXIF) y un diagnóstico de
+corrupción a miles de archivos por segundo.
+
+En miembros STORED se comprueba además el final del archivo (EOI en JPEG, IEND
+en PNG) en los últimos COLA_EOI bytes leídos directamente del ZIP; en los
+comprimidos comprobarlo obligaría a descomprimir el miembro entero y se omite
+(trailer null). Sin marcador se informa trailer false pero no se marca como
+corrupto: con la misma tolerancia que panel_gate, hay cámaras que añaden datos
+(maker notes, térmicos) tras el EOI y la decodificación es la que decide.
+
+Uso:
+  zip_prescan.py archivo.zip [--chunk-megapixels 2000]
+
+Emite el mismo JSON que zip_ingest.py --list ({total_files, valid_images, images})
+con las cabeceras en cada imagen y un resumen en "prescan". Con
+--chunk-megapixels añade "chunks": rangos [inicio, fin) de images cuyo total de
+píxeles no supera el presupuesto, para repartir el trabajo por carga real.
+"""
+
+import argparse
+import json
+import struct
+import sys
+import time
+import traceback
+import zipfile
+
+from image_headers import dimensiones_efectivas, leer_cabecera
+from panel_gate import COLA_EOI
+from zip_ingest import es_imagen_valida
+
+BYTES_COLA = COLA_EOI
+FINALES = {"jpeg": b'\xff\xd9', "png": b'IEND'}
+
+def cola_stored(fp, info, n=BYTES_COLA):
+    """Últimos n bytes de un miembro STORED leídos del ZIP en bruto; None si no aplica"""
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        return None
+    fp.seek(info.header_offset)
+    cabecera = fp.read(30)
+    if len(cabecera) < 30 or cabecera[:4] != b'PK\x03\x04':
+        return None
+    len_nombre, len_extra = struct.unpack('<HH', cabecera[26:30])
+    inicio = info.header_offset + 30 + len_nombre + len_extra
+    fp.seek(inicio + max(0, info.compress_size - n))
+    return fp.read(min(n, info.compress_size))
+
+def escanear_miembro(zf, fp, info):
+    """Cabecera de un miembro (nunca lanza): dict listo para images_data"""
+    ruta = info.filename.replace('\\', '/')
+    entrada = {
+        "name": ruta.rsplit('/', 1)[-1],
+        "path": ruta,
+        "size": info.file_size,
+    }
+
+    try:
+        with zf.open(info) as stream:
+            cabecera = leer_cabecera(stream)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError, OSError, EOFError) as e:
+        cabecera = {"formato": None, "ancho": None, "alto": None, "orientacion_exif": None,
+                    "corrupto": True, "motivo": f"Miembro ilegible: {e}"}
+
+    trailer = None
+    if not cabecera["corrupto"] and cabecera["formato"] in FINALES:
+        cola = cola_stored(fp, info)
+        if cola is not None:
+            trailer = FINALES[cabecera["formato"]] in cola
+
+    ancho, alto = dimensiones_efectivas(cabecera)
+    entrada.update({
+        "formato": cabecera["formato"],
+        "ancho": ancho,
+        "alto": alto,
+        "megapixeles": round(ancho * alto / 1e6, 3) if ancho else None,
+        "orientacion_exif": cabecera["orientacion_exif"],
+        "rotar": bool(ancho and ancho > alto),
+        "trailer": trailer,
+        "corrupto": cabecera["corrupto"],
+        "motivo": cabecera["motivo"],
+    })
+    return entrada
+
+def agrupar_por_pixeles(images, presupuesto_mp):
+    """Rangos consecutivos [inicio, fin) cuyo total de megapíxeles no supera el presupuesto"""
+    chunks = []
+    inicio, acumulado = 0, 0.0
+    for i, imagen in enumerate(images):
+        mp = imagen["megapixeles"] or 0.0
+        if i > inicio and acumulado + mp > presupuesto_mp:
+            chunks.append({"inicio": inicio, "fin": i, "imagenes": i - inicio, "megapixeles": round(acumulado, 3)})
+            inicio, acumulado = i, 0.0
+        acumulado += mp
+    if inicio < len(images):
+        chunks.append({"inicio": inicio, "fin": len(images), "imagenes": len(images) - inicio,
+                       "megapixeles": round(acumulado, 3)})
+    return chunks
+
+def prescan(zip_path, chunk_megapixels=None):
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_path) as zf, open(zip_path, 'rb') as fp:
+        archivos = [info for info in zf.infolist() if not info.is_dir()]
+        images = [escanear_miembro(zf, fp, info) for info in archivos if es_imagen_valida(info.filename)]
+    elapsed = time.perf_counter() - start
+
+    corruptas = sum(1 for imagen in images if imagen["corrupto"])
+    total_mp = sum(imagen["megapixeles"] or 0.0 for imagen in images)
+    print(f"🔎 Pre-escaneo: {len(images)} imágenes, {corruptas} corruptas, {total_mp:.1f} MP en {elapsed:.2f}s",
+          file=sys.stderr)
+
+    result = {
+        "total_files": len(archivos),
+        "valid_images": len(images),
+        "images": images,
+        "prescan": {
+            "corruptas": corruptas,
+            "rotadas": sum(1 for imagen in images if imagen["rotar"]),
+            "sin_trailer": sum(1 for imagen in images if imagen["trailer"] is False),
+            "total_megapixeles": round(total_mp, 3),
+            "segundos": round(elapsed, 3),
+            "archivos_por_segundo": round(len(images) / elapsed, 1) if elapsed > 0 else None,
+        },
+    }
+    if chunk_megapixels:
+        result["chunks"] = agrupar_por_pixeles(images, chunk_megapixels)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Dimensiones y corrupción de las imágenes de un ZIP leyendo solo cabeceras')
+    parser.add_argument('zip_path', help='Archivo ZIP')
+    parser.add_argument('--chunk-megapixels', type=float, default=None,
+                        help='Presupuesto de megapíxeles por chunk (añade "chunks" al resultado)')
+    args = parser.parse_args()
+
+    try:
+        print(json.dumps(prescan(args.zip_path, args.chunk_megapixels), ensure_ascii=True))
+    except Exception as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=True))
+        traceback.print_exc()
+        sys.exit(1)